@@ -1,13 +1,15 @@
 import os
+import queue
+import time
 from datetime import datetime
 
 import streamlit as st
 from PIL import Image
 
-from src.rag_index import build_lore_index
-from src.rag_prompting import rag_enrich_image_prompt
-from src.image_gen import generate_image
-from src.story_from_image import generate_story_from_image
+from src.archive import DEFAULT_STORY_DIR, archive_upload, get_archive_writer
+from src.jobs import FINISHED_STATUSES, JobManager
+from src.model_registry import DEFAULT_PRELOAD
+from src.tracing import METRICS_PORT, start_metrics_server
 
 
 
@@ -16,6 +18,135 @@ st.set_page_config(
     layout="wide",
 )
 
+
+@st.cache_resource(show_spinner="Starting model workers...")
+def get_job_manager():
+    """
+    One job manager per server process; its worker processes load and warm up
+    the models once, and Streamlit reruns reuse them.
+    With $METRICS_PORT set, the workers' stage metrics are served at /metrics.
+    """
+    manager = JobManager(preload=DEFAULT_PRELOAD)
+    start_metrics_server(METRICS_PORT, render=manager.metrics_text)
+    return manager
+
+
+jobs = get_job_manager()
+
+# Seconds between progress refreshes of a running job
+UI_POLL_SECONDS = float(os.environ.get("UI_POLL_SECONDS", "1"))
+# Seconds (from submission) after which the UI gives up on a job and cancels it
+UI_JOB_TIMEOUT_SECONDS = float(os.environ.get("UI_JOB_TIMEOUT_SECONDS", "1800"))
+
+
+def give_up_if_overdue(record: dict, timeout: float = UI_JOB_TIMEOUT_SECONDS) -> dict:
+    """
+    Cancels an unfinished job older than timeout seconds and returns its
+    record as 'timed out'; returns other records unchanged.
+    """
+    if record["status"] in FINISHED_STATUSES or time.time() - record["queued_at"] < timeout:
+        return record
+    jobs.cancel(record["id"])
+    return {**record, "status": "timed out", "error": f"no result after {timeout:.0f}s"}
+
+
+def wait_for_job(job_id: str, on_update=None, poll_interval: float = 0.3, timeout: float = UI_JOB_TIMEOUT_SECONDS) -> dict:
+    """
+    Polls a job until it finishes (or times out, see give_up_if_overdue),
+    calling on_update(record) on every poll.
+    """
+    while True:
+        record = give_up_if_overdue(jobs.status(job_id), timeout)
+        if on_update is not None:
+            on_update(record)
+        if record["status"] in FINISHED_STATUSES + ("timed out",):
+            return record
+        time.sleep(poll_interval)
+
+
+def show_timings(record: dict):
+    """
+    Per-stage timing breakdown of a finished job.
+    """
+    st.caption(f"Queued {record['wait_seconds']:.1f}s, ran {record['run_seconds']:.1f}s")
+    timings = record["result"].get("timings")
+    if timings:
+        with st.expander("Timing breakdown"):
+            st.dataframe(timings, use_container_width=True)
+
+
+def is_finished(job: dict) -> bool:
+    """
+    True once a session's job has finished; the final record is kept in the
+    session so later reruns render it without asking the workers again.
+    """
+    if "record" not in job:
+        record = give_up_if_overdue(jobs.status(job["id"]))
+        if record["status"] not in FINISHED_STATUSES + ("timed out",):
+            return False
+        job["record"] = record
+    return True
+
+
+def show_enriched_prompt(record: dict):
+    if record.get("enriched_prompt"):
+        st.markdown(f"**Enriched image prompt:**\n\n{record['enriched_prompt']}")
+
+
+@st.fragment(run_every=UI_POLL_SECONDS)
+def show_image_progress(job: dict):
+    """
+    Live view of a running image job (step i/N with ETA, latent previews).
+    Only this fragment reruns while polling; the rest of the page stays usable.
+    """
+    if is_finished(job):
+        # Full rerun: renders the result and stops the polling
+        st.rerun()
+
+    record = jobs.status(job["id"])
+    show_enriched_prompt(record)
+    progress = record.get("progress")
+    if progress is None:
+        label = "Waiting for a worker..." if record["status"] == "queued" else "Enriching prompt with lore..."
+        st.progress(0.0, text=label)
+    else:
+        st.progress(
+            progress["step"] / progress["total_steps"],
+            text=f"Diffusion step {progress['step']}/{progress['total_steps']}, "
+            f"about {progress['eta_seconds']:.0f}s left",
+        )
+    if record.get("previews"):
+        st.image(record["previews"], caption=["Preview"] * len(record["previews"]), width=256)
+    if st.button("Cancel", key=f"cancel_{job['id']}"):
+        jobs.cancel(job["id"])
+
+
+def show_image_result(job: dict):
+    record = job["record"]
+    if record["status"] != "done":
+        st.error(f"Image job {record['status']}: {record.get('error', '')}")
+        return
+
+    show_enriched_prompt(record["result"])
+    saved_paths = record["result"]["image_paths"]
+    st.success("Image(s) generated and saved to: " + ", ".join(f"`{p}`" for p in saved_paths))
+    show_timings(record)
+
+    # Display image(s)
+    columns = st.columns(len(saved_paths))
+    for column, saved_path in zip(columns, saved_paths):
+        try:
+            img = Image.open(saved_path)
+            column.image(img, caption="Generated Image", use_column_width=True)
+        except Exception as e:
+            column.error(f"Could not load generated image: {e}")
+
+
+with st.sidebar:
+    st.markdown("### Workers")
+    st.write("Ready ✅" if jobs.is_ready() else "Workers still loading models ⏳")
+    st.json(jobs.workers(), expanded=False)
+
 st.title("🕵️‍♂️🔭 RAG Multimodal Story & Image Generator")
 
 tab1, tab2 = st.tabs(["Text → Image (RAG)", "Image → Story (RAG)"])
@@ -35,39 +166,52 @@ with tab1:
         height=100,
     )
 
+    num_variants = st.number_input(
+        "Number of variants",
+        min_value=1,
+        max_value=4,
+        value=1,
+        help="All variants come from the same enriched prompt, with different seeds.",
+    )
+
+    fresh_prompt = st.checkbox(
+        "Fresh sample",
+        key="fresh_prompt",
+        help="Write a new enriched prompt instead of reusing the cached one for this prompt.",
+    )
+
     generate_button = st.button("Generate Image", type="primary")
 
+    # The render runs in a worker process; the session only keeps its job id,
+    # so reruns (any widget change) neither lose it nor start another one
+    image_job = st.session_state.get("image_job")
     if generate_button:
         if not user_prompt.strip():
             st.warning("Please enter a prompt first.")
+        elif image_job is not None and not is_finished(image_job):
+            st.info("An image is already being generated for this session; it is shown below.")
         else:
-            with st.spinner("Building lore index and enriching prompt..."):
-                # Ensure lore index exists
-                build_lore_index("data/lore")
-
-                # RAG + LLM enriched prompt
-                enriched_prompt = rag_enrich_image_prompt(user_prompt)
-
-            st.markdown("**Enriched image prompt:**")
-            st.write(enriched_prompt)
-
-            # Generate image
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"ui_rag_image_{timestamp}.png"
-            out_path = os.path.join("outputs", "images", filename)
-
-            with st.spinner("Generating image with Stable Diffusion..."):
-                    saved_path = generate_image(enriched_prompt, output_path=out_path)
-
-            st.success(f"Image generated and saved to: `{saved_path}`")
-
-            # Display image
             try:
-                img = Image.open(saved_path)
-                st.image(img, caption="Generated Image", use_column_width=True)
-            except Exception as e:
-                st.error(f"Could not load generated image: {e}")
-
+                job_id = jobs.submit(
+                    "text_to_image",
+                    {
+                        "prompt": user_prompt,
+                        "num_variants": int(num_variants),
+                        "filename_prefix": f"ui_rag_image_{timestamp}",
+                        "use_cache": not fresh_prompt,
+                    },
+                )
+            except queue.Full:
+                st.warning("Too many requests in the queue right now, please try again shortly.")
+            else:
+                image_job = st.session_state["image_job"] = {"id": job_id, "prompt": user_prompt}
+
+    if image_job is not None:
+        if is_finished(image_job):
+            show_image_result(image_job)
+        else:
+            show_image_progress(image_job)
 
 with tab2:
     st.subheader("Image → Story (with RAG + caption)")
@@ -83,72 +227,67 @@ with tab2:
         accept_multiple_files=False,
     )
 
+    fresh_story = st.checkbox(
+        "Fresh sample",
+        key="fresh_story",
+        help="Write a new story instead of reusing the cached one for this image.",
+    )
+
     generate_story_btn = st.button("Generate Story")
 
     if generate_story_btn:
         if uploaded_file is None:
             st.warning("Please upload an image first.")
         else:
-            # Save the uploaded file
-            os.makedirs("outputs/uploaded", exist_ok=True)
+            # The encoded upload is used as is: shown by the browser, archived in the
+            # background under its content hash, and decoded once, in the worker
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_path = os.path.join(
-                "outputs",
-                "uploaded",
-                f"uploaded_{timestamp}.png",
-            )
+            image_bytes = uploaded_file.getvalue()
+            upload_path = archive_upload(image_bytes)
 
-            image = Image.open(uploaded_file).convert("RGB")
-            image.save(temp_path)
+            st.image(image_bytes, caption="Uploaded Image", use_column_width=True)
 
-            st.image(image, caption="Uploaded Image", use_column_width=True)
+            try:
+                job_id = jobs.submit("image_to_story", {"image": image_bytes, "use_cache": not fresh_story})
+            except queue.Full:
+                st.warning("Too many requests in the queue right now, please try again shortly.")
+                st.stop()
 
-            with st.spinner("Building lore index (if needed) and generating story..."):
-                build_lore_index("data/lore")
+            st.markdown("### Caption")
+            caption_box = st.empty()
+            st.markdown("### Story")
+            story_box = st.empty()
 
-                try:
-                    result = generate_story_from_image(temp_path)
-                except Exception as e:
-                    st.error(f"Error inside generate_story_from_image: {e}")
-                    st.stop()
+            def show_progress(record):
+                if record.get("caption"):
+                    caption_box.write(record["caption"])
+                if record.get("partial_story"):
+                    # Tokens appear as the worker generates them
+                    story_box.markdown(record["partial_story"])
 
-            # Debug safety: show what we actually got
-            if not isinstance(result, dict):
-                st.error(f"generate_story_from_image returned {type(result)} instead of dict.")
-                st.write("Raw result:")
-                st.write(result)
-                st.stop()
+            with st.spinner("Captioning, retrieving lore and writing the story..."):
+                record = wait_for_job(job_id, on_update=show_progress)
 
-            if "caption" not in result or "story" not in result:
-                st.error("Result dict is missing 'caption' or 'story' keys.")
-                st.write("Result keys:", list(result.keys()))
+            if record["status"] != "done":
+                st.error(f"Story job {record['status']}: {record.get('error', '')}")
                 st.stop()
 
+            result = record["result"]
             caption = result["caption"]
             story = result["story"]
-
-            st.markdown("### Caption")
-            st.write(caption)
-
-            st.markdown("### Story")
-            st.text_area(
-                "Generated Story",
-                value=story,
-                height=300,
+            caption_box.write(caption)
+            story_box.markdown(story)
+            show_timings(record)
+
+            story_file = os.path.join(DEFAULT_STORY_DIR, f"ui_story_{timestamp}.txt")
+            archive = get_archive_writer()
+            archive.write_text(
+                story_file,
+                f"IMAGE PATH:\n{upload_path}\n\nCAPTION:\n{caption}\n\nSTORY:\n{story}",
             )
 
-            os.makedirs("outputs/stories", exist_ok=True)
-            story_file = os.path.join(
-                "outputs",
-                "stories",
-                f"ui_story_{timestamp}.txt",
-            )
-            with open(story_file, "w", encoding="utf-8") as f:
-                f.write("IMAGE PATH:\n")
-                f.write(temp_path + "\n\n")
-                f.write("CAPTION:\n")
-                f.write(caption + "\n\n")
-                f.write("STORY:\n")
-                f.write(story)
-
-            st.success(f"Story saved to: `{story_file}`")
+            # Written in the background: the file may not exist yet, and may still fail
+            st.success(f"Story queued for saving to: `{story_file}`")
+            errors = archive.stats()["errors"]
+            if errors:
+                st.warning(f"{errors} archive write(s) have failed since the server started; see the server log.")
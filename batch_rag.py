@@ -0,0 +1,49 @@
+import argparse
+
+from src.batch import run_batch
+from src.rag_index import build_lore_index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Headless bulk runs: image -> story over a directory of images, "
+        "text -> image (or image -> story) over a JSONL file. Rerun with the same --output to resume."
+    )
+    parser.add_argument("source", help="Directory of images, or a .jsonl file with one {'prompt': ...} or {'image': ...} per line.")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to (also the resume checkpoint).")
+    parser.add_argument("--lore-dir", default="data/lore", help="Directory with lore .txt files.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Items per pipeline batch (one batched LLM call each).")
+    parser.add_argument("--caption-batch-size", type=int, default=8, help="Images per captioning pass.")
+    parser.add_argument("--top-k", type=int, default=3, help="Lore chunks retrieved per item.")
+    parser.add_argument("--max-new-tokens", type=int, default=400, help="Story length limit in tokens.")
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--variants", type=int, default=1, help="Images generated per prompt.")
+    parser.add_argument("--sd-batch-size", type=int, default=2, help="Images per Stable Diffusion pass.")
+    parser.add_argument("--image-dir", default="outputs/images/batch", help="Where generated images are saved.")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many pending items.")
+    args = parser.parse_args()
+
+    # Unchanged lore just opens the shared index snapshot
+    build_lore_index(args.lore_dir)
+
+    stats = run_batch(
+        args.source,
+        args.output,
+        batch_size=args.batch_size,
+        top_k=args.top_k,
+        max_new_tokens=args.max_new_tokens,
+        temperature=args.temperature,
+        num_variants=args.variants,
+        sd_batch_size=args.sd_batch_size,
+        caption_batch_size=args.caption_batch_size,
+        image_dir=args.image_dir,
+        limit=args.limit,
+    )
+    print(
+        f"✅ {stats['written']} results written to {args.output} in {stats['seconds']:.0f}s "
+        f"({stats['failed']} failed, {stats['skipped']} already done)."
+    )
+
+
+if __name__ == "__main__":
+    main()
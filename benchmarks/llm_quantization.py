@@ -0,0 +1,199 @@
+"""
+Compares LLM quantization modes (see src.quantization.QUANTIZATION_MODES)
+against the fp32 baseline: weight memory, RSS, greedy tokens/sec and output
+drift on a fixed prompt set.
+
+Each mode runs in its own subprocess so RSS is measured per mode. The fp32
+run goes first and saves its greedy completions; the other modes are then
+scored on them:
+- greedy_match:   share of prompts whose greedy completion is identical
+- top1_agreement: share of completion positions where the quantized model's
+                  next-token argmax equals the fp32 token (teacher forced)
+- nll_delta:      increase in mean negative log-likelihood of the fp32
+                  completions (0 for fp32 itself)
+
+Usage (from the repo root):
+
+    python -m benchmarks.llm_quantization --models real
+    python -m benchmarks.llm_quantization --modes none int8 int4 --max-new-tokens 32
+"""
+import os
+import tempfile
+
+_WORK_DIR = tempfile.mkdtemp(prefix="rag_bench_quant_")
+os.environ["RESULT_CACHE"] = "0"
+os.environ.setdefault("TRACE_LOG_PATH", "")
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from src.quantization import QUANTIZATION_MODES
+
+PROMPTS = [
+    "a detective on a rainy rooftop, watching the neon city below",
+    "an abandoned data vault under Sector-9, flooded and flickering",
+    "a street market selling black-market memory chips at midnight",
+    "a corporate tower lobby with holographic guards",
+    "an informant waiting in a noodle bar as the rain starts",
+    "a chase through the maintenance tunnels of the old transit line",
+]
+
+
+def _load(mode: str, models: str):
+    import src.text_llm as text_llm
+    from src.quantization import quantize_model
+
+    if models == "standin":
+        from benchmarks.standins import install_standins
+
+        install_standins(_WORK_DIR, ["llm"])
+        quantize_model(text_llm._LLM_MODEL, mode)
+        text_llm._LLM_QUANTIZATION = mode
+        return text_llm.load_llm()
+    return text_llm.load_llm(quantization=mode, device="cpu")
+
+
+def run_single(mode: str, models: str, max_new_tokens: int, reference_path: str, save_reference: bool) -> Dict[str, Any]:
+    import torch
+    import torch.nn.functional as F
+
+    from src.quantization import model_size_mb
+    from src.rag_prompting import IMAGE_PROMPT_SYSTEM_PROMPT
+    from src.text_llm import _prepare_inputs
+    from src.tracing import peak_rss_mb, rss_mb
+
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    model, tokenizer = _load(mode, models)
+    load_seconds = time.perf_counter() - start
+
+    inputs = [
+        _prepare_inputs(model, tokenizer, IMAGE_PROMPT_SYSTEM_PROMPT, prompt, use_prefix_cache=False)
+        for prompt in PROMPTS
+    ]
+
+    def greedy(input_ids, generate_kwargs, n_tokens):
+        with torch.no_grad():
+            return model.generate(
+                input_ids=input_ids,
+                max_new_tokens=n_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id,
+                **generate_kwargs,
+            )[0, input_ids.shape[1]:].tolist()
+
+    greedy(*inputs[0], 4)  # warm-up
+
+    completions = []
+    tokens = 0
+    seconds = 0.0
+    for input_ids, generate_kwargs in inputs:
+        start = time.perf_counter()
+        completion = greedy(input_ids, generate_kwargs, max_new_tokens)
+        seconds += time.perf_counter() - start
+        tokens += len(completion)
+        completions.append(completion)
+
+    if save_reference:
+        with open(reference_path, "w", encoding="utf-8") as f:
+            json.dump(completions, f)
+    with open(reference_path, "r", encoding="utf-8") as f:
+        reference = json.load(f)
+
+    # Teacher-forced scoring of the fp32 completions
+    matches = agree = positions = 0
+    nll = 0.0
+    for (input_ids, _), completion, ref in zip(inputs, completions, reference):
+        matches += completion == ref
+        if not ref:
+            continue
+        ref_ids = torch.tensor([ref], dtype=input_ids.dtype)
+        with torch.no_grad():
+            logits = model(input_ids=torch.cat([input_ids, ref_ids], dim=1)).logits[0].float()
+        # Position i predicts token i + 1
+        predicted = logits[input_ids.shape[1] - 1:-1]
+        agree += int((predicted.argmax(dim=-1) == ref_ids[0]).sum())
+        nll += float(F.cross_entropy(predicted, ref_ids[0], reduction="sum"))
+        positions += len(ref)
+
+    return {
+        "mode": mode,
+        "weights_mb": round(model_size_mb(model), 1),
+        "rss_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "load_seconds": round(load_seconds, 2),
+        "tokens": tokens,
+        "tokens_per_second": round(tokens / seconds, 2) if seconds else None,
+        "greedy_match": round(matches / len(PROMPTS), 3),
+        "top1_agreement": round(agree / positions, 4) if positions else None,
+        "mean_nll": round(nll / positions, 4) if positions else None,
+    }
+
+
+def _with_baseline(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    baseline: Optional[Dict[str, Any]] = next((r for r in results if r["mode"] == "none"), None)
+    for r in results:
+        if baseline is None:
+            break
+        r["weights_saved_mb"] = round(baseline["weights_mb"] - r["weights_mb"], 1)
+        r["rss_saved_mb"] = round(baseline["rss_mb"] - r["rss_mb"], 1)
+        if r["mean_nll"] is not None and baseline["mean_nll"] is not None:
+            r["nll_delta"] = round(r["mean_nll"] - baseline["mean_nll"], 4)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LLM quantization modes: memory, tokens/sec and drift vs fp32.")
+    parser.add_argument("--modes", nargs="+", default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument("--models", choices=("standin", "real"), default="standin",
+                        help="Tiny random stand-in LLM (offline, default) or the real one.")
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    parser.add_argument("--reference", help=argparse.SUPPRESS)
+    parser.add_argument("--save-reference", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.models, args.max_new_tokens, args.reference, args.save_reference)))
+        return
+
+    reference_path = os.path.join(_WORK_DIR, "fp32_completions.json")
+    # fp32 always runs (first): its completions are the drift reference
+    modes = ["none"] + [mode for mode in args.modes if mode != "none"]
+
+    results = []
+    for mode in modes:
+        print(f"[*] Benchmarking LLM quantization '{mode}'...")
+        cmd = [sys.executable, "-m", "benchmarks.llm_quantization", "--single", mode, "--models", args.models,
+               "--max-new-tokens", str(args.max_new_tokens), "--reference", reference_path]
+        if mode == "none":
+            cmd.append("--save-reference")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"    failed:\n{proc.stderr[-2000:]}")
+            if mode == "none":
+                return
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    _with_baseline(results)
+
+    print(f"\n{'mode':<13} {'weights MB':>10} {'saved MB':>9} {'RSS MB':>8} {'tok/s':>7} "
+          f"{'greedy=':>7} {'top1':>6} {'ΔNLL':>7}")
+    for r in results:
+        print(f"{r['mode']:<13} {r['weights_mb']:>10} {r.get('weights_saved_mb', 0):>9} {r['rss_mb']:>8} "
+              f"{str(r['tokens_per_second']):>7} {r['greedy_match']:>7} {str(r['top1_agreement']):>6} "
+              f"{str(r.get('nll_delta', '')):>7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compares Stable Diffusion inference profiles (see src.image_gen.SD_PROFILES).
+
+Each profile runs in its own subprocess so that peak RSS is measured per
+profile rather than for the whole benchmark. Usage (from the repo root):
+
+    python -m benchmarks.sd_profiles --profiles default fast_cpu --images 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.image_gen import SD_PROFILES
+from src.tracing import peak_rss_mb
+
+PROMPT = "a detective on a rainy rooftop, watching a neon city below, cinematic, noir"
+
+
+def run_single(profile: str, images: int, seed: int) -> dict:
+    from src.image_gen import load_sd_pipeline, generate_image, get_sd_profile
+
+    start = time.perf_counter()
+    load_sd_pipeline(profile=profile)
+    load_seconds = time.perf_counter() - start
+
+    timings = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        # First image includes one-off warm-up costs; reported separately
+        for i in range(images + 1):
+            start = time.perf_counter()
+            generate_image(PROMPT, output_path=os.path.join(out_dir, f"{i}.png"), seed=seed + i, profile=profile)
+            timings.append(time.perf_counter() - start)
+
+    steady = timings[1:]
+    return {
+        "profile": profile,
+        "steps": get_sd_profile(profile)["num_inference_steps"],
+        "load_seconds": round(load_seconds, 2),
+        "first_image_seconds": round(timings[0], 2),
+        "seconds_per_image": round(sum(steady) / len(steady), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Stable Diffusion profiles: seconds/image and peak RSS.")
+    parser.add_argument("--profiles", nargs="+", default=sorted(SD_PROFILES), choices=sorted(SD_PROFILES))
+    parser.add_argument("--images", type=int, default=2, help="Timed images per profile (after one warm-up image).")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.images, args.seed)))
+        return
+
+    results = []
+    for profile in args.profiles:
+        print(f"[*] Benchmarking profile '{profile}'...")
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.sd_profiles", "--single", profile,
+             "--images", str(args.images), "--seed", str(args.seed)],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(f"    failed:\n{proc.stderr[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"\n{'profile':<10} {'steps':>5} {'load s':>8} {'s/image':>8} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['profile']:<10} {r['steps']:>5} {r['load_seconds']:>8} {r['seconds_per_image']:>8} {r['peak_rss_mb']:>12}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Per-stage benchmarks of the RAG pipelines, runnable offline.
+
+By default every stage runs on tiny randomly initialised stand-ins of the
+real models (see benchmarks/standins.py), so the numbers track the cost of
+our own code paths and can be compared between commits on the same machine.
+Use --models real to benchmark the actual models instead. Usage (from the
+repo root):
+
+    python -m benchmarks.stages
+    python -m benchmarks.stages --stages retrieval llm --corpus-sizes 1000 10000
+    python -m benchmarks.stages --compare benchmarks/results/stages_20250101_120000.json
+
+Stages:
+- index:     load_and_chunk_lore + embed_texts throughput (chunks/sec)
+- retrieval: retrieve_lore p50/p95 latency at growing synthetic corpus sizes
+- caption:   caption_image / caption_images images/sec
+- llm:       generate_text tokens/sec
+- sd:        generate_image seconds per denoising step
+"""
+import os
+import tempfile
+
+# Keep benchmark runs out of the persistent caches and the stage log; these are
+# read when the src modules are imported
+_WORK_DIR = tempfile.mkdtemp(prefix="rag_bench_")
+os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(_WORK_DIR, "embedding_cache"))
+os.environ["RESULT_CACHE"] = "0"
+os.environ.setdefault("TRACE_LOG_PATH", "")
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from src.vector_store import DEFAULT_BACKEND
+
+STAGES = ("index", "retrieval", "caption", "llm", "sd")
+
+# Metrics where a larger value is better; everything else is a latency
+_HIGHER_IS_BETTER = ("per_second",)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def _timed(fn: Callable[[], Any], repeats: int) -> List[float]:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _lore_vocabulary(lore_dir: str = "data/lore") -> List[str]:
+    words = []
+    if os.path.isdir(lore_dir):
+        from src.lore_loader import load_lore_texts
+
+        for text in load_lore_texts(lore_dir):
+            words.extend(text.split())
+    return sorted(set(words)) or ["neon", "rain", "detective", "city", "signal", "shadow"]
+
+
+def _synthetic_docs(rng: random.Random, vocabulary: List[str], n: int, words_per_doc: int) -> List[str]:
+    return [" ".join(rng.choices(vocabulary, k=words_per_doc)) for _ in range(n)]
+
+
+def bench_index(args, rng: random.Random, vocabulary: List[str]) -> Dict[str, Any]:
+    from src.embedings import embed_texts
+    from src.lore_loader import load_and_chunk_lore
+
+    lore_dir = os.path.join(_WORK_DIR, "lore")
+    os.makedirs(lore_dir, exist_ok=True)
+    # Files of a few chunks each, like the real lore files
+    words_per_file = 4 * 150
+    n_files = max(1, args.index_chunks // 4)
+    for i, text in enumerate(_synthetic_docs(rng, vocabulary, n_files, words_per_file)):
+        with open(os.path.join(lore_dir, f"synthetic_{i:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    start = time.perf_counter()
+    chunks = load_and_chunk_lore(lore_dir)
+    chunk_seconds = time.perf_counter() - start
+
+    embed_texts(chunks[:8], use_cache=False)  # warm-up
+    start = time.perf_counter()
+    embed_texts(chunks, use_cache=False)
+    embed_seconds = time.perf_counter() - start
+
+    return {
+        "files": n_files,
+        "chunks": len(chunks),
+        "chunk_seconds": round(chunk_seconds, 4),
+        "embed_seconds": round(embed_seconds, 4),
+        "chunks_per_second": round(len(chunks) / (chunk_seconds + embed_seconds), 2),
+    }
+
+
+def bench_retrieval(args, rng: random.Random, vocabulary: List[str]) -> Dict[str, Any]:
+    import src.rag_index as rag_index
+    from src.embedings import get_embedding_model
+    from src.lexical_index import BM25Index
+    from src.vector_store import open_lore_store
+
+    dim = get_embedding_model().get_sentence_embedding_dimension()
+    np_rng = np.random.default_rng(args.seed)
+    queries = [" ".join(rng.choices(vocabulary, k=8)) for _ in range(args.queries)]
+
+    results = {
+        "backend": args.backend,
+        "mode": rag_index.RETRIEVAL_MODE,
+        "top_k": args.top_k,
+        "queries": args.queries,
+        "sizes": [],
+    }
+    for size in args.corpus_sizes:
+        # Random unit vectors stand in for embedded chunks: query cost only depends on the corpus size
+        # (the BM25 side gets real word statistics from the lore vocabulary)
+        store = open_lore_store(args.backend, f"bench_{size}", os.path.join(_WORK_DIR, "index"), reset=True)
+        lexical = BM25Index(f"bench_{size}")
+        embeddings = np_rng.standard_normal((size, dim)).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        batch = 5000
+        for start in range(0, size, batch):
+            end = min(size, start + batch)
+            ids = [f"doc_{i}" for i in range(start, end)]
+            docs = _synthetic_docs(rng, vocabulary, end - start, 60)
+            store.add(ids, docs, embeddings[start:end], [{"source": "synthetic"} for _ in ids])
+            lexical.add(ids, docs)
+        rag_index._store = store
+        rag_index._lexical = lexical
+
+        rag_index.retrieve_lore(queries[0], top_k=args.top_k)  # warm-up
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            rag_index.retrieve_lore(query, top_k=args.top_k)
+            samples.append(time.perf_counter() - start)
+        results["sizes"].append({"corpus_size": size, **_percentiles(samples)})
+        print(f"    corpus {size:>7}: {results['sizes'][-1]}")
+
+    rag_index._store = None
+    rag_index._lexical = None
+    return results
+
+
+def bench_caption(args, rng: random.Random, vocabulary: List[str]) -> Dict[str, Any]:
+    from PIL import Image
+
+    from src.image_caption import caption_image, caption_images
+
+    np_rng = np.random.default_rng(args.seed)
+    images = [
+        Image.fromarray(np_rng.integers(0, 256, (384, 384, 3), dtype=np.uint8))
+        for _ in range(args.images)
+    ]
+
+    caption_image(images[0], use_cache=False)  # warm-up
+    single = _timed(lambda: [caption_image(image, use_cache=False) for image in images], 1)[0]
+    batched = _timed(lambda: caption_images(images, batch_size=args.caption_batch_size, use_cache=False), 1)[0]
+
+    return {
+        "images": len(images),
+        "single_images_per_second": round(len(images) / single, 2),
+        "batched_images_per_second": round(len(images) / batched, 2),
+        "batch_size": args.caption_batch_size,
+    }
+
+
+def bench_llm(args, rng: random.Random, vocabulary: List[str]) -> Dict[str, Any]:
+    from src.rag_prompting import IMAGE_PROMPT_SYSTEM_PROMPT
+    from src.text_llm import generate_text
+    from src.tracing import collect_stages
+
+    user_prompts = [" ".join(rng.choices(vocabulary, k=40)) for _ in range(args.llm_prompts)]
+    generate_text(IMAGE_PROMPT_SYSTEM_PROMPT, user_prompts[0], max_new_tokens=4, use_batching=False)  # warm-up
+
+    runs = []
+    for use_prefix_cache in (False, True):
+        tokens = 0
+        seconds = 0.0
+        for i, user_prompt in enumerate(user_prompts):
+            # Generated token counts come from the llm.generate stage record
+            with collect_stages() as stages:
+                generate_text(
+                    IMAGE_PROMPT_SYSTEM_PROMPT,
+                    user_prompt,
+                    max_new_tokens=args.max_new_tokens,
+                    use_prefix_cache=use_prefix_cache,
+                    use_batching=False,
+                    seed=args.seed + i,
+                )
+            for record in stages:
+                if record["stage"] == "llm.generate":
+                    tokens += record.get("tokens", 0)
+                    seconds += record["wall_seconds"]
+        runs.append(
+            {
+                "prefix_cache": use_prefix_cache,
+                "tokens": tokens,
+                "tokens_per_second": round(tokens / seconds, 2) if seconds else None,
+            }
+        )
+
+    return {"prompts": len(user_prompts), "max_new_tokens": args.max_new_tokens, "runs": runs}
+
+
+def bench_sd(args, rng: random.Random, vocabulary: List[str]) -> Dict[str, Any]:
+    from src.image_gen import generate_image
+
+    prompt = " ".join(rng.choices(vocabulary, k=12))
+    out_path = os.path.join(_WORK_DIR, "images", "bench.png")
+    low, high = args.sd_steps
+
+    generate_image(prompt, output_path=out_path, num_inference_steps=2, seed=args.seed)  # warm-up
+    timings = {}
+    for steps in (low, high):
+        samples = _timed(
+            lambda: generate_image(prompt, output_path=out_path, num_inference_steps=steps, seed=args.seed),
+            args.sd_repeats,
+        )
+        timings[steps] = float(np.median(samples))
+
+    # The slope between two step counts excludes per-image text encoding, VAE decode and save
+    return {
+        "steps": [low, high],
+        "seconds_per_image": {str(steps): round(seconds, 4) for steps, seconds in timings.items()},
+        "seconds_per_step": round((timings[high] - timings[low]) / (high - low), 5),
+    }
+
+
+BENCHMARKS = {
+    "index": bench_index,
+    "retrieval": bench_retrieval,
+    "caption": bench_caption,
+    "llm": bench_llm,
+    "sd": bench_sd,
+}
+
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            label = item.get("corpus_size", item.get("prefix_cache", i)) if isinstance(item, dict) else i
+            _flatten(f"{prefix}[{label}]", item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Returns a line per timing/throughput metric that got worse than the
+    baseline by more than threshold (relative).
+    """
+    now, before = {}, {}
+    _flatten("", current["results"], now)
+    _flatten("", baseline["results"], before)
+
+    regressions = []
+    for key, value in sorted(now.items()):
+        old = before.get(key)
+        is_throughput = any(marker in key for marker in _HIGHER_IS_BETTER)
+        if not old or not (is_throughput or key.endswith("_ms") or "seconds" in key):
+            continue
+        change = (old - value) / old if is_throughput else (value - old) / old
+        if change > threshold:
+            regressions.append(f"{key}: {old:g} -> {value:g} ({change:+.0%} worse)")
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval, captioning, LLM and diffusion stages.")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--models", choices=("standin", "real"), default="standin",
+                        help="Tiny random stand-ins (offline, default) or the real models.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--index-chunks", type=int, default=2000)
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, help="Vector store backend for the retrieval stage.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--caption-batch-size", type=int, default=8)
+    parser.add_argument("--llm-prompts", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--sd-steps", type=int, nargs=2, default=[5, 15], metavar=("LOW", "HIGH"))
+    parser.add_argument("--sd-repeats", type=int, default=3)
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/results/stages_<timestamp>.json).")
+    parser.add_argument("--compare", help="Baseline results JSON to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    import torch
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    if args.models == "standin":
+        from benchmarks.standins import install_standins
+
+        print("[*] Building model stand-ins...")
+        install_standins(_WORK_DIR, args.stages)
+
+    vocabulary = _lore_vocabulary()
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "models": args.models,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "args": vars(args),
+        "results": {},
+    }
+
+    try:
+        for stage in args.stages:
+            print(f"[*] Benchmarking '{stage}'...")
+            # Same inputs for every stage regardless of which others run
+            rng = random.Random(args.seed)
+            report["results"][stage] = BENCHMARKS[stage](args, rng, vocabulary)
+            print(f"    {json.dumps(report['results'][stage])}")
+    finally:
+        shutil.rmtree(_WORK_DIR, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"stages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n⚠️ {len(regressions)} regression(s) vs {args.compare}:")
+            for line in regressions:
+                print(f"    {line}")
+            sys.exit(1)
+        print(f"\nNo regressions vs {args.compare} (threshold {args.threshold:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Tiny, randomly initialised stand-ins for the pipeline's models.
+
+They keep the real architectures (BERT-style sentence encoder, BLIP, Phi,
+Stable Diffusion UNet/VAE/CLIP) at toy sizes and are built entirely from
+local config objects, so benchmarks run offline and in seconds. Outputs are
+gibberish; only the code paths and their relative cost matter.
+
+install_standins() puts them into the modules' lazy-loader globals, so the
+public functions (embed_texts, caption_image, generate_text, generate_image...)
+run unchanged on top of them.
+"""
+import json
+import os
+import string
+from typing import List
+
+import torch
+
+# Module-level names the stand-ins are registered under (also used in cache keys)
+EMBEDDING_NAME = "standin/tiny-minilm"
+CAPTION_NAME = "standin/tiny-blip"
+LLM_NAME = "standin/tiny-phi"
+SD_NAME = "standin/tiny-sd"
+
+_SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def _word_piece_vocab() -> List[str]:
+    # Characters plus their continuation pieces: every input tokenizes, one token per character
+    chars = list(string.ascii_lowercase + string.digits + string.punctuation)
+    return _SPECIAL_TOKENS + chars + [f"##{c}" for c in chars]
+
+
+def _bert_tokenizer(work_dir: str):
+    from transformers import BertTokenizer
+
+    vocab_path = os.path.join(work_dir, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(_word_piece_vocab()) + "\n")
+    return BertTokenizer(vocab_path)
+
+
+def build_embedding_model(work_dir: str):
+    """
+    2-layer BERT encoder + mean pooling as a SentenceTransformer (dim 64).
+    """
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel
+
+    model_dir = os.path.join(work_dir, "embedding")
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = _bert_tokenizer(model_dir)
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=128,
+        max_position_embeddings=512,
+    )
+    BertModel(config).save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+
+    # Chunking sizes chunks with the embedding tokenizer: serve the stand-in's
+    import src.lore_loader as lore_loader
+    from transformers import AutoTokenizer
+
+    lore_loader._tokenizers[lore_loader.DEFAULT_TOKENIZER] = AutoTokenizer.from_pretrained(model_dir)
+
+    transformer = models.Transformer(model_dir, max_seq_length=256)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+    return SentenceTransformer(modules=[transformer, pooling], device="cpu")
+
+
+def build_caption_model(work_dir: str):
+    """
+    BLIP with a 2-layer 64x64 vision tower and a 2-layer text decoder.
+    """
+    from transformers import (
+        BlipConfig,
+        BlipForConditionalGeneration,
+        BlipImageProcessor,
+        BlipProcessor,
+    )
+
+    tokenizer = _bert_tokenizer(work_dir)
+    tokenizer.bos_token = "[CLS]"
+    config = BlipConfig(
+        vision_config={
+            "hidden_size": 64,
+            "intermediate_size": 128,
+            "num_hidden_layers": 2,
+            "num_attention_heads": 4,
+            "image_size": 64,
+            "patch_size": 16,
+        },
+        text_config={
+            "vocab_size": tokenizer.vocab_size,
+            "hidden_size": 64,
+            "intermediate_size": 128,
+            "num_hidden_layers": 2,
+            "num_attention_heads": 4,
+            "encoder_hidden_size": 64,
+            "bos_token_id": tokenizer.cls_token_id,
+            "sep_token_id": tokenizer.sep_token_id,
+            "pad_token_id": tokenizer.pad_token_id,
+        },
+    )
+    model = BlipForConditionalGeneration(config).eval()
+    processor = BlipProcessor(
+        image_processor=BlipImageProcessor(size={"height": 64, "width": 64}),
+        tokenizer=tokenizer,
+    )
+    return model, processor
+
+
+def build_llm(work_dir: str):
+    """
+    2-layer Phi causal LM (hidden 128) with a character-level tokenizer.
+    """
+    from transformers import PhiConfig, PhiForCausalLM
+
+    tokenizer = _bert_tokenizer(work_dir)
+    tokenizer.eos_token = "[SEP]"
+    config = PhiConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=128,
+        intermediate_size=256,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        max_position_embeddings=2048,
+        eos_token_id=tokenizer.sep_token_id,
+        bos_token_id=tokenizer.cls_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    model = PhiForCausalLM(config).eval()
+    return model, tokenizer
+
+
+def _clip_tokenizer(work_dir: str):
+    # Byte-level BPE vocabulary without merges: one token per character
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    chars = list(bytes_to_unicode().values())
+    vocab = chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"]
+    vocab_path = os.path.join(work_dir, "clip_vocab.json")
+    merges_path = os.path.join(work_dir, "clip_merges.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        json.dump({token: i for i, token in enumerate(vocab)}, f)
+    with open(merges_path, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_path, merges_path)
+
+
+def build_sd_pipeline(work_dir: str):
+    """
+    Stable Diffusion pipeline with a 2-level UNet (32/64 channels), a 2-level
+    VAE and a small CLIP text encoder; generates 64x64 images.
+    """
+    from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    tokenizer = _clip_tokenizer(work_dir)
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+    )
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            max_position_embeddings=tokenizer.model_max_length,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    )
+    return StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=PNDMScheduler(skip_prk_steps=True),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    ).to("cpu")
+
+
+def install_standins(work_dir: str, stages: List[str]):
+    """
+    Builds the stand-ins needed by the given benchmark stages and registers
+    them in the modules' globals, as if their lazy loaders had run.
+    """
+    torch.manual_seed(0)
+
+    if {"index", "retrieval"} & set(stages):
+        import src.embedings as embedings
+
+        embedings._embedding_model = build_embedding_model(work_dir)
+        embedings._embedding_model_name = EMBEDDING_NAME
+
+    if "caption" in stages:
+        import src.image_caption as image_caption
+
+        image_caption._caption_model, image_caption._caption_processor = build_caption_model(work_dir)
+        image_caption._caption_model_name = CAPTION_NAME
+
+    if "llm" in stages:
+        import src.text_llm as text_llm
+
+        text_llm._LLM_MODEL, text_llm._LLM_TOKENIZER = build_llm(work_dir)
+        text_llm._LLM_MODEL_NAME = LLM_NAME
+
+    if "sd" in stages:
+        import src.image_gen as image_gen
+
+        pipe = build_sd_pipeline(work_dir)
+        # Serve every profile from the stand-in; profile tweaks are not applied
+        for profile in image_gen.SD_PROFILES:
+            image_gen._sd_pipelines[profile] = pipe
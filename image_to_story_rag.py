@@ -1,15 +1,21 @@
 import os
+import time
 from datetime import datetime
 
-from src.rag_index import build_lore_index
-from src.story_from_image import generate_story_from_image
+from src.jobs import FINISHED_STATUSES, JobManager
+from src.model_registry import DEFAULT_PRELOAD
 
 
 def main():
-    # 1) Ensure lore index is built
-    print("[*] Building lore index (if not already built)...")
-    build_lore_index("data/lore")
+    # 1) Sync the lore index (blocking), then start a worker that loads the
+    #    story models in the background while we wait for input
+    print("[*] Syncing the lore index and starting the worker (models load in the background)...")
+    preload = [name for name in DEFAULT_PRELOAD if name != "sd"]
+    with JobManager(num_workers=1, preload=preload) as jobs:
+        run_story_job(jobs)
 
+
+def run_story_job(jobs: JobManager):
     # 2) Get image path from user
     image_path = input("Enter the path to the image file: ").strip()
     if not image_path:
@@ -20,18 +26,38 @@ def main():
         print(f"File not found: {image_path}")
         return
 
-    # 3) Generate story
+    # 3) Generate story in the worker, printing it as it is written
     print("\n[*] Generating story from image (caption + RAG + LLM)...")
-    result = generate_story_from_image(image_path)
+    job_id = jobs.submit("image_to_story", {"image": image_path})
+
+    shown_caption = False
+    printed = 0
+    while True:
+        record = jobs.status(job_id)
+        if not shown_caption and record.get("caption"):
+            print("\n=== IMAGE CAPTION ===")
+            print(record["caption"])
+            print("\n=== STORY ===")
+            shown_caption = True
+        # The final story is stripped; leading whitespace is stripped here too so
+        # `printed` counts characters of the same text
+        partial = record.get("partial_story", "").lstrip()
+        if len(partial) > printed:
+            print(partial[printed:], end="", flush=True)
+            printed = len(partial)
+        if record["status"] in FINISHED_STATUSES:
+            break
+        time.sleep(0.2)
 
+    result = jobs.result(job_id)
     caption = result["caption"]
     story = result["story"]
-
-    print("\n=== IMAGE CAPTION ===")
-    print(caption)
-
-    print("\n=== STORY ===")
-    print(story)
+    if not shown_caption:
+        print("\n=== IMAGE CAPTION ===")
+        print(caption)
+        print("\n=== STORY ===")
+    # Whatever arrived after the last partial update
+    print(story[printed:])
 
     # 4) Save story to outputs/stories/
     os.makedirs("outputs/stories", exist_ok=True)
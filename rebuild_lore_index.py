@@ -1,5 +1,37 @@
-from src.rag_index import build_lore_index
+import argparse
+
+from src.lore_loader import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_TOKENS
+from src.rag_index import build_lore_index, DEFAULT_INDEX_DIR, DEFAULT_INGEST_BATCH_SIZE, DEFAULT_INGEST_WORKERS
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sync the persistent lore index with the lore files (only changed files are re-embedded)."
+    )
+    parser.add_argument("--lore-dir", default="data/lore", help="Directory with lore .txt files.")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Where the persistent index is stored.")
+    parser.add_argument("--force", action="store_true", help="Drop the index and re-embed every chunk.")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help="Max embedding tokens per chunk (capped at the model's 256-token limit).")
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP,
+                        help="Tokens of trailing sentences repeated at the start of the next chunk.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_INGEST_BATCH_SIZE,
+                        help="Chunks embedded and written per batch.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_INGEST_WORKERS,
+                        help="Processes reading/chunking lore files (used for large lore dirs).")
+    args = parser.parse_args()
+
+    build_lore_index(
+        args.lore_dir,
+        persist_dir=args.index_dir,
+        force=args.force,
+        chunk_tokens=args.chunk_tokens,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+    )
+    print("✅ Lore index synced with latest context.")
+
 
 if __name__ == "__main__":
-    build_lore_index("data/lore")
-    print("✅ Lore index rebuilt with latest context.")
+    main()
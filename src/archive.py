@@ -0,0 +1,118 @@
+from typing import Dict, Optional, Set
+import atexit
+import hashlib
+import os
+import queue
+import threading
+
+DEFAULT_UPLOAD_DIR = "outputs/uploaded"
+DEFAULT_STORY_DIR = "outputs/stories"
+# Pending writes before write_* calls block (keeps memory bounded under bursts)
+ARCHIVE_QUEUE_SIZE = int(os.environ.get("ARCHIVE_QUEUE_SIZE", "64"))
+
+# Leading bytes -> file extension for the upload formats we accept
+_IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpg",
+    b"RIFF": "webp",
+    b"GIF8": "gif",
+}
+
+
+class ArchiveWriter:
+    """
+    Background thread for archival writes (upload copies, story files), so
+    request handlers never wait on disk.
+
+    Writes are atomic (temp file + rename) and performed in submission order.
+    flush() blocks until everything queued so far is on disk.
+    """
+
+    def __init__(self, queue_size: int = ARCHIVE_QUEUE_SIZE):
+        self.written = 0
+        self.errors = 0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=queue_size)
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    def write_bytes(self, path: str, data: bytes, skip_existing: bool = False):
+        """
+        Queues data to be written to path. With skip_existing the write is
+        dropped if path exists or is already queued (content-addressed files).
+        """
+        with self._lock:
+            if skip_existing and (path in self._pending or os.path.exists(path)):
+                return
+            self._pending.add(path)
+        self._queue.put((path, data))
+
+    def write_text(self, path: str, text: str):
+        self.write_bytes(path, text.encode("utf-8"))
+
+    def flush(self):
+        self._queue.join()
+
+    def _loop(self):
+        while True:
+            path, data = self._queue.get()
+            try:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self.written += 1
+            except OSError as e:
+                self.errors += 1
+                print(f"[archive] Could not write {path}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(path)
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {"written": self.written, "errors": self.errors, "queued": self._queue.qsize()}
+
+
+_writer: Optional[ArchiveWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_archive_writer() -> ArchiveWriter:
+    """
+    Process-wide archive writer; queued writes are flushed at exit.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArchiveWriter()
+            atexit.register(_writer.flush)
+    return _writer
+
+
+def image_extension(data: bytes) -> str:
+    """
+    File extension matching the encoded image's format ('bin' if unknown).
+    """
+    for signature, extension in _IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return extension
+    return "bin"
+
+
+def archive_upload(data: bytes, upload_dir: str = DEFAULT_UPLOAD_DIR) -> str:
+    """
+    Queues an uploaded image for storage exactly as it was uploaded (no
+    decode or re-encode, so phone JPEGs stay JPEGs) under its content hash;
+    uploading the same image again stores nothing new.
+
+    Returns the path the upload is (or will shortly be) stored at.
+    """
+    # Same digest as image_content_hash() for encoded bytes
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(upload_dir, f"{digest[:32]}.{image_extension(data)}")
+    get_archive_writer().write_bytes(path, data, skip_existing=True)
+    return path
@@ -0,0 +1,287 @@
+from typing import Any, Dict, Iterator, List, Optional, Set
+import json
+import os
+import queue
+import threading
+import time
+
+from src.image_caption import caption_image, caption_images
+from src.lore_loader import iter_batches
+from src.rag_index import retrieve_lore_batch
+from src.rag_prompting import ENRICH_MAX_NEW_TOKENS, build_image_prompt_messages
+from src.story_from_image import build_story_messages
+from src.text_llm import generate_texts
+from src.tracing import trace_stage
+
+BATCH_TASKS = ("story", "image")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def iter_batch_inputs(source: str) -> Iterator[Dict[str, Any]]:
+    """
+    Items of a batch run, streamed from source:
+    - a directory: every image in it (recursively, sorted), id = relative path
+    - a .jsonl file: one object per line with 'prompt' (text -> image) or
+      'image' (image path -> story) and an optional 'id' (default: line number)
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+        for path in sorted(paths):
+            yield {"id": os.path.relpath(path, source), "image": path}
+        return
+
+    with open(source, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "prompt" not in item and "image" not in item:
+                raise ValueError(f"{source}:{line_no}: expected a 'prompt' or 'image' field")
+            item["id"] = str(item.get("id", line_no))
+            yield item
+
+
+def item_task(item: Dict[str, Any]) -> str:
+    return "story" if "image" in item else "image"
+
+
+def load_done_ids(output_path: str) -> Set[str]:
+    """
+    Ids already written to output_path without an error. This is the
+    checkpoint: a rerun with the same output skips them, failed items are retried.
+    """
+    done: Set[str] = set()
+    if not os.path.isfile(output_path):
+        return done
+    # errors="replace": a line cut by an interrupted run may end mid-character
+    with open(output_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line cut off by an interrupted run
+                continue
+            if "error" in record:
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+    return done
+
+
+def _open_output(output_path: str):
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # Start on a fresh line if the previous run died mid-write. The last byte is
+    # read in binary: a cut-off line can end inside a multi-byte character
+    with open(output_path, "ab+") as f:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    return open(output_path, "a", encoding="utf-8")
+
+
+def _caption_batch_items(items: List[Dict[str, Any]], caption_batch_size: int) -> List[Optional[str]]:
+    """
+    Captions for a batch; if the batch fails (e.g. an unreadable image),
+    items are captioned one by one and failed ones get an 'error'.
+    """
+    try:
+        return caption_images([item["image"] for item in items], batch_size=caption_batch_size)
+    except Exception:
+        captions: List[Optional[str]] = []
+        for item in items:
+            try:
+                captions.append(caption_image(item["image"]))
+            except Exception as e:
+                item["error"] = repr(e)
+                captions.append(None)
+        return captions
+
+
+def _prepare(task: str, items: List[Dict[str, Any]], top_k: int, max_new_tokens: int, caption_batch_size: int):
+    """
+    Front half of the pipeline (captioning, retrieval, prompt building).
+    Sets 'messages' (system, user) on every item that can go on to the LLM.
+    """
+    with trace_stage("batch.prepare", task=task, items=len(items)):
+        if task == "story":
+            queries = _caption_batch_items(items, caption_batch_size)
+            for item, caption in zip(items, queries):
+                item["caption"] = caption
+        else:
+            queries = [item["prompt"] for item in items]
+
+        ready = [(item, query) for item, query in zip(items, queries) if query is not None]
+        lore = retrieve_lore_batch([query for _, query in ready], top_k=top_k) if ready else []
+        for (item, query), lore_results in zip(ready, lore):
+            item["lore_chunks"] = [r.get("text", "") for r in lore_results]
+            if task == "story":
+                item["messages"] = build_story_messages(query, lore_results, max_new_tokens)
+            else:
+                item["messages"] = build_image_prompt_messages(query, lore_results)
+
+
+def _generate(
+    task: str,
+    items: List[Dict[str, Any]],
+    filename_prefix: str,
+    max_new_tokens: int,
+    temperature: float,
+    num_variants: int,
+    sd_batch_size: int,
+    image_dir: str,
+):
+    """
+    Back half of the pipeline: one batched LLM call for the whole batch, then
+    Stable Diffusion for text -> image items.
+    """
+    ready = [item for item in items if "messages" in item]
+    if not ready:
+        return
+    with trace_stage("batch.generate", task=task, items=len(ready)):
+        completions = generate_texts(
+            [item["messages"][0] for item in ready],
+            [item["messages"][1] for item in ready],
+            max_new_tokens=max_new_tokens if task == "story" else ENRICH_MAX_NEW_TOKENS,
+            temperature=temperature,
+        )
+        if task == "story":
+            for item, story in zip(ready, completions):
+                item["story"] = story
+            return
+
+        for item, completion in zip(ready, completions):
+            item["enriched_prompt"] = completion.replace("\n", " ").strip()
+
+        # Imported here so story runs do not need diffusers
+        from src.image_gen import generate_images
+
+        paths = generate_images(
+            [item["enriched_prompt"] for item in ready],
+            num_images_per_prompt=num_variants,
+            batch_size=sd_batch_size,
+            output_dir=image_dir,
+            filename_prefix=filename_prefix,
+        )
+        for i, item in enumerate(ready):
+            item["image_paths"] = paths[i * num_variants:(i + 1) * num_variants]
+
+
+def _record(task: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    fields = ("caption", "lore_chunks", "story") if task == "story" else ("lore_chunks", "enriched_prompt", "image_paths")
+    record = {key: value for key, value in item.items() if key != "messages"}
+    if "error" not in record and any(field not in record for field in fields):
+        record["error"] = "not generated"
+    return record
+
+
+def run_batch(
+    source: str,
+    output_path: str,
+    batch_size: int = 8,
+    top_k: int = 3,
+    max_new_tokens: int = 400,
+    temperature: float = 0.8,
+    num_variants: int = 1,
+    sd_batch_size: int = 2,
+    caption_batch_size: int = 8,
+    image_dir: str = os.path.join("outputs", "images", "batch"),
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Headless bulk run over a directory of images (image -> story) or a JSONL
+    file of prompts (text -> image) or image paths (image -> story).
+
+    Items go through in batches of batch_size, pipelined: a background thread
+    captions / retrieves / builds prompts for batch N+1 while batch N is in
+    the LLM (one batched generate() per batch) and, for prompts, Stable
+    Diffusion. Results are appended to output_path as JSON lines, one per
+    item, flushed after every batch; items already in the output are skipped,
+    so rerunning an interrupted run resumes it. Items that fail carry an
+    'error' field and are retried by the next run.
+
+    Returns run stats (items written, failed, skipped, seconds).
+    """
+    done = load_done_ids(output_path)
+    started = time.perf_counter()
+    # Image file names stay unique across resumed runs
+    run_name = time.strftime("%Y%m%d_%H%M%S")
+    stats = {"written": 0, "failed": 0, "skipped": 0}
+
+    def todo() -> Iterator[Dict[str, Any]]:
+        count = 0
+        for item in iter_batch_inputs(source):
+            if item["id"] in done:
+                stats["skipped"] += 1
+                continue
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield item
+
+    def batches() -> Iterator[List[Dict[str, Any]]]:
+        # Items of one task per batch, so each batch is one LLM (and SD) call
+        for items in iter_batches(todo(), batch_size):
+            for task in BATCH_TASKS:
+                group = [item for item in items if item_task(item) == task]
+                if group:
+                    yield group
+
+    # At most one prepared batch waits for the LLM, bounding memory
+    prepared: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=1)
+
+    def prepare_loop():
+        try:
+            for items in batches():
+                task = item_task(items[0])
+                try:
+                    _prepare(task, items, top_k, max_new_tokens, caption_batch_size)
+                except Exception as e:
+                    for item in items:
+                        item.setdefault("error", repr(e))
+                prepared.put((task, items))
+        except Exception as e:
+            # Unreadable input: stop after the batches already prepared
+            prepared.put(("error", e))
+        prepared.put(None)
+
+    preparer = threading.Thread(target=prepare_loop, name="batch-prepare", daemon=True)
+    preparer.start()
+
+    with _open_output(output_path) as out:
+        batch_no = 0
+        while True:
+            entry = prepared.get()
+            if entry is None:
+                break
+            task, items = entry
+            if task == "error":
+                # items is the exception that stopped reading the input
+                raise items
+            try:
+                _generate(task, items, f"batch_{run_name}_{batch_no:05d}", max_new_tokens, temperature, num_variants, sd_batch_size, image_dir)
+            except Exception as e:
+                for item in items:
+                    item.setdefault("error", repr(e))
+
+            for item in items:
+                record = _record(task, item)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["failed" if "error" in record else "written"] += 1
+            out.flush()
+            os.fsync(out.fileno())
+            batch_no += 1
+
+            elapsed = time.perf_counter() - started
+            processed = stats["written"] + stats["failed"]
+            print(
+                f"[batch] {processed} items ({stats['failed']} failed, {stats['skipped']} already done) "
+                f"in {elapsed:.0f}s, {processed / elapsed:.2f} items/s"
+            )
+
+    preparer.join()
+    stats["seconds"] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional, Set, Tuple
+import os
+
+from src.lexical_index import tokenize
+from src.lore_loader import split_sentences
+from src.text_llm import count_prompt_tokens, get_llm_context_window, get_llm_tokenizer
+from src.tracing import trace_stage
+
+# Upper bound on lore tokens put into a prompt, whatever room the context window leaves
+LORE_CONTEXT_TOKENS = int(os.environ.get("LORE_CONTEXT_TOKENS", "768"))
+# Slack for tokens merging across sentence / label boundaries
+_SAFETY_TOKENS = 8
+
+
+def _render(sentences: List[Tuple[int, int, str]]) -> str:
+    """
+    Formats (chunk, position, text) sentences as '[LORE i]' blocks, one per
+    chunk, numbered in output order.
+    """
+    blocks: Dict[int, List[Tuple[int, str]]] = {}
+    for chunk, position, text in sentences:
+        blocks.setdefault(chunk, []).append((position, text))
+    parts = []
+    for i, chunk in enumerate(sorted(blocks), start=1):
+        parts.append(f"[LORE {i}]\n" + " ".join(text for _, text in sorted(blocks[chunk])))
+    return "\n\n".join(parts)
+
+
+def _count(text: str) -> int:
+    return len(get_llm_tokenizer()(text, add_special_tokens=False).input_ids) if text else 0
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    tokenizer = get_llm_tokenizer()
+    ids = tokenizer(text, add_special_tokens=False).input_ids
+    return tokenizer.decode(ids[:max_tokens]).strip()
+
+
+def build_lore_context(
+    query: str,
+    lore_results: List[dict],
+    system_prompt: str,
+    user_prompt_without_lore: str,
+    max_new_tokens: int,
+    budget_tokens: Optional[int] = None,
+) -> str:
+    """
+    Lore context block sized to the LLM's context window.
+
+    Chunks are split into sentences and sentences already seen in a
+    higher-ranked chunk (the overlap between neighbouring chunks) are
+    dropped. The lore gets what is left of the context window after the
+    prompt without lore and max_new_tokens, capped at budget_tokens
+    (default: $LORE_CONTEXT_TOKENS). If the lore does not fit, the sentences
+    sharing the most words with the query are kept (ties go to higher-ranked
+    chunks), in their original order.
+
+    Token counts are recorded on the 'prompt.context' trace stage.
+    """
+    if budget_tokens is None:
+        budget_tokens = LORE_CONTEXT_TOKENS
+
+    with trace_stage("prompt.context", chunks=len(lore_results), max_new_tokens=max_new_tokens) as record:
+        fixed_tokens = count_prompt_tokens(system_prompt, user_prompt_without_lore)
+        available = min(budget_tokens, get_llm_context_window() - fixed_tokens - max_new_tokens - _SAFETY_TOKENS)
+
+        sentences: List[Tuple[int, int, str]] = []
+        seen: Set[str] = set()
+        duplicates = 0
+        raw_tokens = 0
+        for chunk, item in enumerate(lore_results):
+            text = item.get("text", "").strip()
+            raw_tokens += _count(text)
+            for position, sentence in enumerate(split_sentences(text)):
+                normalized = " ".join(sentence.lower().split())
+                if normalized in seen:
+                    duplicates += 1
+                    continue
+                seen.add(normalized)
+                sentences.append((chunk, position, sentence))
+
+        query_terms = set(tokenize(query))
+        ranked = sorted(
+            sentences,
+            key=lambda s: (-len(query_terms.intersection(tokenize(s[2]))), s[0], s[1]),
+        )
+
+        selected: List[Tuple[int, int, str]] = []
+        if available > 0:
+            # Greedy by relevance on per-sentence counts, then trim on the rendered block
+            token_ids = get_llm_tokenizer()([s[2] for s in ranked], add_special_tokens=False).input_ids if ranked else []
+            used = 0
+            for sentence, ids in zip(ranked, token_ids):
+                n_tokens = len(ids) + 1
+                if used + n_tokens <= available:
+                    selected.append(sentence)
+                    used += n_tokens
+            # selected is in relevance order: drop from the least relevant end
+            while selected and _count(_render(selected)) > available:
+                selected.pop()
+            if not selected and ranked:
+                # Not even the most relevant sentence fits whole: keep its head
+                chunk, position, sentence = ranked[0]
+                room = available - _count(_render([(chunk, position, "")])) - 1
+                if room > 0:
+                    selected = [(chunk, position, _truncate(sentence, room))]
+
+        context = _render(selected)
+        lore_tokens = _count(context)
+        record.update(
+            {
+                "prompt_tokens": fixed_tokens + lore_tokens,
+                "lore_tokens": lore_tokens,
+                "lore_tokens_raw": raw_tokens,
+                "budget_tokens": max(available, 0),
+                "duplicate_sentences": duplicates,
+                "dropped_sentences": len(sentences) - len(selected),
+            }
+        )
+    return context
@@ -0,0 +1,272 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+# Disk tier location; set EMBEDDING_CACHE_DIR="" to keep the cache in memory only
+DEFAULT_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "data/cache/embeddings")
+DEFAULT_MEMORY_ITEMS = int(os.environ.get("EMBEDDING_CACHE_MEMORY_ITEMS", "4096"))
+DEFAULT_DISK_ITEMS = int(os.environ.get("EMBEDDING_CACHE_DISK_ITEMS", "50000"))
+# Disk tier layout version; caches in another layout are started over
+_DISK_FORMAT = 2
+_KEY_BYTES = 16
+
+# Read the disk tier without writing it (set in job workers; the disk tier has one writer)
+READ_ONLY = os.environ.get("EMBEDDING_CACHE_READ_ONLY", "0") == "1"
+
+_caches: Dict[str, "EmbeddingCache"] = {}
+_caches_lock = threading.Lock()
+
+def normalize_text(text: str) -> str:
+    """
+    Normalization applied before hashing: NFC unicode + collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(model_name: str, text: str) -> str:
+    """
+    Content-addressed key for (model name, normalized text).
+    """
+    payload = f"{model_name}\n{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache for one embedding model.
+
+    - memory tier: LRU dict of key -> vector, bounded by max_memory_items
+    - disk tier: memory-mapped float32 matrix (max_disk_items rows) with a JSON
+      sidecar mapping key -> row; the least recently used row is reused when full.
+      Each row's key is also stored next to it and checked on read, so a key
+      index older than the rows (crash before a flush) gives misses, never
+      another text's vector.
+
+    The disk tier assumes a single writer process per cache_dir; other
+    processes open it with read_only=True and only add to their memory tier.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        max_memory_items: int = DEFAULT_MEMORY_ITEMS,
+        max_disk_items: int = DEFAULT_DISK_ITEMS,
+        flush_interval: float = 5.0,
+        read_only: bool = False,
+    ):
+        self.model_name = model_name
+        self.read_only = read_only
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.flush_interval = flush_interval
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+        # Disk tier state (created lazily once the embedding dim is known)
+        self._matrix_path = None
+        self._index_path = None
+        self._matrix = None
+        self._keys = None
+        self._rows: "OrderedDict[str, int]" = OrderedDict()
+        self._free_rows: List[int] = []
+        self._dim = None
+        self._dirty = False
+        self._last_flush = time.time()
+
+        if cache_dir and max_disk_items > 0:
+            if not read_only:
+                os.makedirs(cache_dir, exist_ok=True)
+            slug = model_name.replace("/", "__")
+            self._matrix_path = os.path.join(cache_dir, f"{slug}.f32")
+            self._index_path = os.path.join(cache_dir, f"{slug}.index.json")
+            self._keys_path = os.path.join(cache_dir, f"{slug}.keys")
+            self._open_disk_tier()
+
+    def _open_disk_tier(self):
+        if not all(os.path.isfile(path) for path in (self._index_path, self._matrix_path, self._keys_path)):
+            return
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index["capacity"] != self.max_disk_items or index.get("format") != _DISK_FORMAT:
+                # Capacity or layout changed: start over rather than remap rows
+                return
+            self._dim = index["dim"]
+            mode = "r" if self.read_only else "r+"
+            self._matrix = np.memmap(
+                self._matrix_path, dtype=np.float32, mode=mode,
+                shape=(self.max_disk_items, self._dim),
+            )
+            self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode=mode, shape=(self.max_disk_items, _KEY_BYTES))
+            self._rows = OrderedDict((key, row) for key, row in index["rows"])
+        except (OSError, ValueError, KeyError):
+            self._matrix = None
+            self._keys = None
+            self._rows = OrderedDict()
+            self._dim = None
+            return
+        used = set(self._rows.values())
+        self._free_rows = [r for r in range(self.max_disk_items - 1, -1, -1) if r not in used]
+
+    def _create_disk_tier(self, dim: int):
+        self._dim = dim
+        self._matrix = np.memmap(
+            self._matrix_path, dtype=np.float32, mode="w+",
+            shape=(self.max_disk_items, dim),
+        )
+        self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode="w+", shape=(self.max_disk_items, _KEY_BYTES))
+        self._rows = OrderedDict()
+        self._free_rows = list(range(self.max_disk_items - 1, -1, -1))
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _row_holds(self, key: str) -> bool:
+        return self._keys[self._rows[key]].tobytes() == bytes.fromhex(key)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Returns cached vectors for texts (None where missing) and updates counters.
+        """
+        out = []
+        with self._lock:
+            for text in texts:
+                key = cache_key(self.model_name, text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                elif self._matrix is not None and key in self._rows and self._row_holds(key):
+                    self._rows.move_to_end(key)
+                    vector = np.array(self._matrix[self._rows[key]])
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._dirty = not self.read_only
+                else:
+                    if self._matrix is not None and key in self._rows:
+                        # Stale index entry: the row was reused for another text
+                        del self._rows[key]
+                    self.misses += 1
+                out.append(vector)
+        return out
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """
+        Stores freshly computed vectors in both tiers.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._matrix_path is not None and self._matrix is None and not self.read_only:
+                self._create_disk_tier(vectors.shape[1])
+
+            for text, vector in zip(texts, vectors):
+                key = cache_key(self.model_name, text)
+                self._remember(key, vector)
+
+                if self._matrix is None or self.read_only or key in self._rows:
+                    continue
+                if self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    _, row = self._rows.popitem(last=False)
+                    self.evictions += 1
+                # Invalidate the row first: a crash mid-write leaves a miss, not a wrong vector
+                self._keys[row] = 0
+                self._matrix[row] = vector
+                self._keys[row] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                self._rows[key] = row
+                self._dirty = True
+
+            if self._dirty and time.time() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._matrix is None or self.read_only or not self._dirty:
+            return
+        self._matrix.flush()
+        self._keys.flush()
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "format": _DISK_FORMAT,
+                    "model_name": self.model_name,
+                    "dim": self._dim,
+                    "capacity": self.max_disk_items,
+                    "rows": list(self._rows.items()),
+                },
+                f,
+            )
+        os.replace(tmp_path, self._index_path)
+        self._dirty = False
+        self._last_flush = time.time()
+
+    def flush(self):
+        """
+        Writes the disk tier's matrix and key index to disk.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def clear(self):
+        """
+        Drops all cached vectors (both tiers) and resets the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._matrix is not None and not self.read_only:
+                self._free_rows = list(range(self.max_disk_items - 1, -1, -1))
+                self._rows = OrderedDict()
+                self._dirty = True
+                self._flush_locked()
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": len(self._rows),
+            }
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    """
+    Returns the process-wide cache for model_name, creating it on first use.
+    """
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = EmbeddingCache(model_name, read_only=READ_ONLY)
+            _caches[model_name] = cache
+        return cache
+
+def flush_embedding_caches():
+    for cache in list(_caches.values()):
+        cache.flush()
+
+atexit.register(flush_embedding_caches)
@@ -3,31 +3,82 @@ from typing import List
 from sentence_transformers import SentenceTransformer
 import numpy as np
 
+from src.embedding_cache import get_embedding_cache
+from src.tracing import trace_stage
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
 # Global variable to cache the model
 _embedding_model = None
+_embedding_model_name = None
 
-def get_embedding_model(model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> SentenceTransformer:
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL) -> SentenceTransformer:
     """
     Lazily loads and returns the sentence transformer model.
     """
-    global _embedding_model
+    global _embedding_model, _embedding_model_name
     if _embedding_model is None:
-        _embedding_model = SentenceTransformer(model_name)
+        with trace_stage("load.embedding", model=model_name):
+            _embedding_model = SentenceTransformer(model_name)
+        _embedding_model_name = model_name
     return _embedding_model
 
-def embed_texts(texts: List[str]) -> np.ndarray:
+def _encode_cached(texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+    """
+    Encodes texts, looking each one up in the embedding cache first.
+    Only cache misses (deduplicated) go through the model.
+    """
+    model = get_embedding_model()
+    cache = get_embedding_cache(_embedding_model_name)
+
+    vectors = cache.get_many(texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+
+    if missing:
+        with trace_stage("embed.encode", texts=len(missing)):
+            computed = np.asarray(model.encode(missing, show_progress_bar=show_progress_bar), dtype=np.float32)
+        cache.put_many(missing, computed)
+        by_text = dict(zip(missing, computed))
+        vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+
+    if not vectors:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    return np.stack(vectors)
+
+def embed_texts(texts: List[str], use_cache: bool = True, show_progress_bar: bool = True) -> np.ndarray:
     """
     Given a list of text strings, returns a 2D numpy array of embeddings.
     Shape: (len(texts), embedding_dim)
     """
+    if use_cache:
+        return _encode_cached(texts, show_progress_bar=show_progress_bar)
     model = get_embedding_model()
-    embeddings = model.encode(texts, show_progress_bar=True)
+    embeddings = model.encode(texts, show_progress_bar=show_progress_bar)
     return np.array(embeddings)
 
-def embed_query(query: str) -> np.ndarray:
+def embed_query(query: str, use_cache: bool = True) -> np.ndarray:
     """
     Embeds a single query string and returns a 1D numpy array.
     """
+    if use_cache:
+        return _encode_cached([query])[0]
     model = get_embedding_model()
     embedding = model.encode([query])[0]
     return np.array(embedding)
+
+def embed_queries(queries: List[str], use_cache: bool = True) -> np.ndarray:
+    """
+    Embeds many query strings in one batched encode call.
+    Shape: (len(queries), embedding_dim)
+    """
+    if use_cache:
+        return _encode_cached(queries)
+    model = get_embedding_model()
+    return np.array(model.encode(queries))
+
+def embedding_cache_stats() -> dict:
+    """
+    Hit/miss counters and sizes of the embedding cache for the loaded model.
+    """
+    get_embedding_model()
+    return get_embedding_cache(_embedding_model_name).stats()
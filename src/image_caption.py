@@ -1,20 +1,32 @@
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Union
+import hashlib
+import io
 
 import torch
 from PIL import Image
 from transformers import BlipProcessor, BlipForConditionalGeneration
 
+from src.result_cache import get_result_cache, make_key
+from src.tracing import trace_stage
+
+# An image can be given as a file path, encoded bytes, or an already decoded PIL image
+ImageInput = Union[str, bytes, Image.Image]
+
+DEFAULT_CAPTION_MODEL = "Salesforce/blip-image-captioning-base"
+
 _caption_model = None
 _caption_processor = None
+_caption_model_name = None
 
 def load_caption_model(
-    model_name: str = "Salesforce/blip-image-captioning-base",
+    model_name: str = DEFAULT_CAPTION_MODEL,
     device: Optional[str] = None,
 ):
     """
     Lazily loads the BLIP image captioning model and processor.
     """
-    global _caption_model, _caption_processor
+    global _caption_model, _caption_processor, _caption_model_name
 
     if _caption_model is not None and _caption_processor is not None:
         return _caption_model, _caption_processor
@@ -22,32 +34,124 @@ def load_caption_model(
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
 
-    processor = BlipProcessor.from_pretrained(model_name)
-    model = BlipForConditionalGeneration.from_pretrained(model_name)
-    model.to(device)
+    with trace_stage("load.caption", model=model_name, device=device):
+        processor = BlipProcessor.from_pretrained(model_name)
+        model = BlipForConditionalGeneration.from_pretrained(model_name)
+        model.to(device)
 
     _caption_model = model
     _caption_processor = processor
+    _caption_model_name = model_name
 
     return model, processor
 
-def caption_image(image_path: str, max_new_tokens: int = 30) -> str:
+def load_image(image: ImageInput) -> Image.Image:
+    """
+    Returns an RGB PIL image from a path, encoded bytes, or a PIL image.
+    """
+    if isinstance(image, Image.Image):
+        return image.convert("RGB")
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image)).convert("RGB")
+    return Image.open(image).convert("RGB")
+
+def image_content_hash(image: ImageInput) -> str:
     """
-    Generates a caption for the image at image_path.
+    SHA-256 of the image content: the encoded bytes for paths/bytes,
+    the pixel data for decoded PIL images.
+    """
+    h = hashlib.sha256()
+    if isinstance(image, Image.Image):
+        h.update(f"{image.mode}:{image.size}".encode("utf-8"))
+        h.update(image.tobytes())
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        h.update(image)
+    else:
+        with open(image, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+def _caption_key(image: ImageInput, max_new_tokens: int) -> str:
+    return make_key(
+        "caption",
+        image=image_content_hash(image),
+        model=_caption_model_name or DEFAULT_CAPTION_MODEL,
+        max_new_tokens=max_new_tokens,
+    )
+
+def _caption_batch(images: List[Image.Image], max_new_tokens: int) -> List[str]:
+    """
+    Runs one padded batch of decoded images through BLIP generate.
     """
     model, processor = load_caption_model()
     device = next(model.parameters()).device
 
-    image = Image.open(image_path).convert("RGB")
-
-    inputs = processor(images=image, return_tensors="pt").to(device)
+    with trace_stage("caption.preprocess", images=len(images)):
+        inputs = processor(images=images, return_tensors="pt").to(device)
 
-    with torch.no_grad():
+    with trace_stage("caption.generate", images=len(images)) as record, torch.no_grad():
         out = model.generate(
             **inputs,
             max_new_tokens=max_new_tokens,
         )
+        record["tokens"] = int(out.shape[0] * out.shape[1])
+
+    captions = processor.batch_decode(out, skip_special_tokens=True)
+    return [caption.strip() for caption in captions]
+
+def caption_image(image: ImageInput, max_new_tokens: int = 30, use_cache: bool = True) -> str:
+    """
+    Generates a caption for an image (path, bytes, or PIL image).
+    Captions are deterministic, so they are cached by image content hash.
+    """
+    return caption_images([image], batch_size=1, max_new_tokens=max_new_tokens, num_workers=1, use_cache=use_cache)[0]
+
+def caption_images(
+    images: Sequence[ImageInput],
+    batch_size: int = 8,
+    max_new_tokens: int = 30,
+    num_workers: int = 4,
+    use_cache: bool = True,
+) -> List[str]:
+    """
+    Captions many images (paths, bytes, or PIL images) in batches.
+
+    Images already captioned (same content hash) come from the result cache.
+    The rest are decoded in a background thread pool, one batch ahead of the
+    batch currently in the model, so decoding overlaps generation and at most
+    two batches of decoded images are held in memory.
+    Returns captions in input order.
+    """
+    if not images:
+        return []
+
+    cache = get_result_cache() if use_cache else None
+    captions: List[Optional[str]] = [None] * len(images)
+    keys: List[Optional[str]] = [None] * len(images)
+    if cache is not None:
+        for i, image in enumerate(images):
+            keys[i] = _caption_key(image, max_new_tokens)
+            captions[i] = cache.get(keys[i])
+
+    todo = [i for i, caption in enumerate(captions) if caption is None]
+    if not todo:
+        return captions
+
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
 
-    caption = processor.decode(out[0], skip_special_tokens=True)
-    return caption.strip()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = [pool.submit(load_image, images[i]) for i in batches[0]]
+        for b in range(len(batches)):
+            # Decoding ran in the background; this only times what was not overlapped
+            with trace_stage("caption.decode_wait", images=len(pending)):
+                decoded = [future.result() for future in pending]
+            if b + 1 < len(batches):
+                pending = [pool.submit(load_image, images[i]) for i in batches[b + 1]]
+            for i, caption in zip(batches[b], _caption_batch(decoded, max_new_tokens)):
+                captions[i] = caption
+                if cache is not None:
+                    # Deterministic: keep until evicted for space
+                    cache.put(keys[i], "caption", caption, ttl_seconds=None)
 
+    return captions
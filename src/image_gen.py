@@ -1,57 +1,309 @@
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional
+import contextlib
 import os
+import random
+import threading
 
 import torch
 from diffusers import StableDiffusionPipeline
 from PIL import Image
 
-_sd_pipeline = None
+from src.tracing import trace_stage
+
+DEFAULT_SD_MODEL = "runwayml/stable-diffusion-v1-5"
+
+# Inference profiles. "default" is the original behaviour; "fast_cpu" trades a
+# little quality for speed/memory on GPU-less boxes; "lcm_cpu" additionally
+# needs the LCM LoRA (and peft) and runs in ~4 steps.
+SD_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "scheduler": None,
+        "lora": None,
+        "num_inference_steps": 30,
+        "guidance_scale": 7.5,
+        "attention_slicing": False,
+        "vae_slicing": False,
+        "vae_tiling": False,
+        "channels_last": False,
+        "bf16_autocast": False,
+        "num_threads": None,
+    },
+    "fast_cpu": {
+        "scheduler": "dpmpp",
+        "lora": None,
+        "num_inference_steps": 15,
+        "guidance_scale": 7.0,
+        "attention_slicing": True,
+        "vae_slicing": True,
+        "vae_tiling": True,
+        "channels_last": True,
+        "bf16_autocast": True,
+        "num_threads": "auto",
+    },
+    "lcm_cpu": {
+        "scheduler": "lcm",
+        "lora": "latent-consistency/lcm-lora-sdv1-5",
+        "num_inference_steps": 4,
+        "guidance_scale": 1.0,
+        "attention_slicing": True,
+        "vae_slicing": True,
+        "vae_tiling": True,
+        "channels_last": True,
+        "bf16_autocast": True,
+        "num_threads": "auto",
+    },
+}
+
+DEFAULT_SD_PROFILE = os.environ.get("SD_PROFILE", "default")
+# Denoising steps between latent previews in the UI (0 disables previews)
+SD_PREVIEW_EVERY = int(os.environ.get("SD_PREVIEW_EVERY", "5"))
+
+# Linear map from SD 1.x latent channels to RGB: a rough preview of the
+# image without running the VAE decoder
+_LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+# on_step(step, total_steps, latents), called after every denoising step
+StepCallback = Callable[[int, int, Any], None]
+
+# One pipeline per profile, since profiles change the scheduler and weights
+_sd_pipelines: Dict[str, StableDiffusionPipeline] = {}
+# Pipelines (scheduler state) are not thread-safe: one run at a time per process
+_sd_lock = threading.Lock()
+
+def cpu_supports_bf16() -> bool:
+    """
+    True if the CPU has native bfloat16 support (AVX512-BF16 or AMX).
+    """
+    checks = [
+        getattr(torch.cpu, "_is_avx512_bf16_supported", None),
+        getattr(torch.cpu, "_is_amx_tile_supported", None),
+    ]
+    return any(check is not None and check() for check in checks)
+
+def get_sd_profile(profile: Optional[str] = None) -> Dict[str, Any]:
+    profile = profile or DEFAULT_SD_PROFILE
+    if profile not in SD_PROFILES:
+        raise ValueError(f"Unknown SD profile '{profile}', expected one of {sorted(SD_PROFILES)}")
+    return SD_PROFILES[profile]
+
+def _set_scheduler(pipe, name: str):
+    if name == "dpmpp":
+        from diffusers import DPMSolverMultistepScheduler
+
+        pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+            pipe.scheduler.config,
+            algorithm_type="dpmsolver++",
+            use_karras_sigmas=True,
+        )
+    elif name == "lcm":
+        from diffusers import LCMScheduler
+
+        pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
+    else:
+        raise ValueError(f"Unknown scheduler '{name}'")
+
+def latents_preview(latents) -> List[Image.Image]:
+    """
+    Cheap previews of intermediate (batch, 4, h, w) latents, one small
+    (h x w, i.e. 1/8 scale) RGB image per latent. Costs a matrix product
+    instead of a VAE decode, so it can run every few steps.
+    """
+    factors = torch.tensor(_LATENT_RGB_FACTORS)
+    rgb = torch.einsum("bchw,cr->bhwr", latents.detach().float().cpu(), factors)
+    rgb = ((rgb + 1.0) / 2.0).clamp(0.0, 1.0).mul(255).to(torch.uint8).numpy()
+    return [Image.fromarray(image) for image in rgb]
 
 def load_sd_pipeline(
-    model_name: str = "runwayml/stable-diffusion-v1-5",
+    model_name: str = DEFAULT_SD_MODEL,
     device: Optional[str] = None,
+    profile: Optional[str] = None,
 ):
     """
-    Lazily loads the Stable Diffusion pipeline.
+    Lazily loads the Stable Diffusion pipeline, configured for the given
+    profile (see SD_PROFILES; defaults to $SD_PROFILE or "default").
     """
-    global _sd_pipeline
+    profile = profile or DEFAULT_SD_PROFILE
+    settings = get_sd_profile(profile)
 
-    if _sd_pipeline is not None:
-        return _sd_pipeline
+    if profile in _sd_pipelines:
+        return _sd_pipelines[profile]
 
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
 
-    pipe = StableDiffusionPipeline.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-        safety_checker=None,  # optional: disable HF safety for simplicity
-    )
+    if device == "cpu" and settings["num_threads"] is not None:
+        num_threads = settings["num_threads"]
+        if num_threads == "auto":
+            num_threads = int(os.environ.get("SD_NUM_THREADS", os.cpu_count() or 1))
+        torch.set_num_threads(num_threads)
+
+    with trace_stage("load.sd", model=model_name, profile=profile, device=device):
+        pipe = StableDiffusionPipeline.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            safety_checker=None,  # optional: disable HF safety for simplicity
+        )
+
+        if settings["lora"]:
+            pipe.load_lora_weights(settings["lora"])
+            pipe.fuse_lora()
+        if settings["scheduler"]:
+            _set_scheduler(pipe, settings["scheduler"])
 
-    pipe = pipe.to(device)
-    _sd_pipeline = pipe
-    return _sd_pipeline
+        # Cap peak memory: attention in slices, VAE decode per image and in tiles
+        if settings["attention_slicing"]:
+            pipe.enable_attention_slicing()
+        if settings["vae_slicing"]:
+            pipe.enable_vae_slicing()
+        if settings["vae_tiling"]:
+            pipe.enable_vae_tiling()
+        if settings["channels_last"]:
+            pipe.unet.to(memory_format=torch.channels_last)
+            pipe.vae.to(memory_format=torch.channels_last)
+
+        pipe = pipe.to(device)
+    _sd_pipelines[profile] = pipe
+    return pipe
+
+
+def _run_pipeline(
+    prompts: List[str],
+    seeds: List[int],
+    num_inference_steps: Optional[int],
+    guidance_scale: Optional[float],
+    profile: Optional[str] = None,
+    on_step: Optional[StepCallback] = None,
+) -> List[Image.Image]:
+    """
+    Runs one micro-batch through the pipeline, one seeded generator per image.
+    Steps/guidance default to the profile's values. on_step, if given, is
+    called after every denoising step; an exception raised by it aborts the run.
+    """
+    settings = get_sd_profile(profile)
+    pipe = load_sd_pipeline(profile=profile)
+    generators = [torch.Generator(device=pipe.device).manual_seed(seed) for seed in seeds]
+
+    autocast = contextlib.nullcontext()
+    if settings["bf16_autocast"] and pipe.device.type == "cpu" and cpu_supports_bf16():
+        autocast = torch.autocast("cpu", dtype=torch.bfloat16)
+
+    steps = num_inference_steps or settings["num_inference_steps"]
+    callbacks = {}
+    if on_step is not None:
+        def step_end(pipe, step, timestep, callback_kwargs):
+            on_step(step + 1, steps, callback_kwargs["latents"])
+            return callback_kwargs
+
+        callbacks["callback_on_step_end"] = step_end
+
+    with _sd_lock, trace_stage("sd.generate", images=len(prompts), steps=steps), torch.inference_mode(), autocast:
+        return pipe(
+            prompts,
+            num_inference_steps=steps,
+            guidance_scale=guidance_scale if guidance_scale is not None else settings["guidance_scale"],
+            generator=generators,
+            **callbacks,
+        ).images
 
 
 def generate_image(
     prompt: str,
     output_path: str = "outputs/images/generated.png",
-    num_inference_steps: int = 30,
-    guidance_scale: float = 7.5,
+    num_inference_steps: Optional[int] = None,
+    guidance_scale: Optional[float] = None,
+    seed: Optional[int] = None,
+    profile: Optional[str] = None,
 ):
     """
     Generates an image from a text prompt and saves it to output_path.
+    Steps and guidance default to the SD profile's settings.
     """
-    pipe = load_sd_pipeline()
-
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    image: Image.Image = pipe(
-        prompt,
+    if seed is None:
+        seed = random.randrange(2**32)
+
+    image: Image.Image = _run_pipeline(
+        [prompt],
+        [seed],
         num_inference_steps=num_inference_steps,
         guidance_scale=guidance_scale,
-    ).images[0]
+        profile=profile,
+    )[0]
+
+    with trace_stage("sd.save", images=1):
+        image.save(output_path)
+    return output_path
+
+
+def generate_images(
+    prompts: List[str],
+    num_images_per_prompt: int = 1,
+    seeds: Optional[List[int]] = None,
+    batch_size: int = 2,
+    output_dir: str = "outputs/images",
+    filename_prefix: str = "generated",
+    num_inference_steps: Optional[int] = None,
+    guidance_scale: Optional[float] = None,
+    profile: Optional[str] = None,
+    on_step: Optional[StepCallback] = None,
+) -> List[str]:
+    """
+    Generates num_images_per_prompt images for every prompt, running them
+    through the pipeline in micro-batches of batch_size images.
+
+    seeds gives one seed per output image (len(prompts) * num_images_per_prompt,
+    prompt-major order); random seeds are drawn when it is None. The seed is part
+    of each filename, so any image can be reproduced with generate_image(seed=...).
+
+    on_step(step, total_steps, latents) reports progress over all micro-batches
+    (latents are the current micro-batch's, see latents_preview).
+
+    Returns the saved paths, prompt-major order.
+    """
+    jobs = [(p_idx, prompt) for p_idx, prompt in enumerate(prompts) for _ in range(num_images_per_prompt)]
+
+    if seeds is None:
+        seeds = [random.randrange(2**32) for _ in jobs]
+    if len(seeds) != len(jobs):
+        raise ValueError(f"Expected {len(jobs)} seeds (one per image), got {len(seeds)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    steps = num_inference_steps or get_sd_profile(profile)["num_inference_steps"]
+    total_steps = steps * -(-len(jobs) // batch_size)
+
+    paths = []
+    for start in range(0, len(jobs), batch_size):
+        batch = jobs[start:start + batch_size]
+        batch_seeds = seeds[start:start + batch_size]
+
+        batch_on_step = None
+        if on_step is not None:
+            done_steps = steps * (start // batch_size)
+
+            def batch_on_step(step, _, latents, done_steps=done_steps):
+                on_step(done_steps + step, total_steps, latents)
+
+        images = _run_pipeline(
+            [prompt for _, prompt in batch],
+            batch_seeds,
+            num_inference_steps=steps,
+            guidance_scale=guidance_scale,
+            profile=profile,
+            on_step=batch_on_step,
+        )
+
+        with trace_stage("sd.save", images=len(images)):
+            for (p_idx, _), seed, image in zip(batch, batch_seeds, images):
+                out_path = os.path.join(output_dir, f"{filename_prefix}_p{p_idx}_{len(paths):03d}_seed{seed}.png")
+                image.save(out_path)
+                paths.append(out_path)
 
-    image.save(output_path)
-    return output_path
\ No newline at end of file
+    return paths
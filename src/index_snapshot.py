@@ -0,0 +1,189 @@
+from typing import Any, Dict, Iterable, List, Optional
+import json
+import mmap
+import os
+import shutil
+import time
+
+import numpy as np
+
+from src.vector_store import NumpyLoreStore
+
+# Set LORE_INDEX_SNAPSHOT=0 to keep a private in-memory copy of the index in every process
+SNAPSHOTS_ENABLED = os.environ.get("LORE_INDEX_SNAPSHOT", "1") == "1"
+# Seconds between checks for a newer snapshot (hot swap)
+SNAPSHOT_CHECK_INTERVAL = float(os.environ.get("LORE_INDEX_SNAPSHOT_CHECK_SECONDS", "2"))
+# Snapshots kept on disk; older ones are removed after a new one is published
+KEEP_SNAPSHOTS = 2
+
+_CURRENT = "CURRENT"
+
+
+def snapshot_root(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, "snapshots", collection_name)
+
+
+def _write_strings(path: str, values: Iterable[str]):
+    """
+    Writes UTF-8 strings back to back to path, and their byte offsets
+    (n + 1 int64) to path + '.offsets.npy'.
+    """
+    offsets = [0]
+    with open(path, "wb") as f:
+        for value in values:
+            data = value.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(path + ".offsets.npy", np.asarray(offsets, dtype=np.int64))
+
+
+class MappedStrings:
+    """
+    Read-only sequence over a file written by _write_strings; items are
+    decoded on access, straight from the shared page cache.
+    """
+
+    def __init__(self, path: str, as_json: bool = False):
+        self.offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+        self.as_json = as_json
+        self._file = open(path, "rb")
+        size = int(self.offsets[-1])
+        # Empty files cannot be mapped
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> Any:
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        value = self._data[int(self.offsets[row]):int(self.offsets[row + 1])].decode("utf-8")
+        return json.loads(value) if self.as_json else value
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+class SnapshotLoreStore(NumpyLoreStore):
+    """
+    Read-only lore store over a snapshot directory: the unit embedding
+    matrix is a memory-mapped .npy, chunk ids, texts and metadata are
+    memory-mapped string tables. Opening is instant and every process
+    mapping the same snapshot shares its pages. Search is exact (as the
+    numpy backend).
+    """
+
+    def __init__(self, snapshot_dir: str):
+        with open(os.path.join(snapshot_dir, "info.json"), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.version = self.info["version"]
+        self.snapshot_dir = snapshot_dir
+        self.dtype = np.dtype(self.info["dtype"])
+        self.ids = MappedStrings(os.path.join(snapshot_dir, "ids.bin"))
+        self.documents = MappedStrings(os.path.join(snapshot_dir, "documents.bin"))
+        self.metadatas = MappedStrings(os.path.join(snapshot_dir, "metadatas.bin"), as_json=True)
+        self.matrix = np.load(os.path.join(snapshot_dir, "embeddings.npy"), mmap_mode="r") if len(self.ids) else None
+        self._row_index = None
+        self._prefix = None
+
+    def add(self, ids, documents, embeddings, metadatas):
+        raise TypeError("Snapshot lore stores are read-only; sync the index with build_lore_index")
+
+    def delete(self, ids):
+        raise TypeError("Snapshot lore stores are read-only; sync the index with build_lore_index")
+
+    def save(self):
+        pass
+
+
+def current_snapshot_version(persist_dir: str, collection_name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(snapshot_root(persist_dir, collection_name), _CURRENT), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def open_snapshot(persist_dir: str, collection_name: str) -> Optional[SnapshotLoreStore]:
+    """
+    Opens the current snapshot of a collection, or returns None if there is none.
+    """
+    version = current_snapshot_version(persist_dir, collection_name)
+    if version is None:
+        return None
+    snapshot_dir = os.path.join(snapshot_root(persist_dir, collection_name), version)
+    try:
+        return SnapshotLoreStore(snapshot_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_snapshot(
+    store,
+    persist_dir: str,
+    collection_name: str,
+    version: str,
+    extra_files: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Writes the store's chunks as a new snapshot and publishes it as the
+    collection's current one (atomic rename of the CURRENT pointer), so
+    readers pick it up on their next check. extra_files maps file names in
+    the snapshot to files copied in (BM25 index, manifest).
+
+    Returns the snapshot directory.
+    """
+    root = snapshot_root(persist_dir, collection_name)
+    snapshot_dir = os.path.join(root, version)
+    if not os.path.isdir(snapshot_dir):
+        # Written under a private name, so concurrent writers never see each other's partial files
+        tmp_dir = f"{snapshot_dir}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        ids, documents, metadatas, embeddings = store.export()
+        if not isinstance(store, NumpyLoreStore):
+            # Chroma returns the raw embeddings; the NumPy stores already hold unit vectors
+            embeddings = NumpyLoreStore._normalize(embeddings)
+        np.save(os.path.join(tmp_dir, "embeddings.npy"), np.ascontiguousarray(embeddings))
+        _write_strings(os.path.join(tmp_dir, "ids.bin"), ids)
+        _write_strings(os.path.join(tmp_dir, "documents.bin"), documents)
+        _write_strings(os.path.join(tmp_dir, "metadatas.bin"), (json.dumps(m) for m in metadatas))
+        for name, source in (extra_files or {}).items():
+            if os.path.isfile(source):
+                shutil.copyfile(source, os.path.join(tmp_dir, name))
+        with open(os.path.join(tmp_dir, "info.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": version,
+                    "collection": collection_name,
+                    "count": len(ids),
+                    "dtype": str(embeddings.dtype),
+                    "created_at": time.time(),
+                },
+                f,
+            )
+        try:
+            os.rename(tmp_dir, snapshot_dir)
+        except OSError:
+            # Another process published the same version first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    pointer = os.path.join(root, _CURRENT)
+    with open(pointer + f".tmp{os.getpid()}", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer + f".tmp{os.getpid()}", pointer)
+
+    _remove_old_snapshots(root, keep=version)
+    return snapshot_dir
+
+
+def _remove_old_snapshots(root: str, keep: str):
+    # Processes still mapping a removed snapshot keep reading it until they swap (POSIX)
+    snapshots: List[str] = [
+        name for name in os.listdir(root)
+        if name != keep and ".tmp" not in name and os.path.isfile(os.path.join(root, name, "info.json"))
+    ]
+    snapshots.sort(key=lambda name: os.path.getmtime(os.path.join(root, name)), reverse=True)
+    for name in snapshots[KEEP_SNAPSHOTS - 1:]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
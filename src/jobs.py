@@ -0,0 +1,448 @@
+from typing import Any, Callable, Dict, List, Optional
+import io
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from src.tracing import collect_stages, metrics_snapshot, prometheus_text, stage_breakdown, trace_stage
+
+# Default number of worker processes; each worker loads its own models
+DEFAULT_NUM_WORKERS = int(os.environ.get("JOB_WORKERS", "1"))
+DEFAULT_MAX_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "16"))
+# Jobs run concurrently inside one worker; >1 lets concurrent LLM calls be micro-batched
+DEFAULT_THREADS_PER_WORKER = int(os.environ.get("JOB_THREADS_PER_WORKER", "1"))
+# Finished job records are dropped after this many seconds, keeping at most the newest JOB_MAX_FINISHED
+DEFAULT_FINISHED_TTL = float(os.environ.get("JOB_FINISHED_TTL", "3600"))
+DEFAULT_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", "256"))
+
+JOB_TYPES = ("enrich_prompt", "text_to_image", "image_to_story")
+# 'expired': the record was dropped (or never existed), see JobManager.status
+FINISHED_STATUSES = ("done", "failed", "cancelled", "expired")
+
+# Minimum seconds between partial-story updates pushed to the shared job table
+_PARTIAL_UPDATE_INTERVAL = 0.25
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _update(jobs, job_id: str, **fields):
+    # Manager dict values are plain copies, so write back the whole record
+    record = dict(jobs[job_id])
+    record.update(fields)
+    jobs[job_id] = record
+
+
+def _finish(jobs, job_id: str, **fields):
+    """
+    Final update of a job record; drops progress output the result supersedes.
+    """
+    record = dict(jobs[job_id])
+    record.pop("previews", None)
+    if fields.get("status") == "done":
+        record.pop("partial_story", None)
+    record.update(fields, finished_at=time.time())
+    jobs[job_id] = record
+
+
+def _run_enrich_prompt(payload: Dict[str, Any], check_cancel: Callable[[], None], report) -> Dict[str, Any]:
+    from src.rag_prompting import rag_enrich_image_prompt
+
+    enriched_prompt = rag_enrich_image_prompt(
+        payload["prompt"],
+        top_k=payload.get("top_k", 3),
+        use_cache=payload.get("use_cache", True),
+        seed=payload.get("seed"),
+    )
+    return {"enriched_prompt": enriched_prompt}
+
+
+def _png_bytes(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _run_text_to_image(payload: Dict[str, Any], check_cancel: Callable[[], None], report) -> Dict[str, Any]:
+    from src.image_gen import SD_PREVIEW_EVERY, generate_images, latents_preview
+
+    result = _run_enrich_prompt(payload, check_cancel, report)
+    report(enriched_prompt=result["enriched_prompt"])
+    check_cancel()
+
+    preview_every = payload.get("preview_every", SD_PREVIEW_EVERY)
+    started = time.perf_counter()
+    last_update = 0.0
+
+    def on_step(step: int, total_steps: int, latents):
+        # Runs inside the diffusion loop, so cancelling stops the render mid-way
+        nonlocal last_update
+        check_cancel()
+        preview = preview_every > 0 and (step % preview_every == 0 or step == total_steps)
+        if not preview and time.perf_counter() - last_update < _PARTIAL_UPDATE_INTERVAL:
+            return
+        elapsed = time.perf_counter() - started
+        fields = {
+            "progress": {
+                "step": step,
+                "total_steps": total_steps,
+                "elapsed_seconds": elapsed,
+                "eta_seconds": elapsed / step * (total_steps - step),
+            }
+        }
+        if preview:
+            fields["previews"] = [_png_bytes(image) for image in latents_preview(latents)]
+        report(**fields)
+        last_update = time.perf_counter()
+
+    num_variants = payload.get("num_variants", 1)
+    result["image_paths"] = generate_images(
+        [result["enriched_prompt"]],
+        num_images_per_prompt=num_variants,
+        batch_size=payload.get("batch_size") or num_variants,
+        output_dir=payload.get("output_dir", os.path.join("outputs", "images")),
+        filename_prefix=payload.get("filename_prefix", "job_image"),
+        on_step=on_step,
+    )
+    return result
+
+
+def _run_image_to_story(payload: Dict[str, Any], check_cancel: Callable[[], None], report) -> Dict[str, Any]:
+    from src.story_from_image import generate_story_from_image, stream_story_from_image
+    import src.text_llm as text_llm
+
+    # use_cache=False or a new seed asks for a fresh story instead of the cached one
+    story_options = {
+        "top_k_lore": payload.get("top_k", 3),
+        "use_cache": payload.get("use_cache", True),
+        "seed": payload.get("seed"),
+    }
+    if text_llm.LLM_BATCHING:
+        # Batched LLM calls cannot stream; the story arrives in one piece
+        result = generate_story_from_image(payload["image"], **story_options)
+        # The job-level breakdown (set by the worker) covers the same stages
+        result.pop("timings", None)
+        return result
+
+    result = stream_story_from_image(payload["image"], **story_options)
+    report(caption=result["caption"])
+    check_cancel()
+
+    # Stream the story into the job table so pollers can show it progressively
+    pieces = []
+    last_update = 0.0
+    story_stream = result.pop("story_stream")
+    try:
+        for piece in story_stream:
+            pieces.append(piece)
+            if time.perf_counter() - last_update >= _PARTIAL_UPDATE_INTERVAL:
+                check_cancel()
+                report(partial_story="".join(pieces))
+                last_update = time.perf_counter()
+    finally:
+        # On cancellation this stops the LLM instead of letting it finish the story
+        story_stream.close()
+
+    result["story"] = "".join(pieces).strip()
+    return result
+
+
+_RUNNERS = {
+    "enrich_prompt": _run_enrich_prompt,
+    "text_to_image": _run_text_to_image,
+    "image_to_story": _run_image_to_story,
+}
+
+
+def _worker_loop(job_queue, jobs, cancelled, set_active):
+    while True:
+        item = job_queue.get()
+        if item is None:
+            break
+        job_id, job_type, payload = item
+
+        if cancelled.get(job_id):
+            _finish(jobs, job_id, status="cancelled")
+            continue
+
+        def check_cancel():
+            if cancelled.get(job_id):
+                raise JobCancelled()
+
+        def report(**fields):
+            _update(jobs, job_id, **fields)
+
+        set_active(job_id, True)
+        _update(jobs, job_id, status="running", started_at=time.time(), worker_pid=os.getpid())
+        try:
+            with collect_stages() as stages, trace_stage(f"job.{job_type}", job_id=job_id):
+                result = _RUNNERS[job_type](payload, check_cancel, report)
+            # Per-stage breakdown of this job, ending with the whole-job stage
+            result["timings"] = stage_breakdown(stages)
+        except JobCancelled:
+            _finish(jobs, job_id, status="cancelled")
+        except Exception as e:
+            _finish(jobs, job_id, status="failed", error=repr(e), traceback=traceback.format_exc())
+        else:
+            _finish(jobs, job_id, status="done", result=result)
+        set_active(job_id, False)
+
+
+def _sync_lore_index_main(lore_dir: str):
+    from src.rag_index import build_lore_index
+
+    build_lore_index(lore_dir)
+
+
+def _worker_main(job_queue, jobs, cancelled, workers, preload: Optional[List[str]], threads: int):
+    """
+    Worker process: owns its own copies of the models and runs up to
+    `threads` jobs at a time.
+    """
+    from src.model_registry import get_model_registry
+    from src.rag_index import open_lore_index
+    import src.embedding_cache as embedding_cache
+    import src.text_llm as text_llm
+
+    pid = os.getpid()
+    workers[pid] = {"status": "starting"}
+
+    # The index and the embedding cache's disk tier are written by one process
+    # only (_sync_lore_index_main, run before the workers start)
+    embedding_cache.READ_ONLY = True
+    open_lore_index()
+    registry = get_model_registry()
+    if preload:
+        registry.preload(preload)
+
+    if threads > 1:
+        # Concurrent jobs in this process share the LLM through the micro-batching scheduler
+        text_llm.LLM_BATCHING = True
+
+    active = set()
+    active_lock = threading.Lock()
+
+    def set_active(job_id: str, is_active: bool):
+        with active_lock:
+            if is_active:
+                active.add(job_id)
+            else:
+                active.discard(job_id)
+            info = {
+                "status": "busy" if active else "idle",
+                "active_jobs": sorted(active),
+                "models": registry.status(),
+                "metrics": metrics_snapshot(),
+            }
+            if text_llm.LLM_SPECULATIVE:
+                info["speculative"] = text_llm.speculative_stats()
+            workers[pid] = info
+
+    workers[pid] = {"status": "idle", "active_jobs": [], "models": registry.status(), "metrics": metrics_snapshot()}
+
+    loop_threads = [
+        threading.Thread(target=_worker_loop, args=(job_queue, jobs, cancelled, set_active), daemon=True)
+        for _ in range(threads)
+    ]
+    for thread in loop_threads:
+        thread.start()
+    for thread in loop_threads:
+        thread.join()
+
+    workers[pid] = {"status": "stopped"}
+
+
+class JobManager:
+    """
+    Local job subsystem for the RAG pipelines.
+
+    Jobs go into a bounded queue and are run by num_workers worker processes,
+    each owning its own models. Job records (status, timestamps, result,
+    partial output) live in a multiprocessing Manager dict; finished records
+    are dropped after finished_ttl seconds or beyond the newest max_finished:
+
+        manager = JobManager(num_workers=2)
+        job_id = manager.submit("text_to_image", {"prompt": "a rainy rooftop"})
+        manager.status(job_id)   # 'queued' -> 'running' -> 'done' / 'failed' / 'cancelled' (later 'expired')
+        manager.result(job_id)   # blocks until finished
+    """
+
+    def __init__(
+        self,
+        num_workers: int = DEFAULT_NUM_WORKERS,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        lore_dir: str = "data/lore",
+        preload: Optional[List[str]] = None,
+        threads_per_worker: int = DEFAULT_THREADS_PER_WORKER,
+        finished_ttl: float = DEFAULT_FINISHED_TTL,
+        max_finished: int = DEFAULT_MAX_FINISHED,
+    ):
+        # spawn: CUDA/torch state must not be forked into the workers
+        ctx = mp.get_context("spawn")
+
+        # Sync the lore index once, in a child process (the caller stays free of
+        # torch), so the workers only open it and never write it concurrently
+        sync = ctx.Process(target=_sync_lore_index_main, args=(lore_dir,))
+        sync.start()
+        sync.join()
+        if sync.exitcode != 0:
+            raise RuntimeError(f"Syncing the lore index in {lore_dir} failed (exit code {sync.exitcode})")
+
+        self._manager = ctx.Manager()
+        self._jobs = self._manager.dict()
+        self._cancelled = self._manager.dict()
+        self._workers_info = self._manager.dict()
+        self._queue = ctx.Queue(maxsize=max_queue_size)
+
+        self._threads_per_worker = threads_per_worker
+        self._finished_ttl = finished_ttl
+        self._max_finished = max_finished
+        self._processes = [
+            ctx.Process(
+                target=_worker_main,
+                args=(self._queue, self._jobs, self._cancelled, self._workers_info, preload, threads_per_worker),
+                daemon=True,
+            )
+            for _ in range(num_workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._processes_by_pid = {process.pid: process for process in self._processes}
+
+    def submit(self, job_type: str, payload: Dict[str, Any], block: bool = False, timeout: Optional[float] = None) -> str:
+        """
+        Queues a job and returns its id. Raises queue.Full when the queue is
+        full (unless block=True, which waits up to timeout seconds).
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type '{job_type}', expected one of {JOB_TYPES}")
+
+        self._evict_finished()
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {"id": job_id, "type": job_type, "status": "queued", "queued_at": time.time()}
+        try:
+            self._queue.put((job_id, job_type, payload), block=block, timeout=timeout)
+        except queue.Full:
+            del self._jobs[job_id]
+            raise
+        return job_id
+
+    def _evict_finished(self):
+        """
+        Drops finished job records past the TTL or beyond the newest max_finished.
+        """
+        finished = sorted(
+            (record["finished_at"], job_id)
+            for job_id, record in self._jobs.items()
+            if record["status"] in FINISHED_STATUSES and "finished_at" in record
+        )
+        cutoff = time.time() - self._finished_ttl
+        excess = len(finished) - self._max_finished
+        for i, (finished_at, job_id) in enumerate(finished):
+            if i >= excess and finished_at >= cutoff:
+                break
+            self._jobs.pop(job_id, None)
+            self._cancelled.pop(job_id, None)
+
+    def _worker_died(self, record: Dict[str, Any]) -> Optional[str]:
+        """
+        Why an unfinished job can no longer finish, or None if it still can.
+        """
+        if record["status"] == "running":
+            process = self._processes_by_pid.get(record.get("worker_pid"))
+            if process is not None and not process.is_alive():
+                return f"Worker process {process.pid} died (exit code {process.exitcode})"
+        elif record["status"] == "queued" and not any(p.is_alive() for p in self._processes):
+            return "All worker processes died"
+        return None
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """
+        Returns the job record, with derived wait/run seconds when known.
+        Jobs whose worker process died are marked failed; unknown (or evicted)
+        ids get an 'expired' record.
+        """
+        record = self._jobs.get(job_id)
+        if record is None:
+            return {"id": job_id, "status": "expired", "error": "job record not found (finished too long ago?)"}
+        error = self._worker_died(record)
+        if error is not None:
+            _finish(self._jobs, job_id, status="failed", error=error)
+            record = self._jobs[job_id]
+        if "started_at" in record:
+            record["wait_seconds"] = record["started_at"] - record["queued_at"]
+            record["run_seconds"] = record.get("finished_at", time.time()) - record["started_at"]
+        return record
+
+    def result(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.2) -> Dict[str, Any]:
+        """
+        Waits for the job and returns its result. Raises RuntimeError if it
+        failed or was cancelled, TimeoutError on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            record = self.status(job_id)
+            if record["status"] == "done":
+                return record["result"]
+            if record["status"] == "failed":
+                raise RuntimeError(f"Job {job_id} failed: {record.get('error')}\n{record.get('traceback', '')}")
+            if record["status"] in ("cancelled", "expired"):
+                raise RuntimeError(f"Job {job_id} was {record['status']}")
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f"Job {job_id} still {record['status']} after {timeout}s")
+            time.sleep(poll_interval)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Requests cancellation. Queued jobs are skipped; running jobs stop at
+        their next cancellation check. Returns False if the job already finished
+        (or is unknown).
+        """
+        record = self._jobs.get(job_id)
+        if record is None or record["status"] in FINISHED_STATUSES:
+            return False
+        self._cancelled[job_id] = True
+        return True
+
+    def workers(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Per-worker state ('starting', 'idle', 'busy', 'stopped', 'dead') and model status.
+        """
+        info = dict(self._workers_info)
+        for pid, process in self._processes_by_pid.items():
+            if not process.is_alive() and info.get(pid, {}).get("status") != "stopped":
+                info[pid] = {**info.get(pid, {}), "status": "dead", "exitcode": process.exitcode}
+        return info
+
+    def metrics_text(self) -> str:
+        """
+        Per-stage metrics of all workers (as of their last job) in the
+        Prometheus text format, labelled by worker pid.
+        """
+        snapshots = {str(pid): info.get("metrics", {}) for pid, info in self.workers().items()}
+        return prometheus_text(snapshots)
+
+    def is_ready(self) -> bool:
+        info = self.workers()
+        return len(info) == len(self._processes) and all(w["status"] in ("idle", "busy") for w in info.values())
+
+    def shutdown(self, timeout: float = 10.0):
+        # One stop sentinel per worker thread
+        for _ in range(len(self._processes) * self._threads_per_worker):
+            self._queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._manager.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
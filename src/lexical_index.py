@@ -0,0 +1,119 @@
+from typing import Any, Dict, List, Optional
+import heapq
+import json
+import math
+import os
+import re
+import time
+
+# Lowercased word tokens; keeps names like "Kade" or "Sector-9" matchable as "kade", "sector", "9"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Only the most common English function words; lore names are never dropped
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his in is it its of on or she "
+    "that the their them they this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOP_WORDS]
+
+
+class BM25Index:
+    """
+    Inverted-index BM25 retriever over the lore chunks, kept in sync with the
+    vector store by build_lore_index (same chunk ids).
+
+    Postings map term -> {chunk id: term frequency}. Query terms are scored
+    rarest first, so a query that runs out of its time budget still counts the
+    most selective terms (names, places). Persists to '<collection>.bm25.json'.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        persist_dir: Optional[str] = None,
+        reset: bool = False,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self._path = os.path.join(persist_dir, f"{collection_name}.bm25.json") if persist_dir else None
+
+        if self._path and not reset and os.path.isfile(self._path):
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.postings = data["postings"]
+            self.doc_lengths = data["doc_lengths"]
+            self.total_length = sum(self.doc_lengths.values())
+
+    def count(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, ids: List[str], documents: List[str]):
+        for doc_id, text in zip(ids, documents):
+            if doc_id in self.doc_lengths:
+                continue
+            terms = tokenize(text)
+            self.doc_lengths[doc_id] = len(terms)
+            self.total_length += len(terms)
+            for term in terms:
+                postings = self.postings.setdefault(term, {})
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+
+    def delete(self, ids: List[str]):
+        doomed = {doc_id for doc_id in ids if doc_id in self.doc_lengths}
+        if not doomed:
+            return
+        for doc_id in doomed:
+            self.total_length -= self.doc_lengths.pop(doc_id)
+        # Terms of deleted chunks are not stored separately, so sweep the postings
+        for term in list(self.postings):
+            postings = self.postings[term]
+            for doc_id in doomed.intersection(postings):
+                del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+
+    def save(self):
+        if not self._path:
+            return
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"postings": self.postings, "doc_lengths": self.doc_lengths}, f)
+        os.replace(tmp_path, self._path)
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1.0 + (self.count() - df + 0.5) / (df + 0.5))
+
+    def query(self, query: str, top_k: int, budget_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Returns up to top_k [{'id', 'score'}] by BM25 score. With budget_ms,
+        stops adding query terms once the budget is spent.
+        """
+        if not self.doc_lengths:
+            return []
+        deadline = None if budget_ms is None else time.perf_counter() + budget_ms / 1000.0
+        avg_length = self.total_length / len(self.doc_lengths)
+
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t in self.postings]
+        terms.sort(key=lambda t: len(self.postings[t]))
+
+        scores: Dict[str, float] = {}
+        for term in terms:
+            if deadline is not None and scores and time.perf_counter() > deadline:
+                break
+            idf = self._idf(term)
+            for doc_id, tf in self.postings[term].items():
+                norm = tf + self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1.0) / norm
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [{"id": doc_id, "score": score} for doc_id, score in best]
@@ -0,0 +1,105 @@
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import os
+import queue
+import threading
+import time
+
+from src.text_llm import generate_texts
+
+DEFAULT_MAX_BATCH_SIZE = int(os.environ.get("LLM_BATCH_MAX_SIZE", "8"))
+DEFAULT_MAX_WAIT_MS = float(os.environ.get("LLM_BATCH_MAX_WAIT_MS", "20"))
+
+
+class LLMBatchScheduler:
+    """
+    Cross-request micro-batching for LLM calls.
+
+    Callers (any thread) submit single requests; a background thread waits up
+    to max_wait_ms after the first pending request to collect up to
+    max_batch_size requests, runs one batched generate per group of identical
+    generation parameters, and resolves each caller's future with its text.
+    """
+
+    def __init__(self, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self.batches = 0
+        self.requests = 0
+
+        self._queue: "queue.Queue[Tuple[str, str, int, float, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="llm-batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, system_prompt: str, user_prompt: str, max_new_tokens: int = 128, temperature: float = 0.7) -> Future:
+        future: Future = Future()
+        self._queue.put((system_prompt, user_prompt, max_new_tokens, temperature, future))
+        return future
+
+    def generate(self, system_prompt: str, user_prompt: str, max_new_tokens: int = 128, temperature: float = 0.7) -> str:
+        """
+        Blocking call with the same contract as generate_text.
+        """
+        return self.submit(system_prompt, user_prompt, max_new_tokens, temperature).result()
+
+    def _collect(self) -> List[Tuple[str, str, int, float, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+
+            # Requests can only share a generate() call if their parameters match
+            groups: Dict[Tuple[int, float], List[Tuple[str, str, int, float, Future]]] = {}
+            for request in batch:
+                groups.setdefault((request[2], request[3]), []).append(request)
+
+            for (max_new_tokens, temperature), requests in groups.items():
+                try:
+                    texts = generate_texts(
+                        [r[0] for r in requests],
+                        [r[1] for r in requests],
+                        max_new_tokens=max_new_tokens,
+                        temperature=temperature,
+                    )
+                except Exception as e:
+                    for request in requests:
+                        request[4].set_exception(e)
+                    continue
+                for request, text in zip(requests, texts):
+                    request[4].set_result(text)
+                self.batches += 1
+                self.requests += len(requests)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "pending": self._queue.qsize(),
+        }
+
+
+_scheduler: Optional[LLMBatchScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler() -> LLMBatchScheduler:
+    """
+    Returns the process-wide scheduler, starting it on first use.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMBatchScheduler()
+        return _scheduler
@@ -1,5 +1,32 @@
+import hashlib
+import multiprocessing as mp
 import os
-from typing import List
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Files are read in blocks of this many characters, never whole
+READ_BLOCK_CHARS = 1 << 20
+# Files bigger than this are chunked lazily in the calling process instead of
+# being chunked whole by a pool worker
+LARGE_FILE_BYTES = 64 * 1024 * 1024
+# Upper bound on the size of files being chunked by pool workers at once
+MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+
+# Chunks are sized in tokens of the embedding model's tokenizer
+# (same name as src.embedings.DEFAULT_EMBEDDING_MODEL)
+DEFAULT_TOKENIZER = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_CHUNK_TOKENS = int(os.environ.get("LORE_CHUNK_TOKENS", "200"))
+DEFAULT_CHUNK_OVERLAP = int(os.environ.get("LORE_CHUNK_OVERLAP", "32"))
+# all-MiniLM-L6-v2 truncates inputs past 256 tokens, [CLS] and [SEP] included
+MAX_EMBEDDING_TOKENS = 256
+
+# A sentence ends at ./!/? (plus closing quotes/brackets) followed by
+# whitespace, or at a blank line
+_SENTENCE_END = re.compile(r"[.!?]+[\"'\u201d\u2019)\]]*(?=\s)|\n\s*\n")
+
+_tokenizers: Dict[str, Any] = {}
 
 def load_lore_texts(lore_dir: str) -> List[str]:
     """
@@ -14,6 +41,19 @@ def load_lore_texts(lore_dir: str) -> List[str]:
                 texts.append(f.read())
     return texts
 
+def load_lore_files(lore_dir: str) -> Dict[str, str]:
+    """
+    Reads all .txt files inside the lore directory
+    and returns a dict mapping filename -> raw text.
+    """
+    files = {}
+    for filename in sorted(os.listdir(lore_dir)):
+        if filename.endswith(".txt"):
+            path = os.path.join(lore_dir, filename)
+            with open(path, "r", encoding="utf-8") as f:
+                files[filename] = f.read()
+    return files
+
 def chunk_text(text: str, max_words: int = 150) -> List[str]:
     """
     Splits a long text into smaller chunks of ~max_words.
@@ -40,17 +80,277 @@ def clean_text(text: str) -> str:
             .strip()
     )
 
-def load_and_chunk_lore(lore_dir: str, chunk_size: int = 150) -> List[str]:
+def load_and_chunk_lore(
+    lore_dir: str,
+    max_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+) -> List[str]:
     """
-    Loads all lore files, cleans them, chunks them,
+    Loads all lore files, chunks them,
     and returns a list of text chunks.
     """
     raw_texts = load_lore_texts(lore_dir)
     all_chunks = []
 
     for text in raw_texts:
-        cleaned = clean_text(text)
-        chunks = chunk_text(cleaned, max_words=chunk_size)
-        all_chunks.extend(chunks)
+        chunks = chunk_lore_text(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+        all_chunks.extend(chunk["text"] for chunk in chunks)
 
     return all_chunks
+
+def chunk_lore_text(
+    text: str,
+    max_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+    tokenizer_name: str = DEFAULT_TOKENIZER,
+) -> List[Dict[str, Any]]:
+    """
+    Chunks the text of a single lore file (see iter_text_chunks).
+    """
+    return list(iter_text_chunks([text], max_tokens, overlap_tokens, tokenizer_name))
+
+def get_chunk_tokenizer(tokenizer_name: str = DEFAULT_TOKENIZER):
+    """
+    Lazily loads the (fast) tokenizer used to size chunks. Only the
+    tokenizer is loaded, so chunking workers stay light.
+    """
+    if tokenizer_name not in _tokenizers:
+        from transformers import AutoTokenizer
+
+        _tokenizers[tokenizer_name] = AutoTokenizer.from_pretrained(tokenizer_name)
+    return _tokenizers[tokenizer_name]
+
+def _iter_sentence_spans(blocks: Iterable[str]) -> Iterator[List[Tuple[int, int, str]]]:
+    """
+    Splits streamed text into sentences. Yields, per block, the list of
+    (start, end, text) sentences completed so far, with character offsets
+    into the whole text; the unfinished last sentence is carried over.
+    """
+    buffer = ""
+    offset = 0  # position of buffer[0] in the whole text
+
+    def spans(upto: int) -> List[Tuple[int, int, str]]:
+        out = []
+        start = 0
+        ends = [m.end() for m in _SENTENCE_END.finditer(buffer, 0, upto)] + [upto]
+        for end in ends:
+            piece = buffer[start:end]
+            stripped = piece.strip()
+            if stripped:
+                lead = len(piece) - len(piece.lstrip())
+                out.append((offset + start + lead, offset + start + lead + len(stripped), stripped))
+            start = end
+        return out
+
+    for block in blocks:
+        buffer += block
+        last_end = 0
+        for m in _SENTENCE_END.finditer(buffer):
+            last_end = m.end()
+        if last_end:
+            yield spans(last_end)
+            buffer = buffer[last_end:]
+            offset += last_end
+    if buffer:
+        yield spans(len(buffer))
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Sentences of a text, split the same way the chunker splits lore files.
+    """
+    return [sentence for spans in _iter_sentence_spans([text]) for _, _, sentence in spans]
+
+def iter_text_chunks(
+    blocks: Iterable[str],
+    max_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+    tokenizer_name: str = DEFAULT_TOKENIZER,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Sentence- and token-aware chunker over streamed text.
+
+    Whole sentences are packed into chunks of at most max_tokens embedding
+    tokens (capped below the embedding model's limit, so nothing gets
+    truncated); each chunk starts with the trailing sentences of the previous
+    one, up to overlap_tokens. A sentence longer than max_tokens is split on
+    token boundaries. Yields dicts with 'text' (whitespace-normalized),
+    'start'/'end' (character offsets into the text) and 'tokens'.
+    """
+    tokenizer = get_chunk_tokenizer(tokenizer_name)
+    max_tokens = min(max_tokens, MAX_EMBEDDING_TOKENS - 2)
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    window: deque = deque()  # (start, end, text, n_tokens)
+    window_tokens = 0
+    fresh = False  # window holds sentences not emitted yet
+
+    def emit():
+        return {
+            "text": " ".join(" ".join(s[2].split()) for s in window),
+            "start": window[0][0],
+            "end": window[-1][1],
+            "tokens": window_tokens,
+        }
+
+    for sentences in _iter_sentence_spans(blocks):
+        if not sentences:
+            continue
+        counts = [len(ids) for ids in tokenizer([s[2] for s in sentences], add_special_tokens=False)["input_ids"]]
+
+        for (start, end, text), n_tokens in zip(sentences, counts):
+            if n_tokens > max_tokens:
+                if fresh:
+                    yield emit()
+                window.clear()
+                window_tokens = 0
+                fresh = False
+                yield from _split_long_sentence(tokenizer, start, text, max_tokens, overlap_tokens)
+                continue
+
+            if window_tokens + n_tokens > max_tokens and fresh:
+                yield emit()
+                fresh = False
+            # Keep only the overlap tail (and room for the new sentence)
+            while window and (
+                (not fresh and window_tokens > overlap_tokens) or window_tokens + n_tokens > max_tokens
+            ):
+                window_tokens -= window.popleft()[3]
+
+            window.append((start, end, text, n_tokens))
+            window_tokens += n_tokens
+            fresh = True
+
+    if fresh:
+        yield emit()
+
+def _split_long_sentence(tokenizer, start: int, text: str, max_tokens: int, overlap_tokens: int) -> Iterator[Dict[str, Any]]:
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    step = max_tokens - overlap_tokens
+    for i in range(0, len(offsets), step):
+        window = offsets[i:i + max_tokens]
+        piece = text[window[0][0]:window[-1][1]]
+        yield {
+            "text": " ".join(piece.split()),
+            "start": start + window[0][0],
+            "end": start + window[-1][1],
+            "tokens": len(window),
+        }
+        if i + max_tokens >= len(offsets):
+            break
+
+def list_lore_paths(lore_dir: str) -> List[str]:
+    """
+    Paths of all .txt files inside the lore directory, sorted by filename.
+    """
+    return [
+        os.path.join(lore_dir, filename)
+        for filename in sorted(os.listdir(lore_dir))
+        if filename.endswith(".txt")
+    ]
+
+def hash_lore_file(path: str) -> str:
+    """
+    SHA-256 of a lore file's decoded text, streamed in blocks
+    (same value as hashing the whole text read at once).
+    """
+    h = hashlib.sha256()
+    with open(path, "r", encoding="utf-8") as f:
+        for block in iter(lambda: f.read(READ_BLOCK_CHARS), ""):
+            h.update(block.encode("utf-8"))
+    return h.hexdigest()
+
+def iter_file_chunks(
+    path: str,
+    max_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+    tokenizer_name: str = DEFAULT_TOKENIZER,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily chunks a lore file, reading it block by block. Yields the same
+    chunks as chunk_lore_text on the whole file, holding at most one block
+    and one chunk window in memory.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_text_chunks(
+            iter(lambda: f.read(READ_BLOCK_CHARS), ""), max_tokens, overlap_tokens, tokenizer_name
+        )
+
+def _chunk_file(path: str, max_tokens: int, overlap_tokens: int, tokenizer_name: str) -> List[Dict[str, Any]]:
+    # Pool worker: read and chunk one (not large) file
+    return list(iter_file_chunks(path, max_tokens, overlap_tokens, tokenizer_name))
+
+def open_ingest_pool(num_workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool for hashing/chunking lore files, or None for num_workers <= 1
+    and in daemon processes (job workers), which cannot start children.
+    """
+    if num_workers <= 1 or mp.current_process().daemon:
+        return None
+    # spawn: the parent may hold torch/model state that must not be forked
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context("spawn"))
+
+def hash_lore_files(paths: List[str], pool: Optional[ProcessPoolExecutor] = None) -> List[str]:
+    """
+    hash_lore_file for many files, in parallel when a pool is given.
+    """
+    if pool is None:
+        return [hash_lore_file(path) for path in paths]
+    return list(pool.map(hash_lore_file, paths))
+
+def iter_chunked_files(
+    paths: List[str],
+    max_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+    tokenizer_name: str = DEFAULT_TOKENIZER,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> Iterator[Tuple[str, Iterator[Dict[str, Any]]]]:
+    """
+    Yields (path, chunks) per file, in input order.
+
+    With a pool, files are read and chunked by the workers ahead of the
+    consumer, with at most MAX_IN_FLIGHT_BYTES of files in flight; files over
+    LARGE_FILE_BYTES are streamed with iter_file_chunks when their turn comes.
+    """
+    if pool is None:
+        for path in paths:
+            yield path, iter_file_chunks(path, max_tokens, overlap_tokens, tokenizer_name)
+        return
+
+    pending = deque()
+    in_flight = 0
+    remaining = iter(paths)
+    next_path = next(remaining, None)
+
+    while next_path is not None or pending:
+        # Keep the workers busy without exceeding the in-flight byte budget
+        while next_path is not None:
+            size = os.path.getsize(next_path)
+            if size > LARGE_FILE_BYTES:
+                pending.append((next_path, None, 0))
+            elif pending and in_flight + size > MAX_IN_FLIGHT_BYTES:
+                break
+            else:
+                pending.append((next_path, pool.submit(_chunk_file, next_path, max_tokens, overlap_tokens, tokenizer_name), size))
+                in_flight += size
+            next_path = next(remaining, None)
+
+        path, future, size = pending.popleft()
+        if future is None:
+            yield path, iter_file_chunks(path, max_tokens, overlap_tokens, tokenizer_name)
+        else:
+            chunks = future.result()
+            in_flight -= size
+            yield path, iter(chunks)
+
+def iter_batches(items, batch_size: int) -> Iterator[list]:
+    """
+    Groups any iterable into lists of at most batch_size items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
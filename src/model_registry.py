@@ -0,0 +1,213 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import threading
+import time
+
+from src.tracing import rss_mb
+
+def _load_embedding():
+    from src.embedings import get_embedding_model
+    return get_embedding_model()
+
+def _warmup_embedding():
+    from src.embedings import embed_query
+    embed_query("warm-up", use_cache=False)
+
+def _load_reranker():
+    from src.reranker import load_reranker
+    return load_reranker()
+
+def _warmup_reranker():
+    from src.reranker import rerank
+    rerank("warm-up", [{"text": "warm-up"}])
+
+def _load_caption():
+    from src.image_caption import load_caption_model
+    return load_caption_model()
+
+def _warmup_caption():
+    from PIL import Image
+    from src.image_caption import caption_image
+    caption_image(Image.new("RGB", (384, 384)), max_new_tokens=5, use_cache=False)
+
+def _load_llm():
+    from src.text_llm import LLM_SPECULATIVE, load_draft_model, load_llm
+    model, tokenizer = load_llm()
+    if LLM_SPECULATIVE:
+        # Counted with the LLM's weight memory
+        return model, tokenizer, load_draft_model()
+    return model, tokenizer
+
+def _warmup_llm():
+    from src.text_llm import generate_text
+    generate_text("You are a helpful assistant.", "Say hi.", max_new_tokens=2, use_prefix_cache=False)
+
+def _load_sd():
+    from src.image_gen import load_sd_pipeline
+    return load_sd_pipeline()
+
+def _warmup_sd():
+    from src.image_gen import _run_pipeline
+    _run_pipeline(["warm-up"], [0], num_inference_steps=1, guidance_scale=None)
+
+# name -> (loader, warm-up inference). Loaders are the modules' own lazy
+# loaders, so the models stay in the existing module-level globals.
+MODEL_SPECS: Dict[str, Tuple[Callable[[], Any], Callable[[], None]]] = {
+    "embedding": (_load_embedding, _warmup_embedding),
+    "reranker": (_load_reranker, _warmup_reranker),
+    "caption": (_load_caption, _warmup_caption),
+    "llm": (_load_llm, _warmup_llm),
+    "sd": (_load_sd, _warmup_sd),
+}
+
+def _parse_preload(value: str) -> List[str]:
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in MODEL_SPECS]
+    if unknown:
+        print(f"[model_registry] Ignoring unknown PRELOAD_MODELS entries {unknown}, expected names from {sorted(MODEL_SPECS)}")
+    return [name for name in names if name in MODEL_SPECS]
+
+# Models preloaded by ModelRegistry.preload() when no names are given
+# (the reranker only when one is configured with $RERANKER)
+DEFAULT_PRELOAD = _parse_preload(
+    os.environ.get("PRELOAD_MODELS", "embedding,caption,llm,sd" + (",reranker" if os.environ.get("RERANKER") else ""))
+)
+
+def _torch_modules(obj) -> List[Any]:
+    import torch
+
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    if isinstance(obj, (tuple, list)):
+        return [m for item in obj for m in _torch_modules(item)]
+    # diffusers pipelines expose their sub-models through .components
+    components = getattr(obj, "components", None)
+    if isinstance(components, dict):
+        return [m for item in components.values() for m in _torch_modules(item)]
+    return []
+
+def _size_mb(obj) -> float:
+    """
+    Weight memory of the torch modules in obj, in MB, measured like
+    src.quantization.model_size_mb (which counts quantized weights too).
+    """
+    from src.quantization import model_size_mb
+
+    return sum(model_size_mb(module) for module in _torch_modules(obj))
+
+
+class ModelRegistry:
+    """
+    Central place to preload, warm up, and check readiness of all models.
+
+    Per model it records status ('pending', 'loading', 'ready', 'failed'),
+    load and warm-up seconds, and the model's weight memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status: Dict[str, Dict[str, Any]] = {
+            name: {"status": "pending"} for name in MODEL_SPECS
+        }
+
+    def _update(self, name: str, **fields):
+        with self._lock:
+            self._status[name].update(fields)
+
+    def load(self, name: str, warmup: bool = True) -> Any:
+        """
+        Loads (and optionally warms up) one model, recording timings.
+        """
+        if name not in MODEL_SPECS:
+            raise ValueError(f"Unknown model '{name}', expected one of {sorted(MODEL_SPECS)}")
+        loader, warmup_fn = MODEL_SPECS[name]
+
+        self._update(name, status="loading", error=None)
+        try:
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+
+            warmup_seconds = None
+            if warmup:
+                start = time.perf_counter()
+                warmup_fn()
+                warmup_seconds = time.perf_counter() - start
+        except Exception as e:
+            self._update(name, status="failed", error=repr(e))
+            print(f"[model_registry] Failed to load '{name}': {e!r}")
+            raise
+
+        self._update(
+            name,
+            status="ready",
+            load_seconds=round(load_seconds, 2),
+            warmup_seconds=round(warmup_seconds, 2) if warmup_seconds is not None else None,
+            size_mb=round(_size_mb(model), 1),
+        )
+        print(f"[model_registry] '{name}' ready: {self._status[name]}")
+        return model
+
+    def preload(
+        self,
+        names: Optional[List[str]] = None,
+        warmup: bool = True,
+        parallel: bool = True,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Loads the given models (default: DEFAULT_PRELOAD / $PRELOAD_MODELS),
+        in parallel threads unless parallel=False. Failures are recorded in the
+        status rather than raised, so one broken model does not block the rest.
+        """
+        names = DEFAULT_PRELOAD if names is None else names
+
+        def _safe_load(name: str):
+            try:
+                self.load(name, warmup=warmup)
+            except Exception:
+                pass
+
+        start = time.perf_counter()
+        if parallel and len(names) > 1:
+            with ThreadPoolExecutor(max_workers=len(names)) as pool:
+                list(pool.map(_safe_load, names))
+        else:
+            for name in names:
+                _safe_load(name)
+
+        print(
+            f"[model_registry] Preloaded {names} in {time.perf_counter() - start:.1f}s, "
+            f"process RSS {rss_mb():.0f} MB"
+        )
+        return self.status()
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(fields) for name, fields in self._status.items()}
+
+    def is_ready(self, names: Optional[List[str]] = None) -> bool:
+        """
+        True once every model in names (default: DEFAULT_PRELOAD) is loaded;
+        unknown names are never ready.
+        """
+        names = DEFAULT_PRELOAD if names is None else names
+        with self._lock:
+            return all(self._status.get(name, {}).get("status") == "ready" for name in names)
+
+    def process_rss_mb(self) -> float:
+        return round(rss_mb(), 1)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Returns the process-wide model registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,121 @@
+from typing import Any
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+# "none" keeps fp32 weights; "dynamic_int8" is torch's dynamic quantization (int8 weights and
+# activations quantized on the fly); "int8"/"int4" quantize only the weights
+QUANTIZATION_MODES = ("none", "dynamic_int8", "int8", "int4")
+
+# Input features sharing one int4 scale (per output row); int8 uses one scale per row
+INT4_GROUP_SIZE = 128
+
+# Fused int8-weight CPU matmul (torch >= 2.3); switched off after the first failure
+_fused_int8 = hasattr(torch, "_weight_int8pack_mm")
+
+
+class WeightOnlyLinear(nn.Module):
+    """
+    nn.Linear replacement holding its weight as symmetric int8 (one scale per
+    output row) or int4 (one scale per INT4_GROUP_SIZE inputs, two values
+    packed per byte). Activations stay in floating point: int8 uses torch's
+    fused int8-weight matmul where available, otherwise the weight is
+    dequantized one layer at a time in forward, so only the quantized copy
+    stays resident.
+    """
+
+    def __init__(self, linear: nn.Linear, bits: int, group_size: int = INT4_GROUP_SIZE):
+        super().__init__()
+        if bits not in (4, 8):
+            raise ValueError(f"Unsupported weight bits: {bits}")
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.bits = bits
+
+        weight = linear.weight.detach().float()
+        if bits == 8 or self.in_features % group_size or group_size % 2:
+            group_size = self.in_features
+        self.group_size = group_size
+
+        qmax = 2 ** (bits - 1) - 1
+        grouped = weight.reshape(self.out_features, -1, group_size)
+        scales = grouped.abs().amax(dim=-1, keepdim=True).clamp(min=1e-8) / qmax
+        q = torch.round(grouped / scales).clamp(-qmax - 1, qmax).to(torch.int8)
+        if bits == 4:
+            # Offset to 0..15 and pack neighbouring values into the low/high nibble
+            q = (q + 8).to(torch.uint8)
+            q = q[..., 0::2] | (q[..., 1::2] << 4)
+
+        self.register_buffer("qweight", q.reshape(self.out_features, -1).contiguous())
+        self.register_buffer("scales", scales.reshape(self.out_features, -1).contiguous())
+        self.bias = nn.Parameter(linear.bias.detach().clone()) if linear.bias is not None else None
+
+    def dequantized_weight(self, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        q = self.qweight.reshape(self.out_features, -1, self.group_size // (2 if self.bits == 4 else 1))
+        if self.bits == 4:
+            low = (q & 0x0F).to(torch.int8) - 8
+            high = (q >> 4).to(torch.int8) - 8
+            q = torch.stack([low, high], dim=-1).reshape(self.out_features, -1, self.group_size)
+        weight = q.to(dtype) * self.scales.to(dtype).unsqueeze(-1)
+        return weight.reshape(self.out_features, self.in_features)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        global _fused_int8
+        if self.bits == 8 and _fused_int8:
+            try:
+                out = torch._weight_int8pack_mm(
+                    x.reshape(-1, self.in_features).contiguous(), self.qweight, self.scales.reshape(-1).to(x.dtype)
+                ).reshape(*x.shape[:-1], self.out_features)
+                return out + self.bias.to(x.dtype) if self.bias is not None else out
+            except RuntimeError:
+                # Unsupported dtype/shape in this torch build: dequantize instead
+                _fused_int8 = False
+        bias = self.bias.to(x.dtype) if self.bias is not None else None
+        return F.linear(x, self.dequantized_weight(x.dtype), bias)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bits={self.bits}, group_size={self.group_size}"
+
+
+def _replace_linears(module: nn.Module, bits: int, group_size: int):
+    for name, child in module.named_children():
+        if isinstance(child, nn.Linear):
+            setattr(module, name, WeightOnlyLinear(child, bits, group_size))
+        else:
+            _replace_linears(child, bits, group_size)
+
+
+def quantize_model(model: nn.Module, mode: str, group_size: int = INT4_GROUP_SIZE) -> nn.Module:
+    """
+    Quantizes every nn.Linear of an fp32 CPU model in place (embeddings and
+    norms stay fp32) and returns it. mode is one of QUANTIZATION_MODES.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}'. Available: {', '.join(QUANTIZATION_MODES)}")
+    if mode == "dynamic_int8":
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    if mode in ("int8", "int4"):
+        _replace_linears(model, 8 if mode == "int8" else 4, group_size)
+    return model
+
+
+def _tensor_bytes(value: Any, seen: set) -> int:
+    # Dynamic quantized linears keep (packed weight, bias) tuples in their state dict
+    if isinstance(value, torch.Tensor):
+        # Tied weights (e.g. embeddings shared with the LM head) appear under several names
+        key = (value.data_ptr(), value.nelement(), value.dtype)
+        if value.data_ptr() and key in seen:
+            return 0
+        seen.add(key)
+        return value.nelement() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item, seen) for item in value)
+    return 0
+
+
+def model_size_mb(model: nn.Module) -> float:
+    """
+    Bytes held by the model's weights and buffers (quantized or not), in MB.
+    """
+    seen: set = set()
+    return sum(_tensor_bytes(value, seen) for value in model.state_dict().values()) / (1024 * 1024)
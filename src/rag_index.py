@@ -1,101 +1,515 @@
-from typing import List, Dict, Any
-import chromadb
-from src.lore_loader import load_and_chunk_lore
-from src.embedings import embed_texts, embed_query
+from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import os
+import time
 
-_client = None
-_collection = None
+from src.lore_loader import (
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_TOKENS,
+    hash_lore_files,
+    iter_batches,
+    iter_chunked_files,
+    list_lore_paths,
+    open_ingest_pool,
+)
+from src.embedings import embed_texts, embed_queries, DEFAULT_EMBEDDING_MODEL
+from src.vector_store import open_lore_store, DEFAULT_BACKEND
+from src.index_snapshot import (
+    SNAPSHOT_CHECK_INTERVAL,
+    SNAPSHOTS_ENABLED,
+    SnapshotLoreStore,
+    current_snapshot_version,
+    open_snapshot,
+    write_snapshot,
+)
+from src.lexical_index import BM25Index
+from src.reranker import DEFAULT_RERANKER, load_reranker, rerank
+from src.tracing import trace_stage
 
-def get_chroma_client():
-    global _client
-    if _client is None:
-        _client = chromadb.Client()
-    return _client
+# On-disk location of the persistent index (store files + manifest)
+DEFAULT_INDEX_DIR = "data/lore_index"
+
+# Chunks embedded and written to the store per batch during ingestion
+DEFAULT_INGEST_BATCH_SIZE = int(os.environ.get("LORE_INGEST_BATCH_SIZE", "256"))
+# Processes hashing/chunking lore files; only used for lore dirs of PARALLEL_INGEST_MIN_BYTES or more
+DEFAULT_INGEST_WORKERS = int(os.environ.get("LORE_INGEST_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_INGEST_MIN_BYTES = 32 * 1024 * 1024
+
+# Seconds between ingestion progress lines
+_PROGRESS_INTERVAL = 5.0
+
+# "hybrid" fuses BM25 and dense results (reciprocal rank fusion); "dense" is vector search only
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each retriever for fusion/reranking
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", "20"))
+RRF_K = 60
+# Per-stage latency budgets in ms (per query). BM25 stops adding query terms and
+# the reranker stops scoring candidates when theirs runs out; dense search cannot
+# be cut short, so when it overruns its budget the rerank stage is skipped.
+RETRIEVAL_BUDGETS_MS = {
+    "lexical": float(os.environ.get("RETRIEVAL_LEXICAL_BUDGET_MS", "5")),
+    "dense": float(os.environ.get("RETRIEVAL_DENSE_BUDGET_MS", "50")),
+    "rerank": float(os.environ.get("RETRIEVAL_RERANK_BUDGET_MS", "150")),
+}
+
+_store = None
+_lexical = None
+_manifest = None
+# (persist_dir, collection) of the snapshot _store was opened from, and when it was last checked
+_snapshot_source = None
+_snapshot_checked_at = 0.0
+# True while _store is an in-memory index (persist_dir=None) synced by this process
+_store_in_memory = False
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _chunk_id(source: str, chunk_hash: str, seen: Dict[str, int]) -> str:
+    """
+    Content-addressed chunk id: '<file>:<chunk hash>:<occurrence>'.
+    An unchanged chunk keeps its id even if other chunks of the file change.
+    seen counts hashes already issued for this file (updated in place).
+    """
+    h = chunk_hash[:16]
+    n = seen.get(h, 0)
+    seen[h] = n + 1
+    return f"{source}:{h}:{n}"
+
+def _manifest_path(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, f"{collection_name}.manifest.json")
+
+def _load_manifest(persist_dir: Optional[str], collection_name: str) -> Optional[Dict[str, Any]]:
+    if persist_dir is None:
+        return _manifest if _store_in_memory else None
+    path = _manifest_path(persist_dir, collection_name)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_manifest(manifest: Dict[str, Any], persist_dir: Optional[str], collection_name: str):
+    if persist_dir is None:
+        return
+    path = _manifest_path(persist_dir, collection_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _manifest_version(manifest: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {
+            "settings": manifest.get("settings"),
+            "files": {name: entry.get("hash") for name, entry in manifest.get("files", {}).items()},
+        },
+        sort_keys=True,
+    )
+    return _hash_text(payload)[:16]
+
+def _use_snapshot(persist_dir: Optional[str], backend: str) -> bool:
+    # Snapshots are searched exactly, so the approximate backend keeps its own lists
+    return SNAPSHOTS_ENABLED and persist_dir is not None and backend != "ivf"
+
+def _set_snapshot(snapshot: SnapshotLoreStore, persist_dir: str, collection_name: str):
+    """
+    Makes a snapshot (with the BM25 index and manifest stored in it) the
+    index this process retrieves from.
+    """
+    global _store, _lexical, _manifest, _snapshot_source, _snapshot_checked_at, _store_in_memory
+    lexical = BM25Index(collection_name, persist_dir=snapshot.snapshot_dir)
+    with open(os.path.join(snapshot.snapshot_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    _store, _lexical, _manifest = snapshot, lexical, manifest
+    _store_in_memory = False
+    _snapshot_source = (persist_dir, collection_name)
+    _snapshot_checked_at = time.monotonic()
+
+def _publish_snapshot(store, manifest: Dict[str, Any], persist_dir: str, collection_name: str) -> SnapshotLoreStore:
+    with trace_stage("index.snapshot", chunks=store.count()):
+        write_snapshot(
+            store,
+            persist_dir,
+            collection_name,
+            _manifest_version(manifest),
+            extra_files={
+                f"{collection_name}.bm25.json": os.path.join(persist_dir, f"{collection_name}.bm25.json"),
+                "manifest.json": _manifest_path(persist_dir, collection_name),
+            },
+        )
+    snapshot = open_snapshot(persist_dir, collection_name)
+    _set_snapshot(snapshot, persist_dir, collection_name)
+    print(f"[build_lore_index] Published shared snapshot {snapshot.version} ({snapshot.count()} docs).")
+    return snapshot
+
+def _maybe_swap_snapshot():
+    """
+    Hot swap: at most every SNAPSHOT_CHECK_INTERVAL seconds, switches to a
+    newer snapshot published by another process. In-flight queries keep
+    using the snapshot they started with.
+    """
+    global _snapshot_checked_at
+    if _snapshot_source is None or time.monotonic() - _snapshot_checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return
+    _snapshot_checked_at = time.monotonic()
+    persist_dir, collection_name = _snapshot_source
+    if current_snapshot_version(persist_dir, collection_name) in (None, _store.version):
+        return
+    snapshot = open_snapshot(persist_dir, collection_name)
+    if snapshot is not None:
+        _set_snapshot(snapshot, persist_dir, collection_name)
+        print(f"[retrieve_lore] Switched to lore index snapshot {snapshot.version} ({snapshot.count()} docs).")
 
 def build_lore_index(
     lore_dir: str = "data/lore",
-    collection_name: str = "lore_collection"
+    collection_name: str = "lore_collection",
+    persist_dir: Optional[str] = DEFAULT_INDEX_DIR,
+    force: bool = False,
+    chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    backend: str = DEFAULT_BACKEND,
+    batch_size: int = DEFAULT_INGEST_BATCH_SIZE,
+    num_workers: int = DEFAULT_INGEST_WORKERS,
+):
+    """
+    Builds or incrementally syncs the lore index from lore text files.
+
+    A manifest records a content hash per lore file and per chunk, so only
+    added or changed files are re-embedded, chunks of deleted files are removed,
+    and nothing is embedded when the lore directory is unchanged.
+    Use persist_dir=None for an in-memory index, force=True for a full rebuild.
+    An in-memory index is private to the process: later calls in the same
+    process sync it incrementally, but every process embeds the lore anew
+    (cheaper with a warm embedding cache).
+
+    With a persist_dir the synced index is published as a read-only,
+    memory-mapped snapshot (see src.index_snapshot) that every process opens
+    instead of loading its own copy; when the lore is unchanged opening it is
+    all this does. Processes switch to newer snapshots as they are published.
+    Chunks follow sentence boundaries and are sized in embedding tokens
+    (chunk_tokens, with chunk_overlap tokens shared between neighbours); each
+    is stored with its source file, character offsets, token count and hash.
+    backend picks the vector store: "chroma", "numpy" (exact) or "ivf" (approximate).
+
+    Ingestion is streamed: files are hashed and chunked lazily (by num_workers
+    processes when the lore is large), and new chunks are embedded and written
+    to the store batch_size at a time, so memory does not grow with the corpus.
+    """
+    paths = list_lore_paths(lore_dir)
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    # Starting a process pool costs more than it saves on a small lore dir
+    pool = open_ingest_pool(num_workers if total_bytes >= PARALLEL_INGEST_MIN_BYTES else 1)
+    try:
+        store = _sync_lore_index(
+            paths, collection_name, persist_dir, force, chunk_tokens, chunk_overlap, backend, batch_size, pool
+        )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    _load_reranker()
+    return store
+
+def _load_reranker():
+    # Loaded with the index, so the first query's rerank budget is not spent loading it
+    if DEFAULT_RERANKER:
+        load_reranker()
+
+def open_lore_index(
+    collection_name: str = "lore_collection",
+    persist_dir: Optional[str] = DEFAULT_INDEX_DIR,
+    backend: str = DEFAULT_BACKEND,
 ):
     """
-    Builds an in-memory ChromaDB index from lore text files.
+    Opens the index as last synced by build_lore_index, without syncing or
+    writing anything: for processes that share the index with a writer
+    (the JobManager syncs once before starting its workers).
     """
-    global _collection
+    global _store, _lexical, _manifest, _snapshot_source, _store_in_memory
+    if _use_snapshot(persist_dir, backend):
+        snapshot = open_snapshot(persist_dir, collection_name)
+        if snapshot is not None:
+            _set_snapshot(snapshot, persist_dir, collection_name)
+            print(f"[open_lore_index] Opened shared snapshot {snapshot.version} ({snapshot.count()} docs).")
+            _load_reranker()
+            return snapshot
 
-    client = get_chroma_client()
+    _snapshot_source = None
+    _store_in_memory = False
+    _store = open_lore_store(backend, collection_name, persist_dir=persist_dir)
+    _lexical = BM25Index(collection_name, persist_dir=persist_dir)
+    _manifest = _load_manifest(persist_dir, collection_name)
+    print(f"[open_lore_index] Opened collection '{collection_name}' ({_store.count()} docs).")
+    _load_reranker()
+    return _store
 
-    # Load + chunk lore
-    chunks = load_and_chunk_lore(lore_dir)
-    print(f"[build_lore_index] Loaded {len(chunks)} chunks from {lore_dir}")
+def _sync_lore_index(paths, collection_name, persist_dir, force, chunk_tokens, chunk_overlap, backend, batch_size, pool):
+    global _store, _lexical, _manifest, _snapshot_source, _store_in_memory
 
-    # Embed chunks
-    embeddings = embed_texts(chunks)
-    print(f"[build_lore_index] Computed embeddings with shape: {embeddings.shape}")
+    names = {path: os.path.basename(path) for path in paths}
+    file_hashes = dict(zip(names.values(), hash_lore_files(paths, pool)))
 
-    # (Re)create collection
-    # If a collection with this name already exists, you can delete or get it
-    try:
-        client.delete_collection(name=collection_name)
-    except Exception:
-        # ignore if it doesn't exist
-        pass
+    settings = {
+        "collection": collection_name,
+        "chunker": "sentence-token-v1",
+        "chunk_tokens": chunk_tokens,
+        "chunk_overlap": chunk_overlap,
+        "embedding_model": DEFAULT_EMBEDDING_MODEL,
+        "backend": backend,
+    }
+
+    manifest = None if force else _load_manifest(persist_dir, collection_name)
+    if manifest is not None and manifest.get("settings") != settings:
+        print("[build_lore_index] Index settings changed, rebuilding from scratch.")
+        manifest = None
+
+    use_snapshot = _use_snapshot(persist_dir, backend)
+    if use_snapshot and manifest is not None and {
+        name: entry["hash"] for name, entry in manifest["files"].items()
+    } == file_hashes:
+        snapshot = open_snapshot(persist_dir, collection_name)
+        if snapshot is not None and snapshot.version == _manifest_version(manifest):
+            _set_snapshot(snapshot, persist_dir, collection_name)
+            print(f"[build_lore_index] Collection '{collection_name}' is up to date (shared snapshot, {snapshot.count()} docs).")
+            return snapshot
+
+    _snapshot_source = None
+    store = None
+    if manifest is not None:
+        if persist_dir is None:
+            # In-memory index: the manifest is this process's own, and so is the store it describes
+            store, lexical = _store, _lexical
+        else:
+            store = open_lore_store(backend, collection_name, persist_dir=persist_dir)
+            lexical = BM25Index(collection_name, persist_dir=persist_dir)
+        expected = sum(len(entry["chunks"]) for entry in manifest["files"].values())
+        if store.count() != expected or lexical.count() != expected:
+            print("[build_lore_index] Manifest does not match the index, rebuilding from scratch.")
+            manifest = None
+            store = None
 
-    collection = client.create_collection(name=collection_name)
+    if store is None:
+        # Full (re)build: drop whatever is there and start from an empty manifest
+        store = open_lore_store(backend, collection_name, persist_dir=persist_dir, reset=True)
+        lexical = BM25Index(collection_name, persist_dir=persist_dir, reset=True)
+        manifest = {"settings": settings, "files": {}}
 
-    # Prepare IDs
-    ids = [f"chunk_{i}" for i in range(len(chunks))]
+    old_files = manifest["files"]
+    added = [name for name in file_hashes if name not in old_files]
+    changed = [
+        name for name in file_hashes
+        if name in old_files and old_files[name]["hash"] != file_hashes[name]
+    ]
+    deleted = [name for name in old_files if name not in file_hashes]
 
-    # Add to Chroma
-    collection.add(
-        ids=ids,
-        documents=chunks,
-        embeddings=embeddings.tolist(),
+    if not (added or changed or deleted):
+        print(f"[build_lore_index] Collection '{collection_name}' is up to date ({store.count()} docs).")
+        if use_snapshot:
+            # Indexed earlier but not published (or published under other settings)
+            return _publish_snapshot(store, manifest, persist_dir, collection_name)
+        _store = store
+        _lexical = lexical
+        _manifest = manifest
+        _store_in_memory = persist_dir is None
+        return store
+
+    print(f"[build_lore_index] {len(added)} added, {len(changed)} changed, {len(deleted)} deleted files.")
+
+    # Chunks of deleted files
+    stale_ids = []
+    for name in deleted:
+        stale_ids.extend(old_files[name]["chunks"])
+
+    new_files = {name: old_files[name] for name in old_files if name not in deleted}
+
+    def iter_new_chunks():
+        # Added/changed files: only chunks whose id (content hash) is new get embedded
+        to_sync = set(added + changed)
+        to_chunk = [p for p in paths if names[p] in to_sync]
+        for path, chunks in iter_chunked_files(
+            to_chunk, chunk_tokens, chunk_overlap, DEFAULT_EMBEDDING_MODEL, pool=pool
+        ):
+            name = names[path]
+            previous = set(old_files[name]["chunks"]) if name in old_files else set()
+            ids = []
+            seen = {}
+            for chunk in chunks:
+                chunk_hash = _hash_text(chunk["text"])
+                chunk_id = _chunk_id(name, chunk_hash, seen)
+                ids.append(chunk_id)
+                if chunk_id not in previous:
+                    yield chunk_id, chunk["text"], {
+                        "source": name,
+                        "start_char": chunk["start"],
+                        "end_char": chunk["end"],
+                        "tokens": chunk["tokens"],
+                        "chunk_hash": chunk_hash,
+                    }
+            stale_ids.extend(previous - set(ids))
+            new_files[name] = {"hash": file_hashes[name], "chunks": ids}
+
+    embedded = 0
+    start = time.perf_counter()
+    last_report = start
+    for batch in iter_batches(iter_new_chunks(), batch_size):
+        batch_ids, batch_chunks, batch_metadatas = zip(*batch)
+        with trace_stage("index.embed_batch", chunks=len(batch)):
+            embeddings = embed_texts(list(batch_chunks), show_progress_bar=False)
+        with trace_stage("index.write_batch", chunks=len(batch)):
+            store.add(list(batch_ids), list(batch_chunks), embeddings, list(batch_metadatas))
+            lexical.add(list(batch_ids), list(batch_chunks))
+        embedded += len(batch)
+
+        now = time.perf_counter()
+        if now - last_report >= _PROGRESS_INTERVAL:
+            print(f"[build_lore_index] {embedded} chunks embedded ({embedded / (now - start):.1f} chunks/s)")
+            last_report = now
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"[build_lore_index] Embedded {embedded} chunks in {elapsed:.1f}s "
+        f"({embedded / elapsed if elapsed > 0 else 0.0:.1f} chunks/s), removing {len(stale_ids)}."
     )
 
-    _collection = collection
-    print(f"[build_lore_index] Collection '{collection_name}' built with {len(chunks)} docs.")
+    if stale_ids:
+        store.delete(stale_ids)
+        lexical.delete(stale_ids)
 
-    return collection
+    store.save()
+    lexical.save()
+    manifest = {"settings": settings, "files": new_files}
+    _save_manifest(manifest, persist_dir, collection_name)
+    print(f"[build_lore_index] Collection '{collection_name}' synced with {store.count()} docs.")
 
-def get_lore_collection():
+    if use_snapshot:
+        return _publish_snapshot(store, manifest, persist_dir, collection_name)
+    _store = store
+    _lexical = lexical
+    _manifest = manifest
+    _store_in_memory = persist_dir is None
+    return store
+
+def get_lore_store():
     """
-    Returns the current lore collection.
+    Returns the current lore store.
     Make sure build_lore_index() has been called first.
     """
-    global _collection
-    if _collection is None:
+    global _store
+    if _store is None:
         # As a fallback, build from default lore dir
-        _collection = build_lore_index()
-    return _collection
+        _store = build_lore_index()
+    _maybe_swap_snapshot()
+    return _store
+
+def get_lexical_index() -> BM25Index:
+    """
+    Returns the BM25 index built alongside the lore store.
+    """
+    get_lore_store()
+    return _lexical
 
+# Backwards-compatible name from when the index was always a Chroma collection
+get_lore_collection = get_lore_store
 
-def retrieve_lore(query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+
+def get_retrieval_config() -> Dict[str, Any]:
     """
-    Given a text query, returns top_k relevant lore chunks from the collection.
+    Retrieval settings that change which chunks come back (for cache keys).
     """
-    collection = get_lore_collection()
+    return {
+        "mode": RETRIEVAL_MODE,
+        "candidates": RETRIEVAL_CANDIDATES,
+        "reranker": DEFAULT_RERANKER or None,
+    }
 
-    # Embed query
-    q_emb = embed_query(query)
+def _fuse(store, dense_results: List[Dict[str, Any]], lexical_hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Reciprocal rank fusion of dense and BM25 candidates. Chunks found only by
+    BM25 are fetched from the store; each result gets 'rrf_score' and the
+    'retrievers' that found it.
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for rank, result in enumerate(dense_results):
+        fused[result["id"]] = {**result, "rrf_score": 1.0 / (RRF_K + rank + 1), "retrievers": ["dense"]}
 
-    # Query Chroma
-    result = collection.query(
-        query_embeddings=[q_emb.tolist()],
-        n_results=top_k,
-    )
+    lexical_only = []
+    for rank, hit in enumerate(lexical_hits):
+        entry = fused.get(hit["id"])
+        if entry is None:
+            entry = fused[hit["id"]] = {"id": hit["id"], "distance": None, "rrf_score": 0.0, "retrievers": []}
+            lexical_only.append(hit["id"])
+        entry["rrf_score"] += 1.0 / (RRF_K + rank + 1)
+        entry["bm25_score"] = hit["score"]
+        entry["retrievers"].append("lexical")
+
+    for doc in store.get(lexical_only):
+        fused[doc["id"]].update(doc)
 
-    # result is a dict with keys: 'ids', 'documents', 'distances', 'metadatas'
-    docs = result.get("documents", [[]])[0]
-    ids = result.get("ids", [[]])[0]
-    distances = result.get("distances", [[]])[0]
+    # Ids missing from the store (should not happen once synced) are dropped
+    results = [entry for entry in fused.values() if "text" in entry]
+    results.sort(key=lambda entry: entry["rrf_score"], reverse=True)
+    return results
+
+def _retrieve(queries: List[str], top_k: int) -> List[List[Dict[str, Any]]]:
+    store = get_lore_store()
+    hybrid = RETRIEVAL_MODE == "hybrid" and _lexical is not None
+    n_candidates = max(top_k, RETRIEVAL_CANDIDATES) if hybrid or DEFAULT_RERANKER else top_k
+
+    with trace_stage("retrieve.embed", queries=len(queries)):
+        q_embs = embed_queries(queries)
+
+    # The dense budget covers the vector search only, not query embedding
+    start = time.perf_counter()
+    with trace_stage("retrieve.query", queries=len(queries), top_k=n_candidates):
+        dense = store.query(q_embs, n_candidates)
+    dense_ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+
+    if not (hybrid or DEFAULT_RERANKER):
+        return dense
 
     out = []
-    for doc_id, doc_text, dist in zip(ids, docs, distances):
-        out.append(
-            {
-                "id": doc_id,
-                "text": doc_text,
-                "distance": dist,
-            }
-        )
+    for query, candidates in zip(queries, dense):
+        if hybrid:
+            with trace_stage("retrieve.lexical", budget_ms=RETRIEVAL_BUDGETS_MS["lexical"]):
+                lexical_hits = _lexical.query(query, n_candidates, budget_ms=RETRIEVAL_BUDGETS_MS["lexical"])
+            candidates = _fuse(store, candidates, lexical_hits)
 
+        if DEFAULT_RERANKER:
+            if dense_ms > RETRIEVAL_BUDGETS_MS["dense"]:
+                print(f"[retrieve_lore] Dense search took {dense_ms:.0f} ms (over budget), skipping rerank.")
+            else:
+                with trace_stage("retrieve.rerank", candidates=len(candidates), budget_ms=RETRIEVAL_BUDGETS_MS["rerank"]):
+                    candidates = rerank(query, candidates, budget_ms=RETRIEVAL_BUDGETS_MS["rerank"])
+
+        out.append(candidates[:top_k])
     return out
+
+def retrieve_lore(query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    """
+    Given a text query, returns top_k relevant lore chunks from the collection.
+
+    In hybrid mode (default, $RETRIEVAL_MODE) dense and BM25 candidates are
+    fused with reciprocal rank fusion, then optionally reranked by a
+    cross-encoder ($RERANKER); each stage has its own latency budget.
+    """
+    return _retrieve([query], top_k)[0]
+
+def retrieve_lore_batch(queries: List[str], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+    """
+    Batched retrieve_lore: embeds all queries in one encode call and issues a
+    single multi-vector query. Returns one result list per query, in order.
+    """
+    if not queries:
+        return []
+    return _retrieve(queries, top_k)
+
+def get_lore_index_version() -> str:
+    """
+    Short content hash of the current index (build settings + lore file hashes).
+    Changes whenever the indexed lore or embedding model changes, so cached
+    results that depended on retrieval can be keyed on it.
+    """
+    get_lore_store()
+    return _manifest_version(_manifest or {})
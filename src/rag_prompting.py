@@ -1,11 +1,27 @@
-from typing import List
+from typing import List, Optional, Tuple
 
-from src.rag_index import retrieve_lore
-from src.text_llm import generate_text
+from src.context_budget import LORE_CONTEXT_TOKENS, build_lore_context
+from src.embedings import DEFAULT_EMBEDDING_MODEL
+from src.rag_index import retrieve_lore, retrieve_lore_batch, get_lore_index_version, get_retrieval_config
+from src.result_cache import get_result_cache, make_key
+from src.text_llm import generate_text, get_llm_name
+
+# Tokens generated for an enriched image prompt
+ENRICH_MAX_NEW_TOKENS = 120
+
+IMAGE_PROMPT_SYSTEM_PROMPT = (
+    "You are an assistant that creates concise but vivid image prompts for "
+    "a text-to-image model like Stable Diffusion.\n\n"
+    "You work in a sci-fi noir detective universe. Use the lore context if helpful, "
+    "but do NOT mention 'lore', 'context', or brackets in the final prompt.\n"
+    "The final prompt should be a single sentence or short paragraph, "
+    "focusing on visual details: setting, mood, lighting, key objects, and characters."
+)
 
 def format_lore_context(lore_results: List[dict]) -> str:
     """
-    Combines retrieved lore chunks into a readable context block.
+    Combines retrieved lore chunks into a readable context block, in full
+    (the LLM prompts use build_lore_context, which fits a token budget).
     """
     parts = []
     for i, item in enumerate(lore_results, start=1):
@@ -15,28 +31,8 @@ def format_lore_context(lore_results: List[dict]) -> str:
         parts.append(f"[LORE {i}]\n{text}")
     return "\n\n".join(parts)
 
-def rag_enrich_image_prompt(user_prompt: str, top_k: int = 3) -> str:
-    """
-    Uses RAG to enrich a user prompt with relevant lore,
-    then asks the LLM to create a single, vivid image prompt.
-
-    Returns: enriched prompt string.
-    """
-    # 1) Retrieve relevant lore
-    lore_results = retrieve_lore(user_prompt, top_k=top_k)
-    lore_context = format_lore_context(lore_results)
-
-    # 2) Build system + user prompts for LLM
-    system_prompt = (
-        "You are an assistant that creates concise but vivid image prompts for "
-        "a text-to-image model like Stable Diffusion.\n\n"
-        "You work in a sci-fi noir detective universe. Use the lore context if helpful, "
-        "but do NOT mention 'lore', 'context', or brackets in the final prompt.\n"
-        "The final prompt should be a single sentence or short paragraph, "
-        "focusing on visual details: setting, mood, lighting, key objects, and characters."
-    )
-
-    user_message = f"""
+def _image_prompt_user_message(user_prompt: str, lore_context: str) -> str:
+    return f"""
     User original prompt:
     {user_prompt}
 
@@ -48,14 +44,108 @@ def rag_enrich_image_prompt(user_prompt: str, top_k: int = 3) -> str:
     the user's idea and the tone of this universe. Do not include line breaks or labels, only the prompt.
     """.strip()
 
+def build_image_prompt_messages(
+    user_prompt: str,
+    lore_results: List[dict],
+    max_new_tokens: int = ENRICH_MAX_NEW_TOKENS,
+) -> Tuple[str, str]:
+    """
+    Builds the (system prompt, user message) pair used to enrich an image prompt.
+    The lore is deduplicated and trimmed to fit the LLM context next to
+    max_new_tokens (see build_lore_context).
+    """
+    lore_context = build_lore_context(
+        user_prompt,
+        lore_results,
+        IMAGE_PROMPT_SYSTEM_PROMPT,
+        _image_prompt_user_message(user_prompt, ""),
+        max_new_tokens,
+    )
+    return IMAGE_PROMPT_SYSTEM_PROMPT, _image_prompt_user_message(user_prompt, lore_context)
+
+def rag_result_key(kind: str, **parts) -> str:
+    """
+    Result cache key for a RAG + LLM result: the given inputs plus the LLM,
+    the embedding model, the retrieval settings, the lore token budget and the
+    lore index version, so any of them changing invalidates the entry.
+    """
+    return make_key(
+        kind,
+        llm=get_llm_name(),
+        embedding_model=DEFAULT_EMBEDDING_MODEL,
+        lore_version=get_lore_index_version(),
+        retrieval=get_retrieval_config(),
+        lore_context_tokens=LORE_CONTEXT_TOKENS,
+        **parts,
+    )
+
+def rag_enrich_image_prompt(
+    user_prompt: str,
+    top_k: int = 3,
+    use_cache: bool = True,
+    seed: Optional[int] = None,
+) -> str:
+    """
+    Uses RAG to enrich a user prompt with relevant lore,
+    then asks the LLM to create a single, vivid image prompt.
+
+    Repeated calls with the same prompt and settings are served from the
+    result cache; pass use_cache=False (or a new seed) for a fresh sample.
+
+    Returns: enriched prompt string.
+    """
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        key = rag_result_key(
+            "enriched_prompt",
+            prompt=user_prompt.strip(),
+            top_k=top_k,
+            max_new_tokens=ENRICH_MAX_NEW_TOKENS,
+            temperature=0.7,
+            seed=seed,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    # 1) Retrieve relevant lore
+    lore_results = retrieve_lore(user_prompt, top_k=top_k)
+
+    # 2) Build system + user prompts for LLM
+    system_prompt, user_message = build_image_prompt_messages(user_prompt, lore_results)
+
     enriched_prompt = generate_text(
             system_prompt=system_prompt,
             user_prompt=user_message,
-            max_new_tokens=120,
+            max_new_tokens=ENRICH_MAX_NEW_TOKENS,
             temperature=0.7,
+            seed=seed,
         )
 
         # Clean up whitespace
     enriched_prompt = enriched_prompt.replace("\n", " ").strip()
+    if cache is not None:
+        cache.put(key, "enriched_prompt", enriched_prompt)
     return enriched_prompt
 
+def rag_enrich_image_prompts(user_prompts: List[str], top_k: int = 3) -> List[str]:
+    """
+    Batch version of rag_enrich_image_prompt: lore for all prompts is
+    retrieved with a single retrieve_lore_batch call.
+
+    Returns: enriched prompt strings, in input order.
+    """
+    all_lore_results = retrieve_lore_batch(user_prompts, top_k=top_k)
+
+    enriched_prompts = []
+    for user_prompt, lore_results in zip(user_prompts, all_lore_results):
+        system_prompt, user_message = build_image_prompt_messages(user_prompt, lore_results)
+        enriched_prompt = generate_text(
+            system_prompt=system_prompt,
+            user_prompt=user_message,
+            max_new_tokens=ENRICH_MAX_NEW_TOKENS,
+            temperature=0.7,
+        )
+        enriched_prompts.append(enriched_prompt.replace("\n", " ").strip())
+
+    return enriched_prompts
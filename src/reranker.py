@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Optional
+import os
+import time
+
+from src.tracing import trace_stage
+
+# Cross-encoder used to rerank fused retrieval candidates; empty disables reranking
+DEFAULT_RERANKER = os.environ.get("RERANKER", "")
+# Candidates scored per cross-encoder call; the budget is checked between batches
+RERANK_BATCH_SIZE = 8
+
+_reranker = None
+_reranker_name = None
+
+
+def load_reranker(model_name: Optional[str] = None):
+    """
+    Lazily loads the cross-encoder (e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2").
+    """
+    global _reranker, _reranker_name
+    model_name = model_name or DEFAULT_RERANKER
+    if not model_name:
+        raise ValueError("No reranker configured; set $RERANKER to a cross-encoder model name")
+    if _reranker is None or _reranker_name != model_name:
+        from sentence_transformers import CrossEncoder
+
+        with trace_stage("load.reranker", model=model_name):
+            _reranker = CrossEncoder(model_name, max_length=256)
+        _reranker_name = model_name
+    return _reranker
+
+
+def rerank(query: str, candidates: List[Dict[str, Any]], budget_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Reorders candidates (dicts with 'text') by cross-encoder relevance.
+
+    Candidates are scored in batches in their incoming order; once budget_ms
+    is spent the rest are not scored and keep their order after the scored
+    ones. Scored candidates get a 'rerank_score'.
+    """
+    if not candidates:
+        return []
+    model = load_reranker()
+    deadline = None if budget_ms is None else time.perf_counter() + budget_ms / 1000.0
+
+    scored = []
+    for start in range(0, len(candidates), RERANK_BATCH_SIZE):
+        if deadline is not None and scored and time.perf_counter() > deadline:
+            break
+        batch = candidates[start:start + RERANK_BATCH_SIZE]
+        scores = model.predict([(query, c["text"]) for c in batch])
+        scored.extend({**c, "rerank_score": float(s)} for c, s in zip(batch, scores))
+
+    scored.sort(key=lambda c: c["rerank_score"], reverse=True)
+    return scored + candidates[len(scored):]
@@ -0,0 +1,137 @@
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Set RESULT_CACHE=0 to bypass the cache everywhere
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE", "1") == "1"
+DEFAULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "data/cache/results.sqlite")
+DEFAULT_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+# Marker for "use the cache's default TTL" (None already means "never expires")
+_DEFAULT_TTL = object()
+
+
+def make_key(kind: str, **parts: Any) -> str:
+    """
+    Stable key for a result: hash of the result kind plus every input that
+    affects it (input text/image hash, model names, parameters, seed, lore version).
+    """
+    payload = json.dumps({"kind": kind, **parts}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent SQLite cache for end-to-end results (enriched prompts,
+    captions, stories).
+
+    Entries expire after their TTL (ttl=None never expires) and the cache is
+    kept under max_entries by evicting the least recently used entries.
+    Safe to share between threads and between processes (WAL mode).
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, kind: str, value: Any, ttl_seconds: Any = _DEFAULT_TTL):
+        """
+        Stores value (JSON-serializable). ttl_seconds defaults to the cache's
+        TTL; None means the entry never expires.
+        """
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is _DEFAULT_TTL else ttl_seconds
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, kind, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(value), expires_at, now),
+            )
+            self._evict_locked(now)
+            self._conn.commit()
+
+    def _evict_locked(self, now: float):
+        self._conn.execute("DELETE FROM results WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self, kind: Optional[str] = None):
+        with self._lock:
+            if kind is None:
+                self._conn.execute("DELETE FROM results")
+            else:
+                self._conn.execute("DELETE FROM results WHERE kind = ?", (kind,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, COUNT(*) FROM results GROUP BY kind").fetchall()
+        return {"hits": self.hits, "misses": self.misses, "entries": dict(rows)}
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Returns the process-wide result cache, or None when RESULT_CACHE=0.
+    """
+    global _cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
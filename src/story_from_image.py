@@ -1,15 +1,117 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
-from src.image_caption import caption_image
-from src.rag_index import retrieve_lore
-from src.rag_prompting import format_lore_context
-from src.text_llm import generate_text
+from src.image_caption import caption_image, caption_images, image_content_hash, ImageInput
+from src.rag_index import retrieve_lore, retrieve_lore_batch
+from src.context_budget import build_lore_context
+from src.rag_prompting import rag_result_key
+from src.result_cache import get_result_cache
+from src.tracing import collect_stages, stage_breakdown, trace_stage
+from src.text_llm import generate_text, stream_text
+
+STORY_SYSTEM_PROMPT = (
+    "You are a skilled sci-fi noir storyteller. You write short, atmospheric stories "
+    "set in a futuristic detective universe. Your stories are grounded, vivid, and "
+    "focus on mood, character, and subtle mystery.\n\n"
+    "You will be given:\n"
+    "- an image caption (describing what appears in the image)\n"
+    "- some universe lore (locations, characters, rules, themes)\n\n"
+    "Your job is to write a coherent story that:\n"
+    "- is consistent with both the caption and the lore\n"
+    "- feels like a detective or mystery story in a sci-fi world\n"
+    "- uses concrete sensory details (light, sound, weather, tech)\n"
+    "- has a beginning, middle, and an implied or soft ending\n"
+    "- stays between roughly 300 and 700 words.\n"
+)
+
+def _story_user_prompt(caption: str, lore_context: str) -> str:
+    return f"""
+Image caption:
+{caption}
+
+Relevant universe lore:
+{lore_context}
+
+Task:
+Write a short story inspired by the image and grounded in the lore. 
+Do NOT mention the words 'caption', 'lore', or any list labels. 
+Write in third person, with a moody, cinematic tone.
+""".strip()
+
+def build_story_messages(caption: str, lore_results: List[dict], max_new_tokens: int = 400) -> Tuple[str, str]:
+    """
+    Builds the (system prompt, user prompt) pair for story generation.
+    The lore is deduplicated and trimmed to fit the LLM context next to
+    max_new_tokens (see build_lore_context).
+    """
+    lore_context = build_lore_context(
+        caption, lore_results, STORY_SYSTEM_PROMPT, _story_user_prompt(caption, ""), max_new_tokens
+    )
+    return STORY_SYSTEM_PROMPT, _story_user_prompt(caption, lore_context)
+
+def _image_path_or_none(image: ImageInput) -> Optional[str]:
+    return image if isinstance(image, str) else None
+
+def _story_key(image: ImageInput, top_k_lore: int, max_new_tokens: int, temperature: float, seed: Optional[int]) -> str:
+    return rag_result_key(
+        "story",
+        image=image_content_hash(image),
+        top_k=top_k_lore,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        seed=seed,
+    )
+
+def _run_story_pipeline(
+    image_path: ImageInput,
+    top_k_lore: int,
+    max_new_tokens: int,
+    temperature: float,
+    use_cache: bool,
+    seed: Optional[int],
+) -> Dict[str, Any]:
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        key = _story_key(image_path, top_k_lore, max_new_tokens, temperature, seed)
+        with trace_stage("cache.lookup", kind="story") as record:
+            cached = cache.get(key)
+            record["hit"] = cached is not None
+        if cached is not None:
+            return {"image_path": _image_path_or_none(image_path), **cached}
+
+    # 1) Caption the image
+    caption = caption_image(image_path)
+
+    # 2) Retrieve lore
+    lore_results = retrieve_lore(caption, top_k=top_k_lore)
+
+    # 3) Build prompts for LLM
+    system_prompt, user_prompt = build_story_messages(caption, lore_results, max_new_tokens)
+
+    story = generate_text(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        seed=seed,
+    )
+
+    # Package everything
+    result = {
+        "caption": caption,
+        "lore_chunks": [r.get("text", "") for r in lore_results],
+        "story": story.strip(),
+    }
+    if cache is not None:
+        cache.put(key, "story", result)
+    return {"image_path": _image_path_or_none(image_path), **result}
 
 def generate_story_from_image(
-    image_path: str,
+    image_path: ImageInput,
     top_k_lore: int = 3,
     max_new_tokens: int = 400,
     temperature: float = 0.8,
+    use_cache: bool = True,
+    seed: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
     Full pipeline:
@@ -17,59 +119,123 @@ def generate_story_from_image(
     - retrieve relevant lore using the caption as query
     - generate a short story grounded in the caption + lore
 
+    image_path may also be encoded image bytes or a PIL image, so in-memory
+    uploads need not be written to disk first.
+
+    The same image with the same settings is served from the result cache;
+    pass use_cache=False (or a new seed) for a fresh story.
+
     Returns a dict with:
-    - 'image_path'
+    - 'image_path' (None for in-memory images)
     - 'caption'
     - 'lore_chunks'
     - 'story'
+    - 'timings' (per-stage wall/CPU time, tokens/sec and peak RSS, in run order)
     """
-    # 1) Caption the image
-    caption = caption_image(image_path)
+    with collect_stages() as stages:
+        result = _run_story_pipeline(image_path, top_k_lore, max_new_tokens, temperature, use_cache, seed)
+    result["timings"] = stage_breakdown(stages)
+    return result
 
-    # 2) Retrieve lore
-    lore_results = retrieve_lore(caption, top_k=top_k_lore)
-    lore_context = format_lore_context(lore_results)
+def stream_story_from_image(
+    image_path: ImageInput,
+    top_k_lore: int = 3,
+    max_new_tokens: int = 400,
+    temperature: float = 0.8,
+    use_cache: bool = True,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Streaming variant of generate_story_from_image.
 
-    # 3) Build prompts for LLM
-    system_prompt = (
-        "You are a skilled sci-fi noir storyteller. You write short, atmospheric stories "
-        "set in a futuristic detective universe. Your stories are grounded, vivid, and "
-        "focus on mood, character, and subtle mystery.\n\n"
-        "You will be given:\n"
-        "- an image caption (describing what appears in the image)\n"
-        "- some universe lore (locations, characters, rules, themes)\n\n"
-        "Your job is to write a coherent story that:\n"
-        "- is consistent with both the caption and the lore\n"
-        "- feels like a detective or mystery story in a sci-fi world\n"
-        "- uses concrete sensory details (light, sound, weather, tech)\n"
-        "- has a beginning, middle, and an implied or soft ending\n"
-        "- stays between roughly 300 and 700 words.\n"
-    )
+    Captioning and retrieval run eagerly; the story is not generated yet.
+    On a result cache hit the stream yields the cached story in one piece.
+    Returns a dict with:
+    - 'image_path' (None for in-memory images)
+    - 'caption'
+    - 'lore_chunks'
+    - 'story_stream' (iterator yielding story text as it is generated)
+    """
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        key = _story_key(image_path, top_k_lore, max_new_tokens, temperature, seed)
+        cached = cache.get(key)
+        if cached is not None:
+            return {
+                "image_path": _image_path_or_none(image_path),
+                "caption": cached["caption"],
+                "lore_chunks": cached["lore_chunks"],
+                "story_stream": (piece for piece in [cached["story"]]),
+            }
 
-    user_prompt = f"""
-Image caption:
-{caption}
+    caption = caption_image(image_path)
 
-Relevant universe lore:
-{lore_context}
+    lore_results = retrieve_lore(caption, top_k=top_k_lore)
+    lore_chunks = [r.get("text", "") for r in lore_results]
 
-Task:
-Write a short story inspired by the image and grounded in the lore. 
-Do NOT mention the words 'caption', 'lore', or any list labels. 
-Write in third person, with a moody, cinematic tone.
-""".strip()
+    system_prompt, user_prompt = build_story_messages(caption, lore_results, max_new_tokens)
 
-    story = generate_text(
+    story_stream = stream_text(
         system_prompt=system_prompt,
         user_prompt=user_prompt,
         max_new_tokens=max_new_tokens,
         temperature=temperature,
+        seed=seed,
     )
 
-    # Package everything
+    def caching_stream():
+        # Store the story once the stream has been fully consumed
+        pieces = []
+        try:
+            for piece in story_stream:
+                pieces.append(piece)
+                yield piece
+        finally:
+            # Stops generation if the consumer gave up early
+            story_stream.close()
+        result = {"caption": caption, "lore_chunks": lore_chunks, "story": "".join(pieces).strip()}
+        cache.put(key, "story", result)
+
     return {
-        "image_path": image_path,
+        "image_path": _image_path_or_none(image_path),
         "caption": caption,
-        "lore_chunks": [r.get("text", "") for r in lore_results],
-        "story": story.strip(),
+        "lore_chunks": lore_chunks,
+        "story_stream": caching_stream() if cache is not None else story_stream,
     }
+
+def generate_stories_from_images(
+    image_paths: List[ImageInput],
+    top_k_lore: int = 3,
+    max_new_tokens: int = 400,
+    temperature: float = 0.8,
+    caption_batch_size: int = 8,
+) -> List[Dict[str, Any]]:
+    """
+    Batch version of generate_story_from_image: images are captioned in
+    batches with caption_images and lore for all captions is retrieved with
+    a single retrieve_lore_batch call.
+
+    Returns one result dict per image (same keys), in input order.
+    """
+    captions = caption_images(image_paths, batch_size=caption_batch_size)
+    all_lore_results = retrieve_lore_batch(captions, top_k=top_k_lore)
+
+    results = []
+    for image_path, caption, lore_results in zip(image_paths, captions, all_lore_results):
+        system_prompt, user_prompt = build_story_messages(caption, lore_results, max_new_tokens)
+        story = generate_text(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+        )
+        results.append(
+            {
+                "image_path": _image_path_or_none(image_path),
+                "caption": caption,
+                "lore_chunks": [r.get("text", "") for r in lore_results],
+                "story": story.strip(),
+            }
+        )
+
+    return results
@@ -0,0 +1,11 @@
+import glob
+
+from image_caption import caption_images
+
+# Caption every uploaded image in one batched pass
+image_paths = sorted(glob.glob("outputs/uploaded/*.png"))
+
+print(f"Captioning {len(image_paths)} images...")
+captions = caption_images(image_paths, batch_size=4)
+for path, caption in zip(image_paths, captions):
+    print(f"{path}: {caption}")
@@ -1,79 +1,520 @@
-from typing import Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import copy
+import os
+import threading
+import time
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+from src.quantization import QUANTIZATION_MODES, model_size_mb, quantize_model
+from src.tracing import rss_mb, trace_stage
 
 
 _LLM_MODEL = None
 _LLM_TOKENIZER = None
+_LLM_MODEL_NAME = None
+_LLM_QUANTIZATION = None
+_DRAFT_MODEL = None
+_DRAFT_MODEL_NAME = None
+
+# Prefix KV cache: system prompt text -> (prefix token ids, past_key_values)
+PREFIX_CACHE_SIZE = int(os.environ.get("LLM_PREFIX_CACHE_SIZE", "8"))
+_PREFIX_CACHE: "OrderedDict[str, Tuple[torch.Tensor, Any]]" = OrderedDict()
+_PREFIX_CACHE_LOCK = threading.Lock()
+
+# Route generate_text through the cross-request micro-batching scheduler
+LLM_BATCHING = os.environ.get("LLM_BATCHING", "0") == "1"
 
 # You can change this to another instruct model if you want later
 DEFAULT_LLM_NAME = "microsoft/phi-2"  # small-ish, general model
 
+# Weight quantization applied on CPU (see src.quantization.QUANTIZATION_MODES):
+# int8 roughly quarters phi-2's ~11 GB fp32 footprint, so several workers fit on one box
+LLM_QUANTIZATION = os.environ.get("LLM_QUANTIZATION", "none")
+
+# Speculative (assisted) decoding: a small draft LM proposes tokens that the LLM verifies
+# in one forward pass. Sampling stays distributed exactly as without a draft model.
+LLM_SPECULATIVE = os.environ.get("LLM_SPECULATIVE", "0") == "1"
+# Must share the LLM's tokenizer; phi-1.5 (1.3B) does for phi-2
+DEFAULT_DRAFT_MODEL = os.environ.get("LLM_DRAFT_MODEL", "microsoft/phi-1_5")
+# Tokens proposed per verification step (adapted by transformers as tokens get accepted/rejected)
+DRAFT_NUM_TOKENS = int(os.environ.get("LLM_DRAFT_TOKENS", "5"))
+
+# Running totals over speculative generate calls (see speculative_stats)
+_SPECULATIVE_STATS = {"calls": 0, "tokens": 0, "draft_tokens": 0, "accepted_tokens": 0, "seconds": 0.0}
+_SPECULATIVE_LOCK = threading.Lock()
+
+# Context window (prompt + generated tokens) assumed before the model is loaded; phi-2's is 2048
+LLM_CONTEXT_TOKENS = int(os.environ.get("LLM_CONTEXT_TOKENS", "2048"))
+
 
-def load_llm(model_name: str = DEFAULT_LLM_NAME, device: Optional[str] = None):
+def _resolve_quantization(quantization: Optional[str], device: str) -> str:
+    quantization = quantization or LLM_QUANTIZATION
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown LLM quantization '{quantization}'. Available: {', '.join(QUANTIZATION_MODES)}")
+    if quantization != "none" and device != "cpu":
+        # The quantized kernels are CPU ones; GPUs already run the model in fp16
+        print(f"[load_llm] Quantization '{quantization}' is CPU-only, loading fp16 on {device}.")
+        return "none"
+    return quantization
+
+
+def load_llm(model_name: str = DEFAULT_LLM_NAME, device: Optional[str] = None, quantization: Optional[str] = None):
     """
     Lazily loads a causal LM and tokenizer.
     You can swap model_name to another instruct-tuned model later.
+
+    On CPU the linear layers are quantized according to quantization
+    (default: $LLM_QUANTIZATION).
     """
-    global _LLM_MODEL, _LLM_TOKENIZER
+    global _LLM_MODEL, _LLM_TOKENIZER, _LLM_MODEL_NAME, _LLM_QUANTIZATION
 
     if _LLM_MODEL is not None and _LLM_TOKENIZER is not None:
         return _LLM_MODEL, _LLM_TOKENIZER
 
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
+    quantization = _resolve_quantization(quantization, device)
 
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-    )
+    with trace_stage("load.llm", model=model_name, device=device, quantization=quantization):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            low_cpu_mem_usage=True,
+        )
 
-    model.to(device)
+        model.to(device)
 
+    if quantization != "none":
+        fp32_mb = model_size_mb(model)
+        with trace_stage("load.llm_quantize", mode=quantization):
+            quantize_model(model, quantization)
+        print(
+            f"[load_llm] {quantization}: weights {fp32_mb:.0f} MB -> {model_size_mb(model):.0f} MB "
+            f"(RSS {rss_mb():.0f} MB)"
+        )
+
+    model.eval()
     _LLM_MODEL = model
     _LLM_TOKENIZER = tokenizer
+    _LLM_MODEL_NAME = model_name
+    _LLM_QUANTIZATION = quantization
 
     return model, tokenizer
 
 
+def load_draft_model(model_name: Optional[str] = None):
+    """
+    Lazily loads the draft LM for speculative decoding, on the LLM's device
+    and dtype. Raises ValueError if its vocabulary differs from the LLM's,
+    since the draft's tokens are verified as LLM tokens.
+    """
+    global _DRAFT_MODEL, _DRAFT_MODEL_NAME
+    model_name = model_name or DEFAULT_DRAFT_MODEL
+    if _DRAFT_MODEL is not None and _DRAFT_MODEL_NAME == model_name:
+        return _DRAFT_MODEL
+
+    model, tokenizer = load_llm()
+    param = next(model.parameters())
+    with trace_stage("load.llm_draft", model=model_name):
+        draft_tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            raise ValueError(f"Draft model '{model_name}' does not share the tokenizer of '{get_llm_name()}'")
+        draft = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=param.dtype, low_cpu_mem_usage=True)
+        draft.to(param.device).eval()
+        draft.generation_config.num_assistant_tokens = DRAFT_NUM_TOKENS
+
+    _DRAFT_MODEL = draft
+    _DRAFT_MODEL_NAME = model_name
+    return draft
+
+
+@contextmanager
+def _count_forwards(*models) -> Iterator[List[int]]:
+    """
+    Counts forward calls of each model inside the block (yielded list, in
+    argument order). Concurrent generate calls on the same model would be
+    counted together.
+    """
+    counts = [0] * len(models)
+    handles = []
+    for i, model in enumerate(models):
+        def hook(module, args, i=i):
+            counts[i] += 1
+        handles.append(model.register_forward_pre_hook(hook))
+    try:
+        yield counts
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+@contextmanager
+def _speculative(use_speculative: Optional[bool], model) -> Iterator[Dict[str, Any]]:
+    """
+    Yields extra generate() kwargs (the draft model, when speculative
+    decoding is on) and afterwards stores the acceptance statistics in the
+    dict under 'stats' once 'tokens' has been set in it by the caller.
+    """
+    if use_speculative is None:
+        use_speculative = LLM_SPECULATIVE
+    state: Dict[str, Any] = {"kwargs": {}}
+    if not use_speculative:
+        yield state
+        return
+
+    draft = load_draft_model()
+    state["kwargs"]["assistant_model"] = draft
+    start = time.perf_counter()
+    with _count_forwards(model, draft) as counts:
+        yield state
+    seconds = time.perf_counter() - start
+
+    # Every verification step keeps the accepted draft tokens plus one token of the LLM's own
+    tokens = state.get("tokens", 0)
+    target_forwards, draft_tokens = counts
+    accepted = max(0, tokens - target_forwards)
+    state["stats"] = {
+        "draft_tokens": draft_tokens,
+        "accepted_tokens": accepted,
+        "acceptance_rate": round(accepted / draft_tokens, 3) if draft_tokens else None,
+    }
+    with _SPECULATIVE_LOCK:
+        _SPECULATIVE_STATS["calls"] += 1
+        _SPECULATIVE_STATS["tokens"] += tokens
+        _SPECULATIVE_STATS["draft_tokens"] += draft_tokens
+        _SPECULATIVE_STATS["accepted_tokens"] += accepted
+        _SPECULATIVE_STATS["seconds"] += seconds
+
+
+def speculative_stats() -> Dict[str, Any]:
+    """
+    Totals of speculative generate calls in this process: draft tokens
+    proposed and accepted, acceptance rate and tokens/sec.
+    """
+    with _SPECULATIVE_LOCK:
+        stats = dict(_SPECULATIVE_STATS)
+    stats["draft_model"] = _DRAFT_MODEL_NAME
+    stats["acceptance_rate"] = round(stats["accepted_tokens"] / stats["draft_tokens"], 3) if stats["draft_tokens"] else None
+    stats["tokens_per_second"] = round(stats["tokens"] / stats["seconds"], 2) if stats["seconds"] else None
+    return stats
+
+
+def _get_prefix_kv(model, tokenizer, prefix: str) -> Tuple[torch.Tensor, Any]:
+    """
+    Returns (token ids, past_key_values) for a prompt prefix, computing the
+    prefix forward pass only the first time a given prefix is seen.
+    Bounded LRU of PREFIX_CACHE_SIZE entries.
+    """
+    with _PREFIX_CACHE_LOCK:
+        entry = _PREFIX_CACHE.get(prefix)
+        if entry is not None:
+            _PREFIX_CACHE.move_to_end(prefix)
+            return entry
+
+    device = next(model.parameters()).device
+    prefix_ids = tokenizer(prefix, return_tensors="pt").input_ids.to(device)
+    with trace_stage("llm.prefix_prefill", prefix_tokens=prefix_ids.shape[1]), torch.no_grad():
+        past_key_values = model(input_ids=prefix_ids, use_cache=True).past_key_values
+
+    with _PREFIX_CACHE_LOCK:
+        _PREFIX_CACHE[prefix] = (prefix_ids, past_key_values)
+        _PREFIX_CACHE.move_to_end(prefix)
+        while len(_PREFIX_CACHE) > PREFIX_CACHE_SIZE:
+            _PREFIX_CACHE.popitem(last=False)
+
+    return prefix_ids, past_key_values
+
+
+def get_llm_name() -> str:
+    """
+    Name of the loaded LLM (or the default one if nothing is loaded yet),
+    with the quantization mode appended when it is not fp32, since quantized
+    weights change the outputs.
+    """
+    name = _LLM_MODEL_NAME or DEFAULT_LLM_NAME
+    quantization = _LLM_QUANTIZATION
+    if quantization is None:
+        quantization = LLM_QUANTIZATION if not torch.cuda.is_available() else "none"
+    return name if quantization == "none" else f"{name}@{quantization}"
+
+
+def get_llm_tokenizer():
+    """
+    The LLM's tokenizer, loaded on its own if the model is not loaded yet
+    (for measuring prompts before generation).
+    """
+    global _LLM_TOKENIZER
+    if _LLM_TOKENIZER is None:
+        _LLM_TOKENIZER = AutoTokenizer.from_pretrained(_LLM_MODEL_NAME or DEFAULT_LLM_NAME)
+    return _LLM_TOKENIZER
+
+
+def get_llm_context_window() -> int:
+    """
+    Max prompt + generated tokens of the LLM.
+    """
+    if _LLM_MODEL is not None:
+        return getattr(_LLM_MODEL.config, "max_position_embeddings", None) or LLM_CONTEXT_TOKENS
+    return LLM_CONTEXT_TOKENS
+
+
+def format_prompt(system_prompt: str, user_prompt: str) -> str:
+    # Simple prompt format for phi-2 or generic causal LMs
+    return f"{system_prompt.strip()}\n\nUser: {user_prompt.strip()}\nAssistant:"
+
+
+def count_prompt_tokens(system_prompt: str, user_prompt: str) -> int:
+    """
+    Prompt length in LLM tokens, as generate_text will tokenize it.
+    """
+    return len(get_llm_tokenizer()(format_prompt(system_prompt, user_prompt)).input_ids)
+
+
+def _fit_max_new_tokens(prompt_tokens: int, max_new_tokens: int) -> int:
+    """
+    Caps max_new_tokens to what is left of the context window after the
+    prompt; raises ValueError when the prompt alone does not fit.
+    """
+    room = get_llm_context_window() - prompt_tokens
+    if room <= 0:
+        raise ValueError(
+            f"Prompt of {prompt_tokens} tokens does not fit the LLM context window of {get_llm_context_window()} tokens"
+        )
+    if max_new_tokens > room:
+        print(f"[text_llm] Prompt uses {prompt_tokens} tokens, capping max_new_tokens {max_new_tokens} -> {room}.")
+    return min(max_new_tokens, room)
+
+
+def clear_prefix_cache():
+    with _PREFIX_CACHE_LOCK:
+        _PREFIX_CACHE.clear()
+
+
+def _prepare_inputs(
+    model,
+    tokenizer,
+    system_prompt: str,
+    user_prompt: str,
+    use_prefix_cache: bool,
+) -> Tuple[torch.Tensor, Dict[str, Any]]:
+    """
+    Builds the prompt token ids plus extra generate() kwargs (the cached
+    prefix KV when use_prefix_cache is on).
+    """
+    device = next(model.parameters()).device
+
+    # Tokenized as a whole, exactly like count_prompt_tokens, so the cache never
+    # changes the tokens the model sees
+    input_ids = tokenizer(format_prompt(system_prompt, user_prompt), return_tensors="pt").input_ids.to(device)
+
+    generate_kwargs = {}
+    if use_prefix_cache:
+        # The cached prefix stops before the whitespace after the system prompt,
+        # which BPE tokenizers merge differently at the end of a text
+        prefix_ids, prefix_kv = _get_prefix_kv(model, tokenizer, system_prompt.strip())
+        n = prefix_ids.shape[1]
+        if n < input_ids.shape[1] and torch.equal(input_ids[:, :n], prefix_ids):
+            # generate() extends the cache in place, so every call gets its own copy
+            generate_kwargs["past_key_values"] = copy.deepcopy(prefix_kv)
+        # else: the prompt tokenizes differently at the boundary, so prefill it all
+
+    generate_kwargs["attention_mask"] = torch.ones_like(input_ids)
+    return input_ids, generate_kwargs
+
+
 def generate_text(
     system_prompt: str,
     user_prompt: str,
     max_new_tokens: int = 128,
     temperature: float = 0.7,
+    use_prefix_cache: bool = True,
+    use_batching: Optional[bool] = None,
+    seed: Optional[int] = None,
+    use_speculative: Optional[bool] = None,
 ) -> str:
     """
     Simple helper to generate text from the LLM using a system + user prompt.
 
     For now this is plain concatenation; later we can adapt formatting
     if you switch to a chat-style model.
+
+    With use_prefix_cache the KV cache of the system prompt is computed once
+    and reused, so each call only prefills the user part of the prompt.
+    With use_batching (default: $LLM_BATCHING) the call is handed to the
+    micro-batching scheduler and batched with concurrent calls instead.
+    seed makes sampling reproducible (not applied to batched calls).
+    With use_speculative (default: $LLM_SPECULATIVE) a draft model proposes
+    tokens for the LLM to verify; draft acceptance is recorded on the
+    llm.generate trace stage. Not combined with batching.
+    """
+    if use_batching is None:
+        use_batching = LLM_BATCHING
+    if use_speculative is None:
+        use_speculative = LLM_SPECULATIVE
+    if use_batching and seed is None and not use_speculative:
+        from src.llm_scheduler import get_llm_scheduler
+
+        # The batched generate() itself is traced in the scheduler thread
+        with trace_stage("llm.generate_batched", max_new_tokens=max_new_tokens):
+            return get_llm_scheduler().generate(system_prompt, user_prompt, max_new_tokens, temperature)
+
+    model, tokenizer = load_llm()
+    with trace_stage("llm.tokenize"):
+        input_ids, generate_kwargs = _prepare_inputs(model, tokenizer, system_prompt, user_prompt, use_prefix_cache)
+    max_new_tokens = _fit_max_new_tokens(input_ids.shape[1], max_new_tokens)
+
+    if seed is not None:
+        torch.manual_seed(seed)
+
+    with trace_stage("llm.generate", prompt_tokens=input_ids.shape[1]) as record, torch.no_grad():
+        with _speculative(use_speculative, model) as speculative:
+            outputs = model.generate(
+                input_ids=input_ids,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                do_sample=True,
+                pad_token_id=tokenizer.eos_token_id,
+                **generate_kwargs,
+                **speculative["kwargs"],
+            )
+            speculative["tokens"] = record["tokens"] = outputs.shape[1] - input_ids.shape[1]
+        record.update(speculative.get("stats", {}))
+
+    # Only decode the completion, not the prompt
+    generated = tokenizer.decode(outputs[0][input_ids.shape[1]:], skip_special_tokens=True)
+
+    return generated.strip()
+
+
+def generate_texts(
+    system_prompts: List[str],
+    user_prompts: List[str],
+    max_new_tokens: int = 128,
+    temperature: float = 0.7,
+) -> List[str]:
+    """
+    Batched generate_text: left-pads all prompts into one batch and runs a
+    single generate() call. Returns completions in input order.
+    (The prefix KV cache is not used here, since prompts are padded together.)
     """
     model, tokenizer = load_llm()
     device = next(model.parameters()).device
 
-    # Simple prompt format for phi-2 or generic causal LMs
-    full_prompt = f"{system_prompt.strip()}\n\nUser: {user_prompt.strip()}\nAssistant:"
+    prompts = [
+        format_prompt(system_prompt, user_prompt)
+        for system_prompt, user_prompt in zip(system_prompts, user_prompts)
+    ]
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
 
-    inputs = tokenizer(
-        full_prompt,
-        return_tensors="pt",
-    ).to(device)
+    # Left padding keeps every prompt flush against its first generated token
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True, padding_side="left").to(device)
+    max_new_tokens = _fit_max_new_tokens(inputs.input_ids.shape[1], max_new_tokens)
 
-    with torch.no_grad():
+    with trace_stage("llm.generate", batch_size=len(prompts)) as record, torch.no_grad():
         outputs = model.generate(
             **inputs,
             max_new_tokens=max_new_tokens,
             temperature=temperature,
             do_sample=True,
-            pad_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.pad_token_id,
         )
+        # Upper bound: includes padding after sequences that finished early
+        record["tokens"] = (outputs.shape[1] - inputs.input_ids.shape[1]) * outputs.shape[0]
+
+    completions = tokenizer.batch_decode(outputs[:, inputs.input_ids.shape[1]:], skip_special_tokens=True)
+    return [completion.strip() for completion in completions]
+
+
+class _StopOnEvent(StoppingCriteria):
+    """
+    Ends generate() at the next token once the event is set.
+    """
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def stream_text(
+    system_prompt: str,
+    user_prompt: str,
+    max_new_tokens: int = 128,
+    temperature: float = 0.7,
+    use_prefix_cache: bool = True,
+    seed: Optional[int] = None,
+    use_speculative: Optional[bool] = None,
+) -> Iterator[str]:
+    """
+    Streaming version of generate_text: yields pieces of the completion as
+    they are generated. generate() runs in a background thread feeding a
+    TextIteratorStreamer; joining the yielded pieces gives the full text.
+    With speculative decoding, accepted draft tokens arrive in bursts.
+    Closing the iterator early (or dropping it) stops generate() at the
+    next token, so an abandoned stream does not keep the CPU busy.
+    """
+    model, tokenizer = load_llm()
+    with trace_stage("llm.tokenize"):
+        input_ids, generate_kwargs = _prepare_inputs(model, tokenizer, system_prompt, user_prompt, use_prefix_cache)
+    max_new_tokens = _fit_max_new_tokens(input_ids.shape[1], max_new_tokens)
+
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors = []
+    speculative_stats_out: Dict[str, Any] = {}
+    stop = threading.Event()
+
+    def _generate():
+        if seed is not None:
+            torch.manual_seed(seed)
+        try:
+            with torch.no_grad(), _speculative(use_speculative, model) as speculative:
+                outputs = model.generate(
+                    input_ids=input_ids,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    do_sample=True,
+                    pad_token_id=tokenizer.eos_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop)]),
+                    **generate_kwargs,
+                    **speculative["kwargs"],
+                )
+                speculative["tokens"] = outputs.shape[1] - input_ids.shape[1]
+            speculative_stats_out.update(speculative.get("stats", {}))
+        except Exception as e:
+            errors.append(e)
+            # Unblock the consumer
+            streamer.end()
 
-    generated = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    thread = threading.Thread(target=_generate, daemon=True)
+    thread.start()
 
-    # Remove the prompt part, return only the completion after "Assistant:"
-    if "Assistant:" in generated:
-        generated = generated.split("Assistant:", 1)[1].strip()
+    # Timed from the consumer's side, so it includes time spent between pieces
+    with trace_stage("llm.stream", prompt_tokens=input_ids.shape[1]) as record:
+        pieces = []
+        started = False
+        try:
+            for piece in streamer:
+                if not started:
+                    # Match generate_text, which strips leading whitespace
+                    piece = piece.lstrip()
+                    started = bool(piece)
+                if piece:
+                    pieces.append(piece)
+                    yield piece
+        finally:
+            # Also reached when the consumer closes the stream early
+            stop.set()
 
-    return generated
+        thread.join()
+        if errors:
+            raise errors[0]
+        record["tokens"] = len(tokenizer("".join(pieces), add_special_tokens=False).input_ids)
+        record.update(speculative_stats_out)
@@ -0,0 +1,233 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Unix only; peak_rss_mb reports 0.0 without it (e.g. on Windows)
+    resource = None
+
+# Set TRACE=0 to turn stage tracing off (trace_stage becomes a no-op)
+TRACE_ENABLED = os.environ.get("TRACE", "1") == "1"
+# Every stage record is appended here as one JSON line; empty disables the log
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "outputs/traces/stages.jsonl")
+# Size at which the log is rotated to TRACE_LOG_PATH + '.1' (one old log is kept)
+TRACE_LOG_MAX_MB = float(os.environ.get("TRACE_LOG_MAX_MB", "50"))
+# Port for the Prometheus-style /metrics endpoint; 0 disables it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Stage collectors of the current context, innermost last (see collect_stages)
+_collectors: ContextVar[Tuple[List[Dict[str, Any]], ...]] = ContextVar("trace_collectors", default=())
+
+_lock = threading.Lock()
+_log_file = None
+# stage -> aggregated counters for the metrics endpoint
+_metrics: Dict[str, Dict[str, float]] = {}
+
+
+def rss_mb() -> float:
+    """
+    Current resident set size of this process in MB (0.0 if unavailable).
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process so far, in MB (0.0 if unavailable).
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _write_log(record: Dict[str, Any]):
+    global _log_file
+    if not TRACE_LOG_PATH:
+        return
+    if _log_file is None:
+        if os.path.dirname(TRACE_LOG_PATH):
+            os.makedirs(os.path.dirname(TRACE_LOG_PATH), exist_ok=True)
+        _log_file = open(TRACE_LOG_PATH, "a", encoding="utf-8")
+    _log_file.write(json.dumps(record, default=str) + "\n")
+    _log_file.flush()
+    if _log_file.tell() >= TRACE_LOG_MAX_MB * 1024 * 1024:
+        _rotate_log()
+
+
+def _rotate_log():
+    global _log_file
+    _log_file.close()
+    _log_file = None
+    # Workers share the log: only rotate if no other process did already
+    # (a process still writing to the rotated file rotates onto the new one)
+    try:
+        if os.path.getsize(TRACE_LOG_PATH) >= TRACE_LOG_MAX_MB * 1024 * 1024:
+            os.replace(TRACE_LOG_PATH, TRACE_LOG_PATH + ".1")
+    except OSError:
+        pass
+
+
+def _record(record: Dict[str, Any]):
+    for stages in _collectors.get():
+        stages.append(record)
+
+    with _lock:
+        m = _metrics.setdefault(
+            record["stage"],
+            {"calls": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "tokens": 0, "max_wall_seconds": 0.0},
+        )
+        m["calls"] += 1
+        m["errors"] += 1 if "error" in record else 0
+        m["wall_seconds"] += record["wall_seconds"]
+        m["cpu_seconds"] += record["cpu_seconds"]
+        m["tokens"] += record.get("tokens", 0)
+        m["max_wall_seconds"] = max(m["max_wall_seconds"], record["wall_seconds"])
+        _write_log(record)
+
+
+@contextmanager
+def trace_stage(stage: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Times one pipeline stage:
+
+        with trace_stage("llm.generate", max_new_tokens=400) as record:
+            ...
+            record["tokens"] = n_generated
+
+    Records wall time, process CPU time, RSS at the end of the stage and the
+    process peak RSS so far; tokens_per_second is derived when the stage sets
+    record["tokens"]. The record goes to the JSON-lines log, the aggregated
+    metrics, and every enclosing collect_stages() list.
+    """
+    record: Dict[str, Any] = {"stage": stage, **attrs}
+    if not TRACE_ENABLED:
+        yield record
+        return
+
+    record["started_at"] = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        record["wall_seconds"] = round(wall, 4)
+        record["cpu_seconds"] = round(time.process_time() - cpu_start, 4)
+        record["rss_mb"] = round(rss_mb(), 1)
+        record["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        if record.get("tokens") and wall > 0:
+            record["tokens_per_second"] = round(record["tokens"] / wall, 2)
+        _record(record)
+
+
+@contextmanager
+def collect_stages() -> Iterator[List[Dict[str, Any]]]:
+    """
+    Collects the records of all stages traced in this context (same thread,
+    or generators consumed from it) into the yielded list. Collectors nest:
+    an inner stage is also seen by every outer collector.
+    """
+    stages: List[Dict[str, Any]] = []
+    token = _collectors.set(_collectors.get() + (stages,))
+    try:
+        yield stages
+    finally:
+        _collectors.reset(token)
+
+
+def stage_breakdown(stages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Compact per-stage view of collected records, for result dicts and the UI.
+    """
+    keys = (
+        "stage", "wall_seconds", "cpu_seconds", "tokens", "tokens_per_second", "prompt_tokens", "lore_tokens",
+        "budget_tokens", "acceptance_rate", "peak_rss_mb", "error",
+    )
+    return [{k: record[k] for k in keys if k in record} for record in stages]
+
+
+def metrics_snapshot() -> Dict[str, Dict[str, float]]:
+    """
+    Aggregated per-stage counters of this process (picklable, so workers can
+    ship them to the parent).
+    """
+    with _lock:
+        snapshot = {stage: dict(m) for stage, m in _metrics.items()}
+    return snapshot
+
+
+def prometheus_text(snapshots: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None) -> str:
+    """
+    Renders metrics in the Prometheus text exposition format.
+    snapshots maps a process label to a metrics_snapshot(); defaults to this
+    process only.
+    """
+    if snapshots is None:
+        snapshots = {str(os.getpid()): metrics_snapshot()}
+
+    series = [
+        ("rag_stage_calls_total", "counter", "Number of times the stage ran", "calls"),
+        ("rag_stage_errors_total", "counter", "Number of times the stage raised", "errors"),
+        ("rag_stage_wall_seconds_total", "counter", "Wall time spent in the stage", "wall_seconds"),
+        ("rag_stage_cpu_seconds_total", "counter", "Process CPU time spent in the stage", "cpu_seconds"),
+        ("rag_stage_tokens_total", "counter", "Tokens generated in the stage", "tokens"),
+        ("rag_stage_max_wall_seconds", "gauge", "Slowest single run of the stage", "max_wall_seconds"),
+    ]
+    lines = []
+    for name, kind, help_text, field in series:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for process, snapshot in sorted(snapshots.items()):
+            for stage, m in sorted(snapshot.items()):
+                lines.append(f'{name}{{process="{process}",stage="{stage}"}} {m[field]}')
+    lines.append("# HELP rag_process_rss_bytes Resident set size of this process")
+    lines.append("# TYPE rag_process_rss_bytes gauge")
+    lines.append(f'rag_process_rss_bytes{{process="{os.getpid()}"}} {int(rss_mb() * 1024 * 1024)}')
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port: int = METRICS_PORT, render=prometheus_text) -> Optional[ThreadingHTTPServer]:
+    """
+    Serves render() at http://0.0.0.0:<port>/metrics from a daemon thread.
+    Returns None when port is 0.
+    """
+    if not port:
+        return None
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[tracing] Serving metrics on http://0.0.0.0:{port}/metrics")
+    return server
@@ -0,0 +1,449 @@
+from typing import List, Dict, Any, Optional, Tuple
+import json
+import os
+
+import numpy as np
+
+# Which backend build_lore_index uses: "chroma", "numpy" (exact) or "ivf" (approximate)
+DEFAULT_BACKEND = os.environ.get("LORE_INDEX_BACKEND", "chroma")
+# Storage dtype of the NumPy backends' matrix: "float32" or "float16"
+DEFAULT_DTYPE = os.environ.get("LORE_INDEX_DTYPE", "float32")
+
+_chroma_client = None
+_chroma_client_dir = None
+
+def _append_rows(buffer: Optional[np.ndarray], used: int, rows: np.ndarray) -> np.ndarray:
+    """
+    Writes rows after the first `used` rows of buffer and returns the buffer.
+    When it is full, a buffer twice the size is allocated instead, so a
+    series of appends copies each row O(1) times on average.
+    """
+    needed = used + len(rows)
+    if buffer is None or len(buffer) < needed:
+        grown = np.empty((max(needed, 2 * used),) + rows.shape[1:], dtype=rows.dtype)
+        if used:
+            grown[:used] = buffer[:used]
+        buffer = grown
+    buffer[used:needed] = rows
+    return buffer
+
+def get_chroma_client(persist_dir: Optional[str] = None):
+    """
+    Returns a ChromaDB client. persist_dir=None gives an in-memory client,
+    otherwise a persistent client stored under persist_dir.
+    """
+    # Imported lazily so the NumPy backends work without chromadb installed
+    import chromadb
+
+    global _chroma_client, _chroma_client_dir
+    if _chroma_client is None or _chroma_client_dir != persist_dir:
+        if persist_dir is None:
+            _chroma_client = chromadb.Client()
+        else:
+            os.makedirs(persist_dir, exist_ok=True)
+            _chroma_client = chromadb.PersistentClient(path=persist_dir)
+        _chroma_client_dir = persist_dir
+    return _chroma_client
+
+
+class ChromaLoreStore:
+    """
+    Lore store backed by a ChromaDB collection.
+    """
+
+    def __init__(self, collection_name: str, persist_dir: Optional[str] = None, reset: bool = False):
+        client = get_chroma_client(persist_dir)
+        if reset:
+            try:
+                client.delete_collection(name=collection_name)
+            except Exception:
+                # ignore if it doesn't exist
+                pass
+        self.collection = client.get_or_create_collection(name=collection_name)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def add(self, ids: List[str], documents: List[str], embeddings: np.ndarray, metadatas: List[dict]):
+        self.collection.add(
+            ids=ids,
+            documents=documents,
+            embeddings=embeddings.tolist(),
+            metadatas=metadatas,
+        )
+
+    def delete(self, ids: List[str]):
+        self.collection.delete(ids=ids)
+
+    def get(self, ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Looks chunks up by id: [{'id', 'text', 'metadata'}], skipping unknown ids.
+        """
+        result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        found = {
+            doc_id: {"id": doc_id, "text": text, "metadata": metadata or {}}
+            for doc_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        }
+        return [found[doc_id] for doc_id in ids if doc_id in found]
+
+    def export(self) -> Tuple[List[str], List[str], List[dict], np.ndarray]:
+        """
+        Every chunk as (ids, documents, metadatas, embeddings), for snapshots.
+        """
+        result = self.collection.get(include=["documents", "metadatas", "embeddings"])
+        embeddings = np.asarray(result["embeddings"], dtype=np.float32).reshape(len(result["ids"]), -1)
+        metadatas = [metadata or {} for metadata in result["metadatas"]]
+        return list(result["ids"]), list(result["documents"]), metadatas, embeddings
+
+    def save(self):
+        # Chroma persists on write
+        pass
+
+    def query(self, query_embeddings: np.ndarray, top_k: int) -> List[List[Dict[str, Any]]]:
+        result = self.collection.query(
+            query_embeddings=np.asarray(query_embeddings).tolist(),
+            n_results=top_k,
+        )
+
+        # result is a dict with keys: 'ids', 'documents', 'distances', 'metadatas'
+        out = []
+        for i in range(len(query_embeddings)):
+            docs = (result.get("documents") or [[]])[i]
+            ids = (result.get("ids") or [[]])[i]
+            distances = (result.get("distances") or [[]])[i]
+            metadatas = (result.get("metadatas") or [[]])[i] or [{}] * len(ids)
+            out.append(
+                [
+                    {"id": doc_id, "text": doc_text, "distance": dist, "metadata": metadata or {}}
+                    for doc_id, doc_text, dist, metadata in zip(ids, docs, distances, metadatas)
+                ]
+            )
+        return out
+
+
+class NumpyLoreStore:
+    """
+    In-process exact lore store.
+
+    Normalized embeddings live in one contiguous float32 (or float16) matrix,
+    a view of a buffer that add() grows geometrically; a query is a single
+    matmul plus argpartition for the top-k. Distances are squared L2 between
+    unit vectors (2 - 2 * cosine), the same scale Chroma reports.
+    """
+
+    # Rows scored per block when the matrix is float16 (bounds the float32 copy)
+    BLOCK_ROWS = 65536
+
+    def __init__(
+        self,
+        collection_name: str,
+        persist_dir: Optional[str] = None,
+        reset: bool = False,
+        dtype: str = "float32",
+    ):
+        self.dtype = np.dtype(dtype)
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[dict] = []
+        self.matrix = None
+        # Preallocated buffer matrix is a view of (see add)
+        self._buffer = None
+        # id -> row, built on first get() after a change
+        self._row_index: Optional[Dict[str, int]] = None
+        self._prefix = os.path.join(persist_dir, collection_name) if persist_dir else None
+
+        if self._prefix and not reset:
+            self._load()
+
+    def _load(self):
+        matrix_path = self._prefix + ".embeddings.npy"
+        docs_path = self._prefix + ".docs.json"
+        if not (os.path.isfile(matrix_path) and os.path.isfile(docs_path)):
+            return
+        with open(docs_path, "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        self.ids = docs["ids"]
+        self.documents = docs["documents"]
+        self.metadatas = docs["metadatas"]
+        self.matrix = np.ascontiguousarray(np.load(matrix_path), dtype=self.dtype)
+
+    def save(self):
+        if not self._prefix:
+            return
+        os.makedirs(os.path.dirname(self._prefix), exist_ok=True)
+        matrix = self.matrix if self.matrix is not None else np.zeros((0, 0), dtype=self.dtype)
+        # np.save appends ".npy" itself, so write through an open file to keep the tmp name
+        with open(self._prefix + ".embeddings.npy.tmp", "wb") as f:
+            np.save(f, matrix)
+        with open(self._prefix + ".docs.json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f)
+        os.replace(self._prefix + ".embeddings.npy.tmp", self._prefix + ".embeddings.npy")
+        os.replace(self._prefix + ".docs.json.tmp", self._prefix + ".docs.json")
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def export(self) -> Tuple[List[str], List[str], List[dict], np.ndarray]:
+        """
+        Every chunk as (ids, documents, metadatas, unit embeddings), for snapshots.
+        """
+        matrix = self.matrix if self.matrix is not None else np.zeros((0, 0), dtype=self.dtype)
+        return self.ids, self.documents, self.metadatas, matrix
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def add(self, ids: List[str], documents: List[str], embeddings: np.ndarray, metadatas: List[dict]):
+        if not ids:
+            return
+        rows = self._normalize(embeddings).astype(self.dtype)
+        n = len(self.ids)
+        if self._buffer is not None and self.matrix is not None and self.matrix.base is self._buffer:
+            buffer = self._buffer
+        else:
+            # Loaded or compacted by delete(): the next append moves it into a buffer
+            buffer = self.matrix if n else None
+        self._buffer = _append_rows(buffer, n, rows)
+        self.matrix = self._buffer[:n + len(rows)]
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+        self._row_index = None
+
+    def delete(self, ids: List[str]):
+        drop = set(ids)
+        keep = [i for i, doc_id in enumerate(self.ids) if doc_id not in drop]
+        if len(keep) == len(self.ids):
+            return
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self.ids = [self.ids[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._row_index = None
+
+    def get(self, ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Looks chunks up by id: [{'id', 'text', 'metadata'}], skipping unknown ids.
+        """
+        if self._row_index is None:
+            self._row_index = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        rows = [self._row_index[doc_id] for doc_id in ids if doc_id in self._row_index]
+        return [{"id": self.ids[row], "text": self.documents[row], "metadata": self.metadatas[row]} for row in rows]
+
+    def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cosine scores of (n_queries, dim) unit queries against all rows (or a subset).
+        """
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+        scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), self.BLOCK_ROWS):
+            block = matrix[start:start + self.BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Indices of the top_k scores per row, best first.
+        """
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+        return np.take_along_axis(idx, order, axis=1)
+
+    def _results(self, scores: np.ndarray, idx: np.ndarray, rows: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        out = []
+        for j in idx:
+            row = int(j if rows is None else rows[j])
+            out.append(
+                {
+                    "id": self.ids[row],
+                    "text": self.documents[row],
+                    "distance": max(0.0, float(2.0 - 2.0 * scores[j])),
+                    "metadata": self.metadatas[row],
+                }
+            )
+        return out
+
+    def query(self, query_embeddings: np.ndarray, top_k: int) -> List[List[Dict[str, Any]]]:
+        queries = self._normalize(np.atleast_2d(query_embeddings))
+        if not self.ids:
+            return [[] for _ in range(len(queries))]
+        scores = self._scores(queries)
+        top = self._top_k(scores, top_k)
+        return [self._results(scores[i], top[i]) for i in range(len(queries))]
+
+
+class IVFLoreStore(NumpyLoreStore):
+    """
+    Approximate lore store: an inverted file (IVF) over the NumPy matrix.
+
+    Rows are clustered with k-means into n_lists lists; a query scores the
+    centroids, then searches exactly only inside the n_probe closest lists.
+    Below min_train_rows the store answers queries exactly. The centroids
+    are refitted whenever the store has doubled since they were trained.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        persist_dir: Optional[str] = None,
+        reset: bool = False,
+        dtype: str = "float32",
+        n_lists: int = 256,
+        n_probe: int = 8,
+        min_train_rows: int = 10000,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_rows = min_train_rows
+        self.centroids = None
+        self.assignments = None
+        self._lists = None
+        # Preallocated buffers assignments and each of _lists are views of (see add)
+        self._assign_buffer = None
+        self._list_buffers = None
+        # Rows the centroids were trained at
+        self._trained_rows = 0
+        super().__init__(collection_name, persist_dir=persist_dir, reset=reset, dtype=dtype)
+
+    def _train(self, iterations: int = 10, sample_rows: int = 100000, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        n = len(self.ids)
+        sample = rng.choice(n, size=min(n, sample_rows), replace=False)
+        data = self.matrix[sample].astype(np.float32)
+        centroids = data[rng.choice(len(data), size=min(self.n_lists, len(data)), replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = data[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = self._normalize(centroids)
+        self.centroids = centroids
+        self._trained_rows = n
+        self._assign_all()
+
+    def _assign_all(self):
+        assignments = np.empty(len(self.ids), dtype=np.int32)
+        for start in range(0, len(self.ids), self.BLOCK_ROWS):
+            block = self.matrix[start:start + self.BLOCK_ROWS].astype(np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        self.assignments = assignments
+        self._rebuild_lists()
+
+    @staticmethod
+    def _group(assignments: np.ndarray, n_lists: int) -> List[np.ndarray]:
+        """
+        Positions in assignments per list, in order.
+        """
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        return [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+
+    def _rebuild_lists(self):
+        self._assign_buffer = None
+        self._list_buffers = [rows.copy() for rows in self._group(self.assignments, len(self.centroids))]
+        self._lists = list(self._list_buffers)
+
+    def _load(self):
+        super()._load()
+        ivf_path = self._prefix + ".ivf.npz"
+        if self.ids and os.path.isfile(ivf_path):
+            data = np.load(ivf_path)
+            if len(data["assignments"]) == len(self.ids):
+                self.centroids = data["centroids"]
+                self.assignments = data["assignments"]
+                self._trained_rows = int(data["trained_rows"]) if "trained_rows" in data else len(self.ids)
+                self._rebuild_lists()
+
+    def save(self):
+        super().save()
+        if self._prefix and self.centroids is not None:
+            with open(self._prefix + ".ivf.npz.tmp", "wb") as f:
+                np.savez(f, centroids=self.centroids, assignments=self.assignments, trained_rows=self._trained_rows)
+            os.replace(self._prefix + ".ivf.npz.tmp", self._prefix + ".ivf.npz")
+
+    def add(self, ids: List[str], documents: List[str], embeddings: np.ndarray, metadatas: List[dict]):
+        if not ids:
+            return
+        n = len(self.ids)
+        super().add(ids, documents, embeddings, metadatas)
+        if self.centroids is None:
+            if len(self.ids) >= self.min_train_rows:
+                self._train()
+            return
+        if len(self.ids) >= 2 * self._trained_rows:
+            # Centroids fitted on the first half of the corpus (its first files) only
+            self._train()
+            return
+
+        # Only the new rows are assigned and appended to their lists
+        new_assign = np.argmax(self._normalize(embeddings) @ self.centroids.T, axis=1).astype(np.int32)
+        if self._assign_buffer is None or self.assignments.base is not self._assign_buffer:
+            self._assign_buffer = self.assignments
+        self._assign_buffer = _append_rows(self._assign_buffer, n, new_assign)
+        self.assignments = self._assign_buffer[:len(self.ids)]
+        for c, positions in enumerate(self._group(new_assign, len(self.centroids))):
+            if len(positions):
+                used = len(self._lists[c])
+                self._list_buffers[c] = _append_rows(self._list_buffers[c], used, positions + n)
+                self._lists[c] = self._list_buffers[c][:used + len(positions)]
+
+    def delete(self, ids: List[str]):
+        if self.centroids is None:
+            super().delete(ids)
+            return
+        drop = set(ids)
+        keep = np.array([doc_id not in drop for doc_id in self.ids])
+        super().delete(ids)
+        self.assignments = self.assignments[keep]
+        self._rebuild_lists()
+
+    def query(self, query_embeddings: np.ndarray, top_k: int) -> List[List[Dict[str, Any]]]:
+        if self.centroids is None:
+            return super().query(query_embeddings, top_k)
+
+        queries = self._normalize(np.atleast_2d(query_embeddings))
+        probe = self._top_k(queries @ self.centroids.T, self.n_probe)
+
+        out = []
+        for i, query in enumerate(queries):
+            rows = np.concatenate([self._lists[c] for c in probe[i]])
+            if len(rows) == 0:
+                out.append([])
+                continue
+            scores = self._scores(query[None, :], rows)[0]
+            top = self._top_k(scores[None, :], top_k)[0]
+            out.append(self._results(scores, top, rows))
+        return out
+
+
+_BACKENDS = {
+    "chroma": ChromaLoreStore,
+    "numpy": NumpyLoreStore,
+    "ivf": IVFLoreStore,
+}
+
+def open_lore_store(
+    backend: str,
+    collection_name: str,
+    persist_dir: Optional[str] = None,
+    reset: bool = False,
+):
+    """
+    Opens (or creates) the lore store for the given backend name.
+    """
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown lore index backend '{backend}', expected one of {sorted(_BACKENDS)}")
+    if backend == "chroma":
+        return ChromaLoreStore(collection_name, persist_dir=persist_dir, reset=reset)
+    return _BACKENDS[backend](collection_name, persist_dir=persist_dir, reset=reset, dtype=DEFAULT_DTYPE)
@@ -1,38 +1,50 @@
-import os
+import argparse
 from datetime import datetime
 
-from src.rag_index import build_lore_index
-from src.rag_prompting import rag_enrich_image_prompt
-from src.image_gen import generate_image
+from src.jobs import JobManager
+from src.model_registry import DEFAULT_PRELOAD
 
 
 def main():
-    # 1) Make sure the lore index is built
-    print("[*] Building lore index (if not already built)...")
-    build_lore_index("data/lore")
-
-    # 2) Get user prompt (for now, hardcode or simple input)
-    # You can change this to input() if you want interactive use.
-    user_prompt = input("Enter a short prompt for the scene you want: ").strip()
-    if not user_prompt:
-        print("No prompt provided, exiting.")
-        return
-
-    print("\n[*] Generating enriched image prompt using RAG + LLM...")
-    enriched_prompt = rag_enrich_image_prompt(user_prompt)
+    parser = argparse.ArgumentParser(description="Text -> Image with RAG prompt enrichment.")
+    parser.add_argument("--variants", type=int, default=1, help="Number of images to generate from the enriched prompt.")
+    parser.add_argument("--batch-size", type=int, default=None, help="Images per Stable Diffusion pass (default: all variants at once).")
+    args = parser.parse_args()
+
+    # 1) Sync the lore index (blocking), then start a worker that loads the
+    #    prompt and image models in the background while we wait for input
+    print("[*] Syncing the lore index and starting the worker (models load in the background)...")
+    preload = [name for name in DEFAULT_PRELOAD if name != "caption"]
+    with JobManager(num_workers=1, preload=preload) as jobs:
+        # 2) Get user prompt
+        user_prompt = input("Enter a short prompt for the scene you want: ").strip()
+        if not user_prompt:
+            print("No prompt provided, exiting.")
+            return
+
+        # 3) Enrich the prompt and generate image(s) in the worker
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        job_id = jobs.submit(
+            "text_to_image",
+            {
+                "prompt": user_prompt,
+                "num_variants": args.variants,
+                "batch_size": args.batch_size,
+                "filename_prefix": f"rag_image_{timestamp}",
+            },
+        )
+
+        print("\n[*] Generating enriched image prompt using RAG + LLM, then image(s) with Stable Diffusion...")
+        result = jobs.result(job_id)
+
     print("\nUser prompt:")
     print(user_prompt)
     print("\nEnriched prompt:")
-    print(enriched_prompt)
-
-    # 3) Generate image using Stable Diffusion
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"rag_image_{timestamp}.png"
-    out_path = os.path.join("outputs", "images", filename)
+    print(result["enriched_prompt"])
 
-    print("\n[*] Generating image with Stable Diffusion...")
-    saved_path = generate_image(enriched_prompt, output_path=out_path)
-    print(f"\n✅ Image saved to: {saved_path}")
+    print()
+    for saved_path in result["image_paths"]:
+        print(f"✅ Image saved to: {saved_path}")
 
 
 if __name__ == "__main__":